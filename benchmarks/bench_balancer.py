@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Compare the final clean up pass of the renderer, the streaming balance_html
+against the BeautifulSoup parse and serialization used before, on the html
+of a large rendered page.
+
+    venv/bin/python benchmarks/bench_balancer.py [--size 200]
+
+The page is built by repeating the user guide until the markdown has the
+given size in KB.
+"""
+
+import argparse
+import os
+from timeit import default_timer as timer
+
+from bs4 import BeautifulSoup
+
+import otterwiki.renderer
+from otterwiki.htmlbalancer import balance_html
+
+
+def rendered_html(size):
+    with open(
+        os.path.join(os.path.dirname(otterwiki.__file__), "help.md")
+    ) as f:
+        help_md = f.read()
+    markdown = help_md * (size * 1024 // len(help_md) + 1)
+    # the html before the final pass
+    otterwiki.renderer.balance_html = lambda html: html
+    html, _, _ = otterwiki.renderer.render.markdown(markdown)
+    otterwiki.renderer.balance_html = balance_html
+    return markdown, html
+
+
+def measure(function, html, repeat):
+    t_start = timer()
+    for _ in range(repeat):
+        function(html)
+    return (timer() - t_start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    markdown, html = rendered_html(args.size)
+    assert balance_html(html) == str(BeautifulSoup(html, "html.parser"))
+    t_markdown = measure(
+        otterwiki.renderer.render.markdown, markdown, args.repeat
+    )
+    t_soup = measure(
+        lambda html: str(BeautifulSoup(html, "html.parser")), html, args.repeat
+    )
+    t_balancer = measure(balance_html, html, args.repeat)
+
+    print(f"{len(markdown) // 1024}KB markdown, {len(html) // 1024}KB html")
+    print(f"markdown() incl. balancer: {t_markdown * 1e3:10.3f}ms")
+    print(f"BeautifulSoup:             {t_soup * 1e3:10.3f}ms")
+    print(f"balance_html:              {t_balancer * 1e3:10.3f}ms")
+    print(f"speedup:                   {t_soup / t_balancer:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Compare loading historical blobs via the `git cat-file --batch` pool used
+by GitStorage.load() with the `git show rev:path` it replaced.
+
+    venv/bin/python benchmarks/bench_catfile.py [--blobs 1000]
+
+A temporary repository with 100 files and enough revisions of each file
+is created, then every (revision, file) pair is loaded once by both
+methods.
+"""
+
+import argparse
+import tempfile
+from timeit import default_timer as timer
+
+from otterwiki.gitstorage import GitStorage
+
+AUTHOR = ("Benchmark", "benchmark@example.org")
+
+
+def create_repository(path, files, revisions):
+    storage = GitStorage(path, initialize=True)
+    for r in range(revisions):
+        for f in range(files):
+            storage.update(f"page{f}.md", f"# Page {f}\n\nRevision {r}\n" * 20)
+        storage.commit(
+            [f"page{f}.md" for f in range(files)],
+            message=f"revision {r}",
+            author=AUTHOR,
+        )
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blobs", type=int, default=1000)
+    args = parser.parse_args()
+
+    files = 100
+    revisions = max(1, args.blobs // files)
+    with tempfile.TemporaryDirectory() as path:
+        storage = create_repository(path, files, revisions)
+        blobs = [
+            (entry["revision"], f"page{f}.md")
+            for entry in storage.log()
+            for f in range(files)
+        ][: args.blobs]
+
+        t_start = timer()
+        for revision, filename in blobs:
+            storage.repo.git.show(f"{revision}:{filename}")
+        t_show = timer() - t_start
+
+        t_start = timer()
+        for revision, filename in blobs:
+            storage.load(filename, revision=revision)
+        t_catfile = timer() - t_start
+
+    print(f"loaded {len(blobs)} historical blobs")
+    print(
+        f"git show:       {t_show:8.3f}s {t_show / len(blobs) * 1e3:8.3f}ms/blob"
+    )
+    print(
+        f"cat-file pool:  {t_catfile:8.3f}s"
+        f" {t_catfile / len(blobs) * 1e3:8.3f}ms/blob"
+    )
+    print(f"speedup:        {t_show / t_catfile:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Compare path-limited history queries with and without a commit-graph with
+changed-path Bloom filters.
+
+    venv/bin/python benchmarks/bench_commitgraph.py [--commits 20000]
+
+A temporary repository with the given number of commits, each changing one
+of 1000 files, is created via `git fast-import`. Then `git log -- path` and
+`git log --follow -- path` are run for a few files, once without and once
+with the commit-graph written by GitStorage.
+"""
+
+import argparse
+import subprocess
+import tempfile
+from timeit import default_timer as timer
+
+from otterwiki.gitstorage import GitStorage
+
+FILES = 1000
+
+
+def create_repository(path, commits):
+    storage = GitStorage(path, initialize=True)
+    stream = []
+    for c in range(commits):
+        content = f"# Page {c % FILES}\n\nRevision {c}\n".encode()
+        message = f"commit {c}\n".encode()
+        stream.append(b"commit refs/heads/master\n")
+        stream.append(b"committer Benchmark <b@example.org> %d +0000\n" % c)
+        stream.append(b"data %d\n%s" % (len(message), message))
+        stream.append(b"M 100644 inline page%d.md\n" % (c % FILES))
+        stream.append(b"data %d\n%s\n" % (len(content), content))
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        cwd=path,
+        input=b"".join(stream),
+        check=True,
+    )
+    storage.repo.git.reset("--hard", "master")
+    return storage
+
+
+def measure(storage, queries):
+    t_start = timer()
+    for query in queries:
+        storage.repo.git.log("--format=%H", *query)
+    return (timer() - t_start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        storage = create_repository(path, args.commits)
+        paths = [f"page{f}.md" for f in range(0, FILES, FILES // 5)]
+        queries = {
+            "git log -- path": [["--", p] for p in paths],
+            "git log --follow -- path": [["--follow", "--", p] for p in paths],
+        }
+        before = {name: measure(storage, q) for name, q in queries.items()}
+        t_start = timer()
+        storage.commit_graph.write()
+        t_write = timer() - t_start
+        after = {name: measure(storage, q) for name, q in queries.items()}
+
+    print(f"{args.commits} commits, commit-graph written in {t_write:.3f}s")
+    for name in queries:
+        print(name)
+        print(f"  without commit-graph: {before[name] * 1e3:10.3f}ms/query")
+        print(f"  with commit-graph:    {after[name] * 1e3:10.3f}ms/query")
+        print(f"  speedup:              {before[name] / after[name]:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
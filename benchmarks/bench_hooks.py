@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Measure the rendering of a page with many links, wikilinks, images and
+headings with zero, one and five plugins implementing the render-time
+hooks, comparing the dispatch via the table of the plugin manager with
+the lookup of the implementations on every call used before. Besides the
+whole render, a single call of chain_hooks() is measured.
+
+    venv/bin/python benchmarks/bench_hooks.py [--elements 2000]
+"""
+
+import argparse
+from timeit import default_timer as timer
+
+import otterwiki.renderer
+import otterwiki.renderer_plugins
+from otterwiki.plugins import chain_hooks, hookimpl, plugin_manager
+
+
+class Identity:
+    @hookimpl
+    def renderer_process_link(
+        self, link_html, link_url, link_text, link_title, page
+    ):
+        return link_html
+
+    @hookimpl
+    def renderer_process_wikilink(
+        self, wikilink_html, wikilink_url, wikilink_text, page
+    ):
+        return wikilink_html
+
+    @hookimpl
+    def renderer_process_image(
+        self, image_html, image_src, image_alt, image_title, page
+    ):
+        return image_html
+
+    @hookimpl
+    def renderer_process_heading(
+        self, heading_html, heading_text, heading_level, heading_anchor, page
+    ):
+        return heading_html
+
+
+def lookup_chain_hooks(hook_name, value, *args, **kwargs):
+    """The dispatch before the table of the plugin manager."""
+    for impl in getattr(plugin_manager.hook, hook_name).get_hookimpls():
+        fn = getattr(impl, 'function')
+        value = fn(value, *args, **kwargs)
+    return value
+
+
+def use_chain_hooks(function):
+    otterwiki.renderer.chain_hooks = function
+    otterwiki.renderer_plugins.chain_hooks = function
+
+
+def page(elements):
+    lines = []
+    for i in range(elements // 4):
+        lines.append(f"## Section {i}\n")
+        lines.append(
+            f"See [link {i}](https://example.com/{i}), [[Page {i}]] and "
+            f"![image {i}](/img/{i}.png).\n"
+        )
+    return "\n".join(lines)
+
+
+def measure_dispatch(function, calls):
+    args = ("https://example.com/", "link", None, None)
+    t_start = timer()
+    for _ in range(calls):
+        function("renderer_process_link", "<a>link</a>", *args)
+    return (timer() - t_start) / calls
+
+
+def measure(markdown, repeat):
+    otterwiki.renderer.render.markdown(markdown)
+    t_start = timer()
+    for _ in range(repeat):
+        otterwiki.renderer.render.markdown(markdown)
+    return (timer() - t_start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--elements", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    markdown = page(args.elements)
+    print(f"{args.elements} links, wikilinks, images and headings")
+    print(
+        f"{'plugins':>8} {'render lookup':>14} {'render table':>14}"
+        f" {'call lookup':>12} {'call table':>12}"
+    )
+    registered = []
+    for count in (0, 1, 5):
+        while len(registered) < count:
+            plugin = Identity()
+            plugin_manager.register(plugin)
+            registered.append(plugin)
+        use_chain_hooks(lookup_chain_hooks)
+        t_lookup = measure(markdown, args.repeat)
+        use_chain_hooks(chain_hooks)
+        t_table = measure(markdown, args.repeat)
+        c_lookup = measure_dispatch(lookup_chain_hooks, args.elements * 50)
+        c_table = measure_dispatch(chain_hooks, args.elements * 50)
+        print(
+            f"{count:>8} {t_lookup * 1e3:12.3f}ms {t_table * 1e3:12.3f}ms"
+            f" {c_lookup * 1e9:10.0f}ns {c_table * 1e9:10.0f}ns"
+        )
+    for plugin in registered:
+        plugin_manager.unregister(plugin)
+
+
+if __name__ == "__main__":
+    main()
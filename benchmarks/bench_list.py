@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Compare GitStorage.list() answered from the tree snapshot with the os.walk
+it replaced.
+
+    venv/bin/python benchmarks/bench_list.py [--files 20000] [--calls 100]
+
+A temporary repository with the given number of files spread over 100
+directories is created, then the root and a subdirectory are listed
+repeatedly by both methods.
+"""
+
+import argparse
+import os
+import tempfile
+from timeit import default_timer as timer
+
+from otterwiki.gitstorage import GitStorage
+
+
+def create_repository(path, files):
+    storage = GitStorage(path, initialize=True)
+    for f in range(files):
+        directory = os.path.join(path, f"dir{f % 100}", f"sub{f % 7}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"page{f}.md"), "w") as fh:
+            fh.write(f"# Page {f}\n")
+    return storage
+
+
+def measure(function, calls, p):
+    t_start = timer()
+    for _ in range(calls):
+        function(p)
+    return (timer() - t_start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--calls", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        storage = create_repository(path, args.files)
+        t_start = timer()
+        storage.list()
+        t_build = timer() - t_start
+        print(f"listed {args.files} files, snapshot built in {t_build:.3f}s")
+        for p in [None, "dir42"]:
+            t_walk = measure(storage._walk, args.calls, p)
+            t_list = measure(storage.list, args.calls, p)
+            print(f"list(p={p!r})")
+            print(f"  os.walk:   {t_walk * 1e3:10.3f}ms/call")
+            print(f"  snapshot:  {t_list * 1e3:10.3f}ms/call")
+            print(f"  speedup:   {t_walk / t_list:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
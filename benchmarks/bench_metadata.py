@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Compare the blame view of a page, which needs the metadata of every commit
+that contributed a line, with the lazily computed commit files against the
+eagerly computed `commit.stats.files` used before.
+
+    venv/bin/python benchmarks/bench_metadata.py [--commits 200]
+
+A temporary repository with one page is created, every commit changes one
+line of the page and a few other files.
+"""
+
+import argparse
+import tempfile
+from timeit import default_timer as timer
+
+from otterwiki.gitstorage import GitStorage
+
+AUTHOR = ("Benchmark", "benchmark@example.org")
+LINES = 50
+
+
+def eager_metadata(commit):
+    return {
+        "revision-full": commit.hexsha,
+        "revision": commit.hexsha[0:6],
+        "datetime": commit.authored_datetime,
+        "author_name": commit.author.name,
+        "author_email": commit.author.email,
+        "message": commit.message,
+        "files": commit.stats.files,
+    }
+
+
+def create_repository(path, commits):
+    storage = GitStorage(path, initialize=True)
+    lines = [f"line {n}" for n in range(LINES)]
+    for c in range(commits):
+        lines[c % LINES] = f"line {c % LINES} changed in commit {c}"
+        storage.update("page.md", "\n".join(lines) + "\n")
+        for f in range(5):
+            storage.update(f"other{f}.md", f"commit {c}\n")
+        storage.commit(
+            ["page.md"] + [f"other{f}.md" for f in range(5)],
+            message=f"commit {c}",
+            author=AUTHOR,
+        )
+    return storage
+
+
+def measure(path, eager, views):
+    t_start = timer()
+    for _ in range(views):
+        # a fresh storage per view, the commit metadata is cached otherwise
+        storage = GitStorage(path)
+        if eager:
+            storage._get_metadata_of_commit = eager_metadata
+        storage.blame("page.md")
+    return (timer() - t_start) / views
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--views", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        create_repository(path, args.commits)
+        t_eager = measure(path, True, args.views)
+        t_lazy = measure(path, False, args.views)
+
+    print(f"blame of a page with {LINES} lines and {args.commits} commits")
+    print(f"eager commit.stats.files: {t_eager * 1e3:10.3f}ms/view")
+    print(f"lazy files:               {t_lazy * 1e3:10.3f}ms/view")
+    print(f"speedup:                  {t_eager / t_lazy:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Render the documents of the benchmark corpus (see render_corpus.py) with
+OtterwikiRenderer.markdown() and report per document the render time,
+the peak memory and the memory blocks allocated during the render.
+
+    venv/bin/python benchmarks/bench_render.py [--repeat 5]
+    venv/bin/python benchmarks/bench_render.py --save baseline.json
+    venv/bin/python benchmarks/bench_render.py --compare baseline.json
+
+The time is the median of the repeated renders. The highlighted code is
+cached between renders, the cache is cleared before every render so that
+each one does the complete work. The memory is measured with tracemalloc
+in a separate render: the peak is the maximum of the memory allocated
+during the render, the blocks are the number of memory blocks allocated
+and still held when markdown() returns, including the result.
+
+--compare prints the change against a baseline saved with --save and
+exits with 1 if a document got slower or needs more memory than the
+--threshold allows. The times are compared by their minimum, which is
+less affected by other load on the machine than the median.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tracemalloc
+from timeit import default_timer as timer
+
+import otterwiki.renderer
+from otterwiki.renderer import OtterwikiRenderer, highlight_cache
+from render_corpus import corpus
+
+
+def measure_time(renderer, markdown, repeat):
+    times = []
+    for _ in range(repeat):
+        highlight_cache.clear()
+        t_start = timer()
+        renderer.markdown(markdown)
+        times.append(timer() - t_start)
+    return statistics.median(times), min(times)
+
+
+def measure_memory(renderer, markdown):
+    highlight_cache.clear()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        result = renderer.markdown(markdown)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, "filename")
+    )
+    del result
+    return peak - start, blocks
+
+
+def run(documents, repeat):
+    renderer = OtterwikiRenderer()
+    results = {}
+    for name, markdown in documents.items():
+        # warm up: imports, compiled regular expressions, lexers
+        renderer.markdown(markdown)
+        median, minimum = measure_time(renderer, markdown, repeat)
+        peak, blocks = measure_memory(renderer, markdown)
+        results[name] = {
+            "size": len(markdown),
+            "time": median,
+            "time_min": minimum,
+            "peak": peak,
+            "blocks": blocks,
+        }
+    return results
+
+
+def print_results(results):
+    print(
+        f"{'document':<14} {'size':>8} {'time':>11} {'min':>11}"
+        f" {'peak':>10} {'blocks':>8}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<14} {r['size'] // 1024:>6}KB {r['time'] * 1e3:>9.2f}ms"
+            f" {r['time_min'] * 1e3:>9.2f}ms {r['peak'] // 1024:>8}KB"
+            f" {r['blocks']:>8}"
+        )
+
+
+def compare(results, baseline, threshold):
+    """Print the changes against `baseline`, returns the regressions."""
+    regressions = []
+    print(
+        f"{'document':<14} {'min':>11} {'change':>8}"
+        f" {'peak':>10} {'change':>8} {'blocks':>8} {'change':>8}"
+    )
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            print(f"{name:<14} not in the baseline")
+            continue
+        changes = {
+            key: (r[key] - b[key]) / b[key] if b[key] else 0.0
+            for key in ("time_min", "peak", "blocks")
+        }
+        marks = {
+            key: "!" if change > threshold else " "
+            for key, change in changes.items()
+        }
+        print(
+            f"{name:<14} {r['time_min'] * 1e3:>9.2f}ms"
+            f" {changes['time_min']:>+7.1%}{marks['time_min']}"
+            f" {r['peak'] // 1024:>8}KB"
+            f" {changes['peak']:>+7.1%}{marks['peak']}"
+            f" {r['blocks']:>8} {changes['blocks']:>+7.1%}{marks['blocks']}"
+        )
+        regressions += [
+            (name, key) for key, mark in marks.items() if mark == "!"
+        ]
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--only", action="append", help="render only this document"
+    )
+    parser.add_argument("--save", help="store the results as baseline")
+    parser.add_argument("--compare", help="compare with a stored baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="the relative change reported as regression",
+    )
+    args = parser.parse_args()
+
+    documents = corpus()
+    if args.only:
+        documents = {name: documents[name] for name in args.only}
+    results = run(documents, args.repeat)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "mistune": otterwiki.renderer.mistune.__version__,
+                    "documents": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["documents"]
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                "regressions: "
+                + ", ".join(f"{name} {key}" for name, key in regressions)
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Compare the sanitizer of inline and block html in the renderer with the
+BeautifulSoup based check used before, on the html fragments of a page
+with many <br>, <kbd> and <span> tags.
+
+    venv/bin/python benchmarks/bench_sanitizer.py [--lines 2000]
+"""
+
+import argparse
+from timeit import default_timer as timer
+
+from bs4 import BeautifulSoup
+
+import otterwiki.renderer
+from otterwiki.renderer import ALLOWED_ATTRIBUTES, ALLOWED_TAGS, escape
+
+
+def soup_clean_html(html):
+    """The check before the HtmlSanitizer, without custom allowlist."""
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup.find_all(True):
+        tag = element.name.lower()
+        if tag not in ALLOWED_TAGS:
+            return escape(html)
+        allowed_attrs = (
+            ALLOWED_ATTRIBUTES.get(tag, []) + ALLOWED_ATTRIBUTES['*']
+        )
+        for name, value in element.attrs.items():
+            if name.lower() not in allowed_attrs:
+                return escape(html)
+            if name.lower() in otterwiki.renderer.URL_ATTRIBUTES:
+                normalized = (
+                    otterwiki.renderer.normalize_url_for_protocol_check(value)
+                )
+                if normalized.startswith(
+                    otterwiki.renderer.DANGEROUS_PROTOCOLS
+                ):
+                    return escape(html)
+    return html
+
+
+def page(lines):
+    return "".join(
+        f"Press <kbd>Ctrl</kbd>+<kbd>{i}</kbd><br>"
+        f'<span class="note">note {i}</span> and <b>bold</b>\n\n'
+        for i in range(lines)
+    )
+
+
+def fragments(markdown):
+    """The html fragments the renderer sanitizes."""
+    result = []
+    md_renderer = otterwiki.renderer.render.md_renderer
+    inline_html, block_html = md_renderer.inline_html, md_renderer.block_html
+    md_renderer.inline_html = lambda html: result.append(html) or html
+    md_renderer.block_html = lambda html: result.append(html) or html
+    try:
+        otterwiki.renderer.render.markdown(markdown)
+    finally:
+        md_renderer.inline_html = inline_html
+        md_renderer.block_html = block_html
+    return result
+
+
+def measure(function, items, repeat):
+    t_start = timer()
+    for _ in range(repeat):
+        for item in items:
+            function(item)
+    return (timer() - t_start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    markdown = page(args.lines)
+    items = fragments(markdown)
+    sanitizer = otterwiki.renderer.HtmlSanitizer()
+    for item in items:
+        assert sanitizer.clean(item) == soup_clean_html(item)
+    t_soup = measure(soup_clean_html, items, args.repeat)
+    t_sanitizer = measure(sanitizer.clean, items, args.repeat)
+    t_markdown = measure(
+        otterwiki.renderer.render.markdown, [markdown], args.repeat
+    )
+
+    print(f"{len(items)} html fragments")
+    print(f"markdown() incl. sanitizer: {t_markdown * 1e3:10.3f}ms")
+    print(f"BeautifulSoup:              {t_soup * 1e3:10.3f}ms")
+    print(f"HtmlSanitizer:              {t_sanitizer * 1e3:10.3f}ms")
+    print(f"speedup:                    {t_soup / t_sanitizer:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Measure the scan of the search over generated pages on disk with a regexp
+the trigram index can not narrow down: loading the pages and matching line
+by line in one thread like before, and via the Scan, which matches whole
+pages in a thread pool.
+
+    venv/bin/python benchmarks/bench_scan.py [--pages 5000]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from timeit import default_timer as timer
+
+import regex
+
+from otterwiki.searchscan import Scan
+
+WORDS = (
+    "otter river stream fish pebble holt whisker paddle burrow current"
+    " willow reed heron kingfisher meadow bank moss stone dam beaver"
+).split()
+
+# (pattern, max_results)
+QUERIES = (
+    (r"\d{4}", 0),
+    (r"kingf\w+r", 0),
+    (r"kingf\w+r", 100),
+    (r"\bz\w+", 0),
+)
+
+
+def populate(path, pages):
+    rng = random.Random(1)
+    for i in range(pages):
+        lines = [f"# Page {i}", ""]
+        for _ in range(40):
+            lines.append(" ".join(rng.choices(WORDS, k=12)) + ".")
+        with open(os.path.join(path, f"page{i}.md"), "w") as f:
+            f.write("\n".join(lines))
+
+
+def line_by_line(path, filenames, pattern):
+    found = []
+    for filename in filenames:
+        with open(os.path.join(path, filename)) as f:
+            content = f.read()
+        if [line for line in content.splitlines() if pattern.search(line)]:
+            found.append(filename)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        populate(path, args.pages)
+        filenames = sorted(os.listdir(path))
+        pages = [
+            (filename, filename[:-3], None, os.path.join(path, filename))
+            for filename in filenames
+        ]
+        print(
+            f"{'query':>12} {'limit':>6} {'pages':>6} {'lines':>10} {'scan':>10}"
+        )
+        for query, max_results in QUERIES:
+            pattern = regex.compile("(" + query + ")", regex.IGNORECASE)
+            t_start = timer()
+            for _ in range(args.repeat):
+                found = line_by_line(path, filenames, pattern)
+            t_lines = (timer() - t_start) / args.repeat
+            t_start = timer()
+            for _ in range(args.repeat):
+                scan = Scan(pattern, pattern, max_results=max_results)
+                matches = scan.run(pages)
+            t_scan = (timer() - t_start) / args.repeat
+            if not max_results:
+                assert found == [filename for filename, _, _ in matches]
+            print(
+                f"{query:>12} {max_results:>6} {len(matches):>6}"
+                f" {t_lines * 1e3:8.1f}ms {t_scan * 1e3:8.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
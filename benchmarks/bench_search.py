@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+Measure finding the pages of a query in a generated wiki, by loading and
+matching every page like the search did before, and via the full-text
+index, which only returns the candidates to match. The time to build the
+index from scratch and its size are reported, too.
+
+    venv/bin/python benchmarks/bench_search.py [--pages 5000]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from timeit import default_timer as timer
+
+import regex
+
+from otterwiki.gitstorage import GitStorage
+from otterwiki.searchindex import SearchIndex
+
+WORDS = (
+    "otter river stream fish pebble holt whisker paddle burrow current"
+    " willow reed heron kingfisher meadow bank moss stone dam beaver"
+).split()
+
+# (query, is_regexp)
+QUERIES = (
+    ("kingfisher", False),
+    ("otter river", False),
+    ("beav", False),
+    ("lutra", False),
+    ("utr", False),
+    ("zebra", False),
+    ("lut?ra", True),
+    (r"Eura\w+ otter", True),
+    (r"\d{4}", True),
+)
+
+
+def populate(path, pages):
+    rng = random.Random(1)
+    for i in range(pages):
+        directory = os.path.join(path, f"section{i % 20}")
+        os.makedirs(directory, exist_ok=True)
+        lines = [f"# Page {i}", ""]
+        if i % 100 == 0:
+            # a word found on a few pages only
+            lines.append("Lutra lutra, the Eurasian otter.")
+        for _ in range(40):
+            lines.append(" ".join(rng.choices(WORDS, k=12)) + ".")
+        with open(os.path.join(directory, f"page{i}.md"), "w") as f:
+            f.write("\n".join(lines))
+
+
+def compile(query, is_regexp):
+    if not is_regexp:
+        query = regex.escape(query)
+    return regex.compile("(" + query + ")", regex.IGNORECASE)
+
+
+def matching(pages, needle):
+    return sorted(
+        filename
+        for filename, content in pages
+        if any(needle.search(line) for line in content.splitlines())
+    )
+
+
+def scan(storage, query, is_regexp):
+    files, _ = storage.list()
+    pages = (
+        (filename, storage.load(filename))
+        for filename in files
+        if filename.endswith(".md")
+    )
+    return matching(pages, compile(query, is_regexp))
+
+
+def search(index, query, is_regexp):
+    candidates = index.search(query, is_regexp)
+    return matching(candidates, compile(query, is_regexp)), len(candidates)
+
+
+def database_size(path):
+    directory = os.path.join(path, ".git", "otterwiki")
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for name in os.listdir(directory)
+        if name.startswith("search.sqlite3")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        populate(path, args.pages)
+        storage = GitStorage(path=path, initialize=True)
+        index = SearchIndex(storage)
+        t_start = timer()
+        index.rebuild()
+        index.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(
+            f"indexing {args.pages} pages took {timer() - t_start:.2f}s,"
+            f" {database_size(path) / 2**20:.1f}MB"
+        )
+        print(
+            f"{'query':>14} {'pages':>6} {'candidates':>10}"
+            f" {'scan':>10} {'index':>10}"
+        )
+        for query, is_regexp in QUERIES:
+            t_start = timer()
+            for _ in range(args.repeat):
+                found = scan(storage, query, is_regexp)
+            t_scan = (timer() - t_start) / args.repeat
+            t_start = timer()
+            for _ in range(args.repeat):
+                found_index, candidates = search(index, query, is_regexp)
+            t_index = (timer() - t_start) / args.repeat
+            assert found == found_index
+            print(
+                f"{query:>14} {len(found):>6} {candidates:>10}"
+                f" {t_scan * 1e3:8.1f}ms {t_index * 1e3:8.1f}ms"
+            )
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
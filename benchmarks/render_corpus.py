@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+The markdown corpus of the render benchmarks. Every document is generated
+deterministically, so that the corpus is the same in every run and on
+every machine, and covers one feature of the renderer at a size where it
+dominates the render time.
+"""
+
+import os
+
+import otterwiki
+
+LANGUAGES = ["python", "javascript", "bash", "json", "sql", "unknown", ""]
+
+
+def large_table(rows=400, columns=8):
+    lines = ["# Large table\n"]
+    lines.append("| " + " | ".join(f"Column {c}" for c in range(columns)))
+    lines.append("|" + "|".join(":---" for _ in range(columns)) + "|")
+    for r in range(rows):
+        lines.append(
+            "| "
+            + " | ".join(
+                (
+                    f"**{r}.{c}** [link](/Page{r}) `code`"
+                    if c % 3 == 0
+                    else f"cell {r}.{c} _emphasis_"
+                )
+                for c in range(columns)
+            )
+            + " |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def code_blocks(blocks=200):
+    parts = ["# Code blocks\n"]
+    for i in range(blocks):
+        language = LANGUAGES[i % len(LANGUAGES)]
+        parts.append(f"## Example {i}\n\nSome text about example {i}.\n")
+        parts.append(
+            f"```{language}\n"
+            f"def function_{i}(value):\n"
+            f"    # compute something for {i}\n"
+            f"    result = [value * n for n in range({i % 17})]\n"
+            f"    return {{'index': {i}, 'result': result}}\n"
+            "```\n"
+        )
+    return "\n".join(parts)
+
+
+def math(formulas=300):
+    parts = ["# Math\n"]
+    for i in range(formulas):
+        parts.append(
+            f"The value $x_{{{i}}} = \\frac{{a^{i}}}{{b_{i}}}$ follows from\n\n"
+            f"$$\n\\sum_{{n=0}}^{{{i}}} \\alpha_n x^n = \\int_0^{i} "
+            f"f(t)\\,dt\n$$\n"
+        )
+    return "\n".join(parts)
+
+
+def mermaid(diagrams=100):
+    parts = ["# Mermaid\n"]
+    for i in range(diagrams):
+        parts.append(
+            f"Diagram {i}:\n\n```mermaid\ngraph TD\n"
+            + "".join(f"    A{n} --> B{n}\n" for n in range(i % 12 + 2))
+            + "```\n"
+        )
+    return "\n".join(parts)
+
+
+def footnotes(notes=400):
+    text = " ".join(
+        f"Sentence {i} with a footnote[^note{i}]." for i in range(notes)
+    )
+    definitions = "\n".join(
+        f"[^note{i}]: The footnote {i} with *markdown* and a [link](/N{i})."
+        for i in range(notes)
+    )
+    return f"# Footnotes\n\n{text}\n\n{definitions}\n"
+
+
+def wikilinks(links=1500):
+    lines = ["# Wikilinks\n"]
+    for i in range(links):
+        path = "/".join(f"Level {d}" for d in range(i % 6))
+        target = f"{path}/Page {i}" if path else f"Page {i}"
+        if i % 2:
+            lines.append(f"- [[Title {i}|{target}#Section {i}]]")
+        else:
+            lines.append(f"- [[{target}]]")
+    return "\n".join(lines) + "\n"
+
+
+def fancy_blocks(blocks=200):
+    kinds = ["info", "warning", "danger", "success", "none"]
+    alerts = ["NOTE", "TIP", "IMPORTANT", "WARNING", "CAUTION"]
+    parts = ["# Blocks\n"]
+    for i in range(blocks):
+        parts.append(
+            f"::: {kinds[i % len(kinds)]}\n# Block {i}\n"
+            f"Text with **bold** and a [[Link {i}]].\n:::\n"
+        )
+        parts.append(
+            f"> [!{alerts[i % len(alerts)]}]\n> Alert {i} with `code`.\n"
+        )
+        parts.append(f">! Spoiler {i}\n>! with two lines.\n")
+        parts.append(f">| # Fold {i}\n>| Folded content {i}.\n")
+    return "\n".join(parts)
+
+
+def frontmatter(sections=300):
+    head = (
+        "---\ntitle: Frontmatter title\ntags: [benchmark, corpus]\n"
+        "date: 2025-01-01 12:00:00\n---\n\n"
+    )
+    body = "\n".join(
+        f"## Section {i}\n\nParagraph {i} with *emphasis*, **strong** and "
+        f"==marked== text, ~~deleted~~ and a [link](https://example.com/{i}).\n"
+        for i in range(sections)
+    )
+    return head + body
+
+
+def embeddings(embeddings=150):
+    parts = ["# Embeddings\n"]
+    for i in range(embeddings):
+        parts.append(
+            f"{{{{InfoBox\n|caption=Box {i}\n|key=value {i}\n"
+            f"|Homepage=[example](https://example.com/{i})\n"
+            f"Text of the box {i} with **markdown**.\n}}}}\n"
+        )
+        parts.append(
+            f"{{{{ImageFrame\n|src=https://example.com/image{i}.png\n"
+            f"|caption=Image {i}\n}}}}\n"
+        )
+        parts.append(
+            f"{{{{Video\n|src=https://example.com/video{i}.mp4\n}}}}\n"
+        )
+    return "\n".join(parts)
+
+
+def user_guide(copies=10):
+    with open(
+        os.path.join(os.path.dirname(otterwiki.__file__), "help.md")
+    ) as f:
+        return f.read() * copies
+
+
+CORPUS = {
+    "large_table": large_table,
+    "code_blocks": code_blocks,
+    "math": math,
+    "mermaid": mermaid,
+    "footnotes": footnotes,
+    "wikilinks": wikilinks,
+    "fancy_blocks": fancy_blocks,
+    "frontmatter": frontmatter,
+    "embeddings": embeddings,
+    "user_guide": user_guide,
+}
+
+
+def corpus():
+    """The documents of the corpus by name."""
+    return {name: build() for name, build in CORPUS.items()}
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+"""
+The render benchmarks of bench_render.py for pytest-benchmark:
+
+    venv/bin/pip install pytest-benchmark
+    venv/bin/pytest benchmarks/test_bench_render.py --benchmark-autosave
+    venv/bin/pytest benchmarks/test_bench_render.py --benchmark-compare
+
+The benchmarks are not part of the test suite.
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from otterwiki.renderer import OtterwikiRenderer, highlight_cache
+from render_corpus import corpus
+
+DOCUMENTS = corpus()
+
+
+@pytest.fixture(scope="module")
+def renderer():
+    return OtterwikiRenderer()
+
+
+@pytest.mark.parametrize("name", DOCUMENTS)
+def test_render(benchmark, renderer, name):
+    markdown = DOCUMENTS[name]
+    benchmark.extra_info["size"] = len(markdown)
+    html, _, _ = benchmark.pedantic(
+        renderer.markdown,
+        args=(markdown,),
+        setup=highlight_cache.clear,
+        rounds=5,
+        warmup_rounds=1,
+    )
+    assert html
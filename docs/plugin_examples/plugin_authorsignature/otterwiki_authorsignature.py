@@ -11,6 +11,7 @@ An Otter Wikis core objects: The Flask app, the database and the storage.
 Note: To make the plugin_manager find it, the class has to be registered.
 """
 
+from otterwiki.gitstorage import StorageNotFound
 from otterwiki.plugins import hookimpl, plugin_manager
 
 
@@ -24,21 +25,11 @@ class AuthorSignature:
     @hookimpl
     def page_view_htmlcontent_postprocess(self, html, page):
         if page.metadata is not None:
-            # fetch only log entries when the file was (A)dded
-            rawlog = self.storage.repo.git.log(
-                "--diff-filter=A", page.filename
-            )
-            # clean up
-            log = [
-                entry
-                for entry in rawlog.strip("\x00").split("\x00\x00")
-                if len(entry) > 0
-            ]
-            if log and len(log) > 1:
-                # pick the latest add as creation date
-                creation_metadata = self.storage._get_metadata_of_log(log[-1])
-            else:
-                # fallback in case the git log --diff-filter fails
+            try:
+                # the oldest log entry of the page is its creation
+                creation_metadata = self.storage.log(page.filename)[-1]
+            except StorageNotFound:
+                # fallback in case the page has no history
                 creation_metadata = page.metadata
             html += f"""
             <div style="margin-top: 5rem; padding-top: .5rem; border-top: 1px dashed rgba(128,128,128,0.2); color: rgba(128,128,128,0.5);" class="text-small">
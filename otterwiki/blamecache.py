@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+A persistent cache of `git blame` results.
+
+The blame of a file only depends on the content of the file (its blob SHA)
+and the history leading to the blamed commit. The cache stores it under
+this (blob, commit) pair as run-length encoded list of (commit, number of
+lines) tuples, the lines themselves are read from the blob when needed.
+
+Results that are not cached are computed with `git blame --incremental`,
+which reports the blamed line ranges as soon as they are found, so that the
+first lines can be shown before the blame of the whole file is finished.
+"""
+
+import json
+import re
+import subprocess
+from threading import Lock
+
+from otterwiki.commitindex import open_database
+
+SCHEMA_VERSION = 1
+
+# entries kept in the cache, the least recently stored are dropped first
+MAX_ENTRIES = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS blame (
+    id INTEGER PRIMARY KEY,
+    blob TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    runs TEXT NOT NULL,
+    UNIQUE (blob, revision)
+);
+"""
+
+_ENTRY_RE = re.compile(r"\A([0-9a-f]{40,64}) (\d+) (\d+) (\d+)\Z")
+
+
+class BlameError(Exception):
+    pass
+
+
+def incremental_runs(git_dir, revision, path, lines):
+    """
+    Blame `path` at `revision` with `git blame --incremental` and yield
+    (hexsha, number of lines) tuples from the first line on. A run is
+    yielded as soon as it is complete, i.e. all of its lines and the first
+    line of the next run have been blamed. `lines` is the number of lines
+    of the file.
+    """
+    process = subprocess.Popen(
+        [
+            "git",
+            f"--git-dir={git_dir}",
+            "blame",
+            "--incremental",
+            revision,
+            "--",
+            path,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    owner = [None] * lines
+    done = 0
+    run = None
+    try:
+        for raw in process.stdout:  # pyright: ignore
+            match = _ENTRY_RE.match(raw.decode("utf-8", "replace").rstrip())
+            if match is None:
+                # the commit headers and the filename lines
+                continue
+            hexsha = match.group(1)
+            final, count = int(match.group(3)), int(match.group(4))
+            owner[final - 1 : final - 1 + count] = [hexsha] * count
+            # advance over the lines blamed from the top
+            while done < lines and owner[done] is not None:
+                if run is not None and run[0] == owner[done]:
+                    run[1] += 1
+                else:
+                    if run is not None:
+                        yield tuple(run)
+                    run = [owner[done], 1]
+                done += 1
+        if process.wait() != 0 or done < lines:
+            raise BlameError(f"git blame {revision} -- {path} failed")
+        if run is not None:
+            yield tuple(run)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()  # pyright: ignore
+
+
+class BlameCache:
+    """
+    The blame results of the repository, persisted in SQLite.
+    """
+
+    def __init__(self, repo, max_entries=MAX_ENTRIES):
+        self.repo = repo
+        self.git_dir = repo.git_dir
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self.db = open_database(self.git_dir, "blame.sqlite3")
+        self.db.executescript(_SCHEMA)
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        if row is None or row[0] != str(SCHEMA_VERSION):
+            self.db.execute("DELETE FROM blame")
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value)"
+                " VALUES ('version', ?)",
+                (str(SCHEMA_VERSION),),
+            )
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def get(self, blob, revision):
+        """The cached runs of `blob` blamed at `revision`, or None."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT runs FROM blame WHERE blob = ? AND revision = ?",
+                (blob, revision),
+            ).fetchone()
+        if row is None:
+            return None
+        return [tuple(run) for run in json.loads(row[0])]
+
+    def put(self, blob, revision, runs):
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO blame (blob, revision, runs)"
+                " VALUES (?, ?, ?)",
+                (blob, revision, json.dumps(runs, separators=(",", ":"))),
+            )
+            self.db.execute(
+                "DELETE FROM blame WHERE id <= ("
+                " SELECT MAX(id) FROM blame) - ?",
+                (self.max_entries,),
+            )
+
+    def runs(self, blob, revision, path, lines):
+        """
+        Yield the runs of `path` (with the content `blob` and `lines` lines)
+        blamed at `revision`, from the cache or computed incrementally. The
+        computed runs are cached once all of them have been yielded.
+        """
+        cached = self.get(blob, revision)
+        if cached is not None:
+            yield from cached
+            return
+        runs = []
+        for run in incremental_runs(self.git_dir, revision, path, lines):
+            runs.append(run)
+            yield run
+        self.put(blob, revision, runs)
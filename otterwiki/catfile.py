@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+A pool of long-lived `git cat-file --batch` processes.
+
+Loading a historical version of a file with `git show rev:path` costs a
+fork+exec and a full repository open per call. A `git cat-file --batch`
+process reads object names from stdin and answers with the raw object, so
+one process can serve any number of requests. The pool hands out one
+process per concurrently reading thread and keeps them for reuse.
+"""
+
+import subprocess
+from contextlib import contextmanager
+from threading import Lock
+
+
+class CatFileError(Exception):
+    pass
+
+
+class CatFileNotFound(CatFileError):
+    pass
+
+
+def _is_hex(value):
+    try:
+        bytes.fromhex(value.decode("ascii"))
+    except ValueError:
+        return False
+    return True
+
+
+class CatFile:
+    """
+    A single `git cat-file --batch` (or `--batch-check`) process.
+    """
+
+    def __init__(self, git_dir, check=False):
+        self.check = check
+        self.process = subprocess.Popen(
+            [
+                "git",
+                f"--git-dir={git_dir}",
+                "cat-file",
+                "--batch-check" if check else "--batch",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()  # pyright: ignore
+                self.process.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        self.process.stdout.close()  # pyright: ignore
+
+    def query(self, name):
+        """
+        Look up the object `name`, e.g. "<revision>:<path>". Returns a tuple
+        (hexsha, type, size, data), data is None for a --batch-check process.
+        """
+        if "\n" in name:
+            # the name would be split into two requests
+            raise CatFileNotFound(name)
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None
+        request = name.encode("utf-8", "surrogateescape") + b"\n"
+        try:
+            stdin.write(request)
+            stdin.flush()
+            header = stdout.readline()
+        except (OSError, ValueError) as e:
+            raise CatFileError(f"git cat-file failed: {e}")
+        if not header.endswith(b"\n"):
+            raise CatFileError("git cat-file terminated unexpectedly")
+        fields = header.split()
+        if not fields or fields[-1] in (b"missing", b"ambiguous"):
+            # "<name> missing" or "<name> ambiguous", the name may contain
+            # spaces itself
+            raise CatFileNotFound(name)
+        if (
+            len(fields) != 3
+            or len(fields[0]) not in (40, 64)
+            or not _is_hex(fields[0])
+            or not fields[2].isdigit()
+        ):
+            raise CatFileNotFound(name)
+        hexsha, objtype, size = (
+            fields[0].decode(),
+            fields[1].decode(),
+            int(fields[2]),
+        )
+        if self.check:
+            return hexsha, objtype, size, None
+        data = stdout.read(size + 1)
+        if len(data) != size + 1:
+            raise CatFileError("git cat-file terminated unexpectedly")
+        return hexsha, objtype, size, data[:-1]
+
+
+class CatFilePool:
+    """
+    Idle CatFile processes of a repository. A thread checks out a process
+    for the duration of a request and returns it afterwards, so each thread
+    reading at the same time gets its own process.
+    """
+
+    def __init__(self, repo, max_idle=8):
+        self.repo = repo
+        self.git_dir = repo.git_dir
+        self.max_idle = max_idle
+        self._lock = Lock()
+        self._idle = {False: [], True: []}
+        self._generation = 0
+
+    @contextmanager
+    def _checkout(self, check):
+        with self._lock:
+            generation = self._generation
+            try:
+                catfile = self._idle[check].pop()
+            except IndexError:
+                catfile = None
+        if catfile is None:
+            catfile = CatFile(self.git_dir, check=check)
+        healthy = True
+        try:
+            yield catfile
+        except CatFileError as e:
+            healthy = isinstance(e, CatFileNotFound)
+            raise
+        finally:
+            with self._lock:
+                keep = (
+                    healthy
+                    and catfile.alive()
+                    and generation == self._generation
+                    and len(self._idle[check]) < self.max_idle
+                )
+                if keep:
+                    self._idle[check].append(catfile)
+            if not keep:
+                catfile.close()
+
+    def _query(self, name, check):
+        try:
+            with self._checkout(check) as catfile:
+                return catfile.query(name)
+        except CatFileNotFound:
+            raise
+        except CatFileError:
+            # the process might have died in the meantime, retry once
+            # with a fresh one
+            with self._checkout(check) as catfile:
+                return catfile.query(name)
+
+    def read(self, name):
+        """Returns (hexsha, type, size, data) of the object `name`."""
+        return self._query(name, check=False)
+
+    def info(self, name):
+        """Returns (hexsha, type, size, None) of the object `name`."""
+        return self._query(name, check=True)
+
+    def read_blob(self, revision, path):
+        """The content of the file `path` at `revision` as bytes."""
+        _, objtype, _, data = self.read(f"{revision}:{path}")
+        if objtype != "blob":
+            raise CatFileNotFound(f"{revision}:{path}")
+        return data
+
+    def close(self):
+        """
+        Terminate all idle processes. Processes that are currently checked
+        out are terminated when they are returned.
+        """
+        with self._lock:
+            self._generation += 1
+            idle = self._idle[False] + self._idle[True]
+            self._idle = {False: [], True: []}
+        for catfile in idle:
+            catfile.close()
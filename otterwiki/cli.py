@@ -15,6 +15,7 @@ import json
 import sys
 import click
 from datetime import datetime
+from timeit import default_timer as timer
 from flask import current_app, render_template
 from flask.cli import AppGroup
 
@@ -583,3 +584,72 @@ def user_list(output_json):
 
 
 app.cli.add_command(user_cli)
+
+
+@app.cli.command("search-index")
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Drop the indexes and index all pages from scratch.",
+)
+def search_index(rebuild):
+    """Build or update the full-text indexes of the pages and the history."""
+    from otterwiki.server import app_history_index, app_search_index
+
+    t_start = timer()
+    if rebuild:
+        reindexed = app_search_index.rebuild()
+        changes = app_history_index.rebuild()
+    else:
+        reindexed = app_search_index.update()
+        changes = app_history_index.update()
+    if reindexed is None:
+        click.echo(
+            "Error: SQLite has been built without FTS5, the search scans"
+            " all pages.",
+            err=True,
+        )
+        sys.exit(1)
+    click.echo(
+        f"Indexed {reindexed} of {app_search_index.count()} pages and"
+        f" {changes} of {app_history_index.count()} changes in history"
+        f" in {timer() - t_start:.2f} seconds."
+    )
+
+
+@app.cli.command("writer")
+@click.option(
+    "--socket",
+    "socket_path",
+    default=None,
+    help="The Unix socket to listen on, defaults to GIT_WRITER_SOCKET.",
+)
+def writer(socket_path):
+    """Run the writer process, which executes all changes of the repository."""
+    from otterwiki.repomgmt import get_repo_manager
+    from otterwiki.server import storage, update_app_config
+    from otterwiki.writer import WriterServer
+
+    socket_path = socket_path or app.config["GIT_WRITER_SOCKET"]
+    if not socket_path:
+        click.echo("Error: Please configure GIT_WRITER_SOCKET.", err=True)
+        sys.exit(1)
+    # this process does the writing
+    storage.disconnect_writer()
+    if app.config["GIT_GROUP_COMMIT"]:
+        storage.enable_group_commit()
+    server = WriterServer(
+        storage,
+        socket_path,
+        repo_manager=get_repo_manager(),
+        # pick up the remote settings changed in the admin interface
+        before=update_app_config,
+    )
+    click.echo(f"Writer listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        storage.disable_group_commit()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+Maintenance of the commit-graph file of the repository.
+
+The commit-graph (.git/objects/info/commit-graph) stores the parents and
+generation numbers of all commits, and with changed-path Bloom filters for
+every commit a filter of the paths it touched. Path-limited history walks
+like `git log -- path` or `git log --follow` can then skip the tree diff of
+almost every commit that did not touch the path. git only writes the file
+during maintenance, so otterwiki writes it itself after the history changed.
+"""
+
+import os
+import struct
+import time
+from datetime import datetime
+from threading import Lock, Timer
+
+import git.exc
+
+# seconds to wait after a change before the commit-graph is written, further
+# changes within this window are written in the same run.
+DEBOUNCE_DELAY = 10.0
+
+
+def _read_graph_file(filename):
+    """
+    Parse the header and the chunk table of a commit-graph file. Returns a
+    tuple (number of commits, has Bloom filters) or None if the file can
+    not be read.
+    """
+    try:
+        with open(filename, "rb") as f:
+            header = f.read(8)
+            if len(header) != 8 or header[0:4] != b"CGPH":
+                return None
+            chunks = header[6]
+            table = f.read(12 * (chunks + 1))
+            offsets = {}
+            for i in range(chunks):
+                chunk_id, offset = struct.unpack_from(">4sQ", table, 12 * i)
+                offsets[chunk_id] = offset
+            if b"OIDF" not in offsets:
+                return None
+            # the last entry of the fanout table is the number of commits
+            f.seek(offsets[b"OIDF"] + 255 * 4)
+            (commits,) = struct.unpack(">I", f.read(4))
+    except (OSError, struct.error):
+        return None
+    return commits, b"BIDX" in offsets and b"BDAT" in offsets
+
+
+class CommitGraph:
+    """
+    Writes the commit-graph of `repo` with changed-path Bloom filters in a
+    background thread. Calls to schedule() are debounced, so that a burst of
+    commits results in a single write.
+    """
+
+    def __init__(self, repo, delay=DEBOUNCE_DELAY):
+        self.repo = repo
+        self.delay = delay
+        self._lock = Lock()
+        self._timer = None
+        self._running = False
+        self._rerun = False
+        self.last_written = None
+        self.last_duration = None
+        self.last_error = None
+
+    @property
+    def info_directory(self):
+        return os.path.join(self.repo.common_dir, "objects", "info")
+
+    def graph_files(self):
+        """The files the commit-graph consists of, base layer first."""
+        single = os.path.join(self.info_directory, "commit-graph")
+        chain = os.path.join(
+            self.info_directory, "commit-graphs", "commit-graph-chain"
+        )
+        try:
+            with open(chain) as f:
+                hashes = f.read().split()
+        except OSError:
+            return [single] if os.path.exists(single) else []
+        return [
+            os.path.join(
+                self.info_directory, "commit-graphs", f"graph-{h}.graph"
+            )
+            for h in hashes
+        ]
+
+    def write(self):
+        """
+        Write the commit-graph now. A new layer with the commits that are not
+        yet part of the graph is added, git merges the layers when they grow.
+        """
+        t_start = time.monotonic()
+        try:
+            self.repo.git.commit_graph(
+                "write", "--reachable", "--changed-paths", "--split"
+            )
+        except git.exc.GitCommandError as e:
+            self.last_error = str(e)
+            return False
+        self.last_error = None
+        self.last_written = datetime.now()
+        self.last_duration = time.monotonic() - t_start
+        return True
+
+    def schedule(self):
+        """Write the commit-graph in the background after `delay` seconds."""
+        with self._lock:
+            if self._running:
+                self._rerun = True
+                return
+            if self._timer is not None:
+                return
+            self._timer = Timer(self.delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+            self._running = True
+        try:
+            self.write()
+        except Exception as e:
+            self.last_error = str(e)
+        finally:
+            with self._lock:
+                self._running = False
+                rerun, self._rerun = self._rerun, False
+            if rerun:
+                self.schedule()
+
+    def cancel(self):
+        """Drop a scheduled write."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def status(self):
+        """A summary of the commit-graph for the admin interface."""
+        files = self.graph_files()
+        layers = [_read_graph_file(f) for f in files]
+        valid = [layer for layer in layers if layer is not None]
+        size, mtime = 0, None
+        for f in files:
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            size += st.st_size
+            mtime = max(mtime or 0, st.st_mtime)
+        with self._lock:
+            pending = self._timer is not None or self._rerun
+            running = self._running
+        return {
+            "exists": len(valid) > 0,
+            "layers": len(valid),
+            "commits": sum(commits for commits, _ in valid),
+            "bloom_filters": len(valid) > 0
+            and all(bloom for _, bloom in valid),
+            "size": size,
+            "modified": datetime.fromtimestamp(mtime) if mtime else None,
+            "pending": pending,
+            "running": running,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+        }
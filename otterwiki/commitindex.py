@@ -0,0 +1,541 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+A persistent index of the commit metadata of a git repository.
+
+The index maps every commit to its author, date, message and the files it
+changed, and every path to the ordered list of commits that touched it. It
+is stored in a SQLite database inside the .git directory and is caught up
+incrementally from the last indexed HEAD, so that GitStorage can answer
+log() and metadata() queries without spawning git.
+"""
+
+import os
+import sqlite3
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+import git
+import git.exc
+
+# bump this whenever the schema or the way the data is parsed changes,
+# the index is rebuilt from scratch if the stored version differs.
+SCHEMA_VERSION = 1
+
+# record and field separators used in the --format of git log
+_RS = "\x1e"
+_FS = "\x1f"
+
+_LOG_FORMAT = (
+    "%x1e" + "%x1f".join(["%H", "%P", "%an", "%ae", "%ad", "%B"]) + "%x1f"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS commits (
+    seq INTEGER PRIMARY KEY,
+    hexsha TEXT NOT NULL UNIQUE,
+    parents TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    author_email TEXT NOT NULL,
+    authored_date INTEGER NOT NULL,
+    authored_tz INTEGER NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    old_path TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_seq ON changes (seq);
+CREATE INDEX IF NOT EXISTS changes_path ON changes (path, seq);
+CREATE INDEX IF NOT EXISTS changes_old_path ON changes (old_path, seq);
+CREATE INDEX IF NOT EXISTS changes_renames ON changes (path, seq)
+    WHERE status = 'R';
+"""
+
+
+def index_directory(git_dir):
+    """
+    The directory otterwiki keeps its repository indexes in. It lives inside
+    the .git directory so it never shows up in the working tree.
+    """
+    return os.path.join(git_dir, "otterwiki")
+
+
+def open_database(git_dir, filename):
+    """
+    Open the SQLite database `filename` in the index directory. If that is
+    not possible, e.g. in a read-only repository, the database is kept in
+    memory.
+    """
+    try:
+        directory = index_directory(git_dir)
+        os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(
+            os.path.join(directory, filename),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        # the indexes can always be rebuilt, durability is not a concern
+        db.execute("PRAGMA synchronous=NORMAL")
+    except (OSError, sqlite3.Error):
+        db = sqlite3.connect(
+            ":memory:", check_same_thread=False, isolation_level=None
+        )
+    return db
+
+
+def _parse_tz(offset):
+    """Turn a git timezone offset like +0200 into seconds."""
+    sign = -1 if offset.startswith("-") else 1
+    offset = offset.lstrip("+-")
+    return sign * (int(offset[0:2]) * 3600 + int(offset[2:4]) * 60)
+
+
+def parse_log(rawlog):
+    """
+    Parse the output of `git log --name-status -z --date=raw` in the
+    _LOG_FORMAT into a list of (commit, changes) tuples, newest first.
+    """
+    result = []
+    for record in rawlog.split(_RS):
+        if not record:
+            continue
+        hexsha, parents, name, email, date, rest = record.split(_FS, 5)
+        # the message is terminated by a _FS, followed by the -z separated
+        # name-status list. A commit message can not contain NUL.
+        message, _, status = rest.partition(_FS + "\x00")
+        message = message.removesuffix(_FS)
+        timestamp, tz = date.split(" ")
+        commit = (
+            hexsha,
+            parents,
+            name,
+            email,
+            int(timestamp),
+            _parse_tz(tz),
+            message,
+        )
+        changes = []
+        fields = status.strip("\x00\n").split("\x00")
+        i = 0
+        while i < len(fields):
+            code = fields[i]
+            if not code:
+                i += 1
+                continue
+            if code[0] in "RC":
+                # renames and copies list the source and the target
+                changes.append((fields[i + 2], code[0], fields[i + 1]))
+                i += 3
+            else:
+                changes.append((fields[i + 1], code[0], None))
+                i += 2
+        result.append((commit, changes))
+    return result
+
+
+def _prefix_range(path):
+    """Paths below the directory `path` sort between these two strings."""
+    return path + "/", path + "0"
+
+
+class RevisionArray:
+    """
+    The sorted binary SHAs of all commits, packed into a single bytes
+    object of 20 bytes per commit, so that a revision prefix can be
+    resolved with a bisect.
+    """
+
+    SIZE = 20
+
+    def __init__(self, data=b""):
+        self.data = data
+
+    @classmethod
+    def from_hexshas(cls, hexshas):
+        return cls(b"".join(sorted(bytes.fromhex(h) for h in hexshas)))
+
+    def __len__(self):
+        return len(self.data) // self.SIZE
+
+    def __getitem__(self, i):
+        return self.data[i * self.SIZE : (i + 1) * self.SIZE]
+
+    def merge(self, hexshas):
+        """A new RevisionArray with `hexshas` added."""
+        shas = sorted(bytes.fromhex(h) for h in hexshas)
+        if not shas:
+            return self
+        parts, start = [], 0
+        for sha in shas:
+            i = bisect_left(self, sha)
+            parts.append(self.data[start * self.SIZE : i * self.SIZE])
+            parts.append(sha)
+            start = i
+        parts.append(self.data[start * self.SIZE :])
+        return RevisionArray(b"".join(parts))
+
+    def resolve(self, prefix):
+        """All hexshas starting with the hex string `prefix`."""
+        prefix = prefix.lower()
+        try:
+            # the smallest sha with this prefix
+            low = bytes.fromhex(prefix.ljust(2 * self.SIZE, "0"))
+        except ValueError:
+            return []
+        result = []
+        for i in range(bisect_left(self, low), len(self)):
+            hexsha = self[i].hex()
+            if not hexsha.startswith(prefix):
+                break
+            result.append(hexsha)
+        return result
+
+
+class CommitIndex:
+    """
+    The commit metadata of the repository, persisted in SQLite.
+
+    Commits are numbered by `seq` in log order: a higher number means the
+    commit is listed earlier by `git log`. New commits are appended on top
+    when the index catches up with HEAD.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.git_dir = repo.git_dir
+        self._lock = Lock()
+        self._head = None
+        self._revisions = None
+        self.db = self._connect()
+
+    def _connect(self):
+        db = open_database(self.git_dir, "commits.sqlite3")
+        db.executescript(_SCHEMA)
+        if self._get_meta(db, "version") != str(SCHEMA_VERSION):
+            self._clear(db)
+            self._set_meta(db, "version", str(SCHEMA_VERSION))
+        return db
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    @staticmethod
+    def _get_meta(db, key):
+        row = db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_meta(db, key, value):
+        db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+
+    @staticmethod
+    def _clear(db):
+        db.execute("DELETE FROM changes")
+        db.execute("DELETE FROM commits")
+        db.execute("DELETE FROM meta WHERE key = 'head'")
+
+    def head(self):
+        """
+        The hexsha HEAD points to, or None in an empty repository. The refs
+        are resolved by reading the files in .git, no git process is spawned.
+        """
+        try:
+            return git.refs.SymbolicReference.dereference_recursive(
+                self.repo, "HEAD"
+            )
+        except (ValueError, OSError):
+            return None
+
+    def update(self):
+        """
+        Catch up with HEAD. Only the commits added since the last indexed
+        HEAD are read, unless HEAD moved to a commit that does not descend
+        from it (e.g. after a hard reset), then the index is rebuilt.
+        """
+        head = self.head()
+        with self._lock:
+            if head is not None and head == self._head:
+                return
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                indexed = self._get_meta(self.db, "head")
+                added = None
+                if indexed != head:
+                    added = self._catch_up(indexed, head)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            if added is None:
+                # rebuilt from scratch or changed by another process
+                self._revisions = None
+            elif self._revisions is not None:
+                self._revisions = self._revisions.merge(added)
+            self._head = head
+
+    def _read_log(self, rev_range):
+        try:
+            rawlog = self.repo.git.log(
+                "--name-status",
+                "-z",
+                "-M",
+                "--date=raw",
+                f"--format={_LOG_FORMAT}",
+                rev_range,
+            )
+        except git.exc.GitCommandError:
+            return None
+        return parse_log(rawlog)
+
+    def _catch_up(self, indexed, head):
+        """
+        Index the commits up to `head`. Returns the hexshas of the commits
+        added on top of the index, None if it was rebuilt from scratch.
+        """
+        if head is None:
+            self._clear(self.db)
+            return None
+        entries = None
+        if indexed is not None:
+            entries = self._read_log(f"{indexed}..{head}")
+            # usually HEAD simply moved on from the indexed head, which is
+            # then the parent of one of the new commits. Otherwise ask git
+            # if the indexed head is still part of the history.
+            if entries is not None and not any(
+                indexed in commit[1].split() for commit, _ in entries
+            ):
+                try:
+                    self.repo.git.merge_base("--is-ancestor", indexed, head)
+                except git.exc.GitCommandError:
+                    entries = None
+        rebuilt = entries is None
+        if rebuilt:
+            self._clear(self.db)
+            entries = self._read_log(head) or []
+        (top,) = self.db.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM commits"
+        ).fetchone()
+        seq = top + len(entries)
+        for commit, changes in entries:
+            self.db.execute(
+                "INSERT INTO commits (seq, hexsha, parents, author_name,"
+                " author_email, authored_date, authored_tz, message)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (seq,) + commit,
+            )
+            self.db.executemany(
+                "INSERT INTO changes (seq, path, status, old_path)"
+                " VALUES (?, ?, ?, ?)",
+                [(seq,) + change for change in changes],
+            )
+            seq -= 1
+        self._set_meta(self.db, "head", head)
+        return None if rebuilt else [commit[0] for commit, _ in entries]
+
+    def _query(self, sql, args=()):
+        self.update()
+        with self._lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def resolve(self, prefix):
+        """
+        The full hexshas of all indexed commits starting with `prefix`,
+        newest first. Usually there is at most one.
+        """
+        self.update()
+        with self._lock:
+            if self._revisions is None:
+                self._revisions = RevisionArray.from_hexshas(
+                    row[0]
+                    for row in self.db.execute("SELECT hexsha FROM commits")
+                )
+            revisions = self._revisions
+        hexshas = revisions.resolve(prefix)
+        if len(hexshas) > 1:
+            rows = self._query(
+                "SELECT hexsha FROM commits WHERE hexsha IN ({})"
+                " ORDER BY seq DESC".format(",".join("?" * len(hexshas))),
+                hexshas,
+            )
+            hexshas = [row[0] for row in rows]
+        return hexshas
+
+    def get(self, hexsha):
+        """The metadata of the commit `hexsha`, None if it is not indexed."""
+        rows = self._query("SELECT * FROM commits WHERE hexsha = ?", (hexsha,))
+        if not rows:
+            return None
+        with self._lock:
+            files = self._files([rows[0][0]])
+        return self.metadata(rows[0], files[rows[0][0]])
+
+    def _files(self, seqs):
+        files = {seq: [] for seq in seqs}
+        for i in range(0, len(seqs), 500):
+            chunk = seqs[i : i + 500]
+            for seq, path in self.db.execute(
+                "SELECT seq, path FROM changes WHERE seq IN ({})"
+                " ORDER BY rowid".format(",".join("?" * len(chunk))),
+                chunk,
+            ):
+                files[seq].append(path)
+        return files
+
+    @staticmethod
+    def metadata(row, files):
+        seq, hexsha, _, name, email, date, tz, message = row
+        return {
+            "revision-full": hexsha,
+            "revision": hexsha[0:6],
+            "datetime": datetime.fromtimestamp(
+                date, timezone(timedelta(seconds=tz))
+            ),
+            "author_name": name,
+            "author_email": email,
+            "message": message,
+            "files": files,
+        }
+
+    def _path_condition(self, path, column="path"):
+        start, end = _prefix_range(path)
+        return (
+            f"({column} = ? OR ({column} >= ? AND {column} < ?))",
+            [path, start, end],
+        )
+
+    def log(self, max_count=None):
+        """All commits, newest first."""
+        sql = "SELECT * FROM commits ORDER BY seq DESC"
+        args = []
+        if max_count:
+            sql += " LIMIT ?"
+            args.append(max_count)
+        rows = self._query(sql, args)
+        with self._lock:
+            files = self._files([row[0] for row in rows])
+        return [self.metadata(row, files[row[0]]) for row in rows]
+
+    def _touching(self, path, below=None):
+        """
+        The commits touching `path` (or anything below it) with a seq lower
+        than `below` as (row, status, old_path) tuples, newest first.
+        """
+        cond_path, args_path = self._path_condition(path, "changes.path")
+        cond_old, args_old = self._path_condition(path, "changes.old_path")
+        sql = (
+            "SELECT commits.*, changes.path, changes.status, changes.old_path"
+            " FROM changes JOIN commits ON changes.seq = commits.seq"
+            f" WHERE ({cond_path} OR {cond_old})"
+        )
+        args = args_path + args_old
+        if below is not None:
+            sql += " AND changes.seq < ?"
+            args.append(below)
+        sql += " ORDER BY changes.seq DESC"
+        return self._query(sql, args)
+
+    def log_path(self, path, follow=True, max_count=None):
+        """
+        The commits touching `path`, newest first. With `follow` the history
+        is continued beyond renames, like `git log --follow`. The files of
+        each entry are the name the path had in that commit.
+        """
+        result = []
+        seen = set()
+        below = None
+        while True:
+            renamed_from = None
+            for row in self._touching(path, below):
+                seq = row[0]
+                if seq in seen:
+                    continue
+                seen.add(seq)
+                result.append(self.metadata(row[:8], [path]))
+                if max_count and len(result) >= max_count:
+                    return result
+                changed_path, status, old_path = row[8:]
+                if follow and status == "R" and changed_path == path:
+                    renamed_from = (old_path, seq)
+                    break
+            if renamed_from is None:
+                return result
+            path, below = renamed_from
+
+    def renamed_from(self, path, above, below=None):
+        """
+        The newest rename of a file to `path` in a commit with a seq between
+        `above` and `below` as tuple (seq, old_path), None if there is none.
+        """
+        sql = (
+            "SELECT seq, old_path FROM changes"
+            " WHERE path = ? AND status = 'R' AND seq > ?"
+        )
+        args = [path, above]
+        if below is not None:
+            sql += " AND seq < ?"
+            args.append(below)
+        sql += " ORDER BY seq DESC LIMIT 1"
+        rows = self._query(sql, args)
+        return rows[0] if rows else None
+
+    def filename_at(self, path, hexsha):
+        """
+        The name the file currently called `path` had in the commit `hexsha`,
+        found by undoing all renames since then. None if the commit is not
+        indexed.
+        """
+        rows = self._query(
+            "SELECT seq FROM commits WHERE hexsha = ?", (hexsha,)
+        )
+        if not rows:
+            return None
+        target = rows[0][0]
+        below = None
+        while True:
+            rename = self.renamed_from(path, target, below)
+            if rename is None:
+                return path
+            below, path = rename
+
+    def last(self, path, revision=None):
+        """
+        The metadata of the last commit touching `path`, or of the commit
+        touching `path` whose hexsha starts with `revision`. None if there
+        is no such commit.
+        """
+        cond_path, args_path = self._path_condition(path, "changes.path")
+        cond_old, args_old = self._path_condition(path, "changes.old_path")
+        sql = (
+            "SELECT DISTINCT commits.* FROM changes"
+            " JOIN commits ON changes.seq = commits.seq"
+            f" WHERE ({cond_path} OR {cond_old})"
+        )
+        args = args_path + args_old
+        if revision is not None:
+            revision = revision.lower()
+            sql += " AND commits.hexsha >= ? AND commits.hexsha < ?"
+            args += [revision, revision + "g"]
+        sql += " ORDER BY commits.seq DESC LIMIT 1"
+        rows = self._query(sql, args)
+        if not rows:
+            return None
+        with self._lock:
+            files = self._files([rows[0][0]])
+        return self.metadata(rows[0], files[rows[0][0]])
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+The metadata of a single commit, as returned by GitStorage.
+
+The list of files a commit changed requires a diff of the commit against
+its parent, which is by far the most expensive part of the metadata and
+not needed by most callers. CommitMetadata therefore only computes it when
+`files` is read, and load_files() computes it for many commits with a
+single git process.
+"""
+
+import subprocess
+from collections.abc import Mapping
+
+import git
+
+
+class CommitMetadata(Mapping):
+    """
+    A read-only mapping with the keys revision-full, revision, datetime,
+    author_name, author_email, message and files. The values are also
+    available as attributes.
+    """
+
+    __slots__ = (
+        "repo",
+        "hexsha",
+        "datetime",
+        "author_name",
+        "author_email",
+        "message",
+        "_files",
+        "_stats",
+        "_batch",
+    )
+
+    KEYS = (
+        "revision-full",
+        "revision",
+        "datetime",
+        "author_name",
+        "author_email",
+        "message",
+        "files",
+    )
+
+    def __init__(self, repo, commit):
+        self.repo = repo
+        self.hexsha = commit.hexsha
+        self.datetime = commit.authored_datetime
+        self.author_name = commit.author.name
+        self.author_email = commit.author.email
+        self.message = commit.message
+        # this is a workaround
+        if self.author_email is None:
+            self.author_name = self.author_name.replace("<>", "").strip()
+        self._files = None
+        self._stats = None
+        self._batch = None
+
+    @property
+    def revision(self):
+        return self.hexsha[0:6]
+
+    @property
+    def files(self):
+        """The paths changed by the commit, compared to its first parent."""
+        if self._files is None:
+            self.load_files(self.repo, self._batch or [self])
+        return self._files
+
+    @property
+    def stats(self):
+        """The insertions, deletions and lines changed per file."""
+        if self._stats is None:
+            self._stats = git.Commit(
+                self.repo, bytes.fromhex(self.hexsha)
+            ).stats.files
+        return self._stats
+
+    @staticmethod
+    def batch(metadatas):
+        """
+        Group `metadatas`, e.g. the entries of a log: the first access to
+        the files of one of them computes the files of all of them.
+        """
+        metadatas = list(metadatas)
+        for metadata in metadatas:
+            metadata._batch = metadatas
+        return metadatas
+
+    @staticmethod
+    def load_files(repo, metadatas):
+        """
+        Compute the files of all `metadatas` that do not know them yet via
+        a single `git diff-tree --stdin`.
+        """
+        pending = {m.hexsha: m for m in metadatas if m._files is None}
+        if not pending:
+            return
+        for metadata in pending.values():
+            metadata._files = []
+        process = subprocess.run(
+            [
+                "git",
+                f"--git-dir={repo.git_dir}",
+                "diff-tree",
+                "--stdin",
+                "--root",
+                "-r",
+                "--name-only",
+                "-z",
+            ],
+            input=("\n".join(pending) + "\n").encode(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        if process.returncode != 0:
+            return
+        output = process.stdout.decode("utf-8", "replace")
+        # every commit is introduced by its hexsha, followed by the paths.
+        # Merge commits and commits without changes print nothing.
+        current = None
+        for token in output.split("\x00"):
+            if not token:
+                continue
+            if token in pending:
+                current = pending[token]
+            elif current is not None:
+                current._files.append(token)
+
+    def __getitem__(self, key):
+        if key == "revision-full":
+            return self.hexsha
+        if key in self.KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"<CommitMetadata {self.hexsha}>"
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+The generation number of the repository.
+
+Every change of the repository made through GitStorage, in any process,
+increments the generation number. It is kept in a small file in the index
+directory, so reading it is a single read() and processes can compare it
+with the generation they last saw to notice that their caches are stale.
+"""
+
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the increments are not atomic there
+    fcntl = None
+
+from otterwiki.commitindex import index_directory
+
+
+class Generation:
+    """The generation counter of the repository in `git_dir`."""
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.filename = os.path.join(index_directory(git_dir), "generation")
+
+    def read(self):
+        """The current generation, 0 if the repository was never changed."""
+        try:
+            with open(self.filename, "rb") as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self):
+        """Increment the generation and return the new value."""
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(self.filename + ".lock", "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                generation = self.read() + 1
+                # readers never see a partially written file
+                tmpname = f"{self.filename}.{os.getpid()}"
+                with open(tmpname, "w") as f:
+                    f.write(str(generation))
+                os.replace(tmpname, self.filename)
+        except OSError:
+            # e.g. a read-only repository
+            return self.read()
+        return generation
@@ -1,15 +1,23 @@
 #!/usr/bin/env python
 # vim: set et ts=8 sts=4 sw=4 ai:
 
+import functools
 import os
 import pathlib
 import re
 from datetime import datetime
-from typing import List, cast
+from threading import RLock
 
 import git
 import git.exc
 
+from otterwiki.blamecache import BlameCache, BlameError
+from otterwiki.catfile import CatFileError, CatFilePool
+from otterwiki.commitgraph import CommitGraph
+from otterwiki.commitindex import CommitIndex
+from otterwiki.commitmetadata import CommitMetadata
+from otterwiki.generation import Generation
+from otterwiki.treesnapshot import TreeSnapshot
 from otterwiki.util import split_path, ttl_lru_cache
 from otterwiki.repomgmt import get_repo_manager
 from otterwiki.plugins import plugin_manager
@@ -38,6 +46,21 @@ except NameError:
 _REVISION_RE = re.compile(r"\A(?:HEAD|[0-9a-fA-F]{4,64})\Z")
 
 
+def _writer_operation(method):
+    """
+    Send the call to the writer process, if the storage is connected to
+    one. See writer.py.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.writer is not None:
+            return self.writer.call(method.__name__, *args, **kwargs)
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class GitStorage(object):
     def __init__(self, path, initialize=False):
         # make path absolute
@@ -45,6 +68,18 @@ class GitStorage(object):
         if initialize:
             self.repo = git.Repo.init(self.path)
         self.repo = self._read_repo()
+        self._commit_index = None
+        self._cat_file = None
+        self._tree = None
+        self._commit_graph = None
+        self._blame_cache = None
+        # serializes the writes to the git index of this process
+        self._write_lock = RLock()
+        self._group_commit = None
+        # the WriterClient, if the writes are done by a writer process
+        self.writer = None
+        self._generation = None
+        self._seen_generation = self.generation
 
     def _read_repo(self):
         try:
@@ -60,6 +95,106 @@ class GitStorage(object):
         if os.path.exists(os.path.join(self.path, ".git/RELOAD_GIT")):
             os.remove(os.path.join(self.path, ".git/RELOAD_GIT"))
             self.repo = self._read_repo()
+            if self._cat_file is not None:
+                self._cat_file.close()
+        # another process changed the repository
+        generation = self.generation
+        if generation != self._seen_generation:
+            self._seen_generation = generation
+            self.tree.expire()
+
+    @property
+    def _generation_counter(self):
+        if (
+            self._generation is None
+            or self._generation.git_dir != self.repo.git_dir
+        ):
+            self._generation = Generation(self.repo.git_dir)
+        return self._generation
+
+    @property
+    def generation(self):
+        """
+        The generation number of the repository, incremented by every change
+        made through a GitStorage in any process. Cheap to read, compare it
+        with a remembered value to find out if cached data might be stale.
+        """
+        return self._generation_counter.read()
+
+    def _bump_generation(self):
+        generation = self._generation_counter.bump()
+        # unless another process changed the repository in the meantime
+        if generation == self._seen_generation + 1:
+            self._seen_generation = generation
+        return generation
+
+    @property
+    def commit_index(self):
+        """
+        The CommitIndex of the repository, reopened whenever the repository
+        has been reloaded.
+        """
+        if (
+            self._commit_index is None
+            or self._commit_index.repo is not self.repo
+        ):
+            if self._commit_index is not None:
+                self._commit_index.close()
+            self._commit_index = CommitIndex(self.repo)
+        return self._commit_index
+
+    @property
+    def cat_file(self):
+        """
+        The pool of `git cat-file --batch` processes used to read objects
+        from the repository.
+        """
+        if self._cat_file is None or self._cat_file.repo is not self.repo:
+            if self._cat_file is not None:
+                self._cat_file.close()
+            self._cat_file = CatFilePool(self.repo)
+        return self._cat_file
+
+    @property
+    def blame_cache(self):
+        """The persistent BlameCache of the repository."""
+        if (
+            self._blame_cache is None
+            or self._blame_cache.repo is not self.repo
+        ):
+            if self._blame_cache is not None:
+                self._blame_cache.close()
+            self._blame_cache = BlameCache(self.repo)
+        return self._blame_cache
+
+    @property
+    def commit_graph(self):
+        """
+        The CommitGraph maintaining the commit-graph file with changed-path
+        Bloom filters, which speeds up path-limited history queries.
+        """
+        if (
+            self._commit_graph is None
+            or self._commit_graph.repo is not self.repo
+        ):
+            if self._commit_graph is not None:
+                self._commit_graph.cancel()
+            self._commit_graph = CommitGraph(self.repo)
+        return self._commit_graph
+
+    @property
+    def tree(self):
+        """
+        The TreeSnapshot of the working tree, used to answer list() without
+        walking the filesystem.
+        """
+        if (
+            self._tree is None
+            or self._tree.repo is not self.repo
+            or self._tree.path != self.path
+        ):
+            self._tree = TreeSnapshot(self.repo, self.path)
+        return self._tree
 
     def _validate_revision(self, revision):
         """
@@ -84,6 +219,10 @@ class GitStorage(object):
         This method detects what files changed in the last commit.
         """
         try:
+            self.tree.invalidate()
+            self.commit_index.update()
+            self.commit_graph.schedule()
+            self._bump_generation()
             last_commit = self.repo.head.commit
             changed_files = list(last_commit.stats.files.keys())
             if changed_files:
@@ -112,6 +251,9 @@ class GitStorage(object):
         """
         Get the filesize in bytes
         """
+        stat = self.tree.stat(filename)
+        if stat is not None:
+            return stat[0]
         return os.path.getsize(os.path.join(self.path, filename))
 
     def isdir(self, dirname):
@@ -125,22 +267,16 @@ class GitStorage(object):
         if revision is not None:
             self._validate_revision(revision)
             try:
-                content = self.repo.git.show(
-                    "{}:{}".format(revision, filename)
-                )
-                if mode == "rb":
-                    content = content.encode("utf8", "surrogateescape")
-                else:
-                    # git show uses surrogateescape for non-UTF-8 bytes,
-                    # which produces surrogate characters that cannot be
-                    # encoded back to UTF-8. Detect this early.
-                    content.encode("utf8")
-            except git.exc.GitCommandError:
+                content = self.cat_file.read_blob(revision, filename)
+            except CatFileError:
                 raise StorageNotFound
-            except (UnicodeDecodeError, UnicodeEncodeError):
-                raise StorageErrorEncoding(
-                    "{} could not be decoded as text.".format(filename)
-                )
+            if mode != "rb":
+                try:
+                    content = content.decode("utf8")
+                except UnicodeDecodeError:
+                    raise StorageErrorEncoding(
+                        "{} could not be decoded as text.".format(filename)
+                    )
             return content
         try:
             with open(os.path.join(self.path, filename), mode=mode) as f:
@@ -155,179 +291,143 @@ class GitStorage(object):
 
     @ttl_lru_cache(maxsize=128, ttl=60)
     def _get_metadata_of_commit(self, commit):
-        metadata = {
-            "revision-full": commit.hexsha,
-            "revision": commit.hexsha[
-                0:6
-            ],  # FIXME: Too slow, self.repo.git.rev_parse(commit.hexsha, short=6),
-            "datetime": commit.authored_datetime,
-            "author_name": commit.author.name,
-            "author_email": commit.author.email,
-            #            'author' : '{} {}'.format(commit.author.name, commit.author.email),
-            "message": commit.message,
-            "files": commit.stats.files,  # This is slow
-        }
-        # this is a workaround
-        if commit.author.email is None:
-            metadata["author_name"] = (
-                metadata["author_name"].replace("<>", "").strip()
-            )
-        return metadata
+        # the files are only computed when they are accessed
+        return CommitMetadata(self.repo, commit)
+
+    def _metadata_at_revision(self, filename, revision):
+        """
+        The metadata of the commit `revision` (a hexsha prefix) if
+        `filename` exists in it, or of the commit touching `filename` whose
+        hexsha starts with `revision`, e.g. the commit deleting it.
+        """
+        for hexsha in self.commit_index.resolve(revision):
+            try:
+                self.cat_file.info(f"{hexsha}:{filename}")
+            except CatFileError:
+                continue
+            return self.commit_index.get(hexsha)
+        return self.commit_index.last(filename, revision)
 
     def _get_commit(self, filename, revision):
         self._check_reload()
-        commit = None
         if revision is None:
-            try:
-                commit = list(
-                    self.repo.iter_commits(paths=filename, max_count=1)
-                )[0]
-            except (ValueError, IndexError, git.exc.GitCommandError):
-                raise StorageNotFound
+            metadata = self.commit_index.last(filename)
         else:
-            try:
-                all_commits = list(self.repo.iter_commits(paths=filename))
-            except (git.exc.GitCommandError, ValueError):
-                raise StorageNotFound
-            for c in all_commits:
-                if c.hexsha.startswith(revision):
-                    # found
-                    commit = c
-                    break
+            metadata = self._metadata_at_revision(filename, revision)
         # not found :(
-        if commit is None:
+        if metadata is None:
             raise StorageNotFound
 
-        return commit
+        return git.Commit(self.repo, bytes.fromhex(metadata["revision-full"]))
 
-    def blame(self, filename, revision=None):
+    def blame_runs(self, filename, revision=None):
+        """
+        The blame of `filename` at `revision` as iterator of
+        (metadata, lines) tuples, one per run of consecutive lines last
+        changed by the same commit. `lines` is a list of (linenumber, line)
+        tuples. Uncached results are computed incrementally, the first runs
+        are available before the whole file has been blamed.
+        """
         if revision is None:
             revision = "HEAD"
         self._validate_revision(revision)
+        self._check_reload()
         try:
-            commits = list(self.repo.blame(revision, filename) or [])
-        except (ValueError, IndexError, git.exc.GitCommandError):
+            blob, objtype, _, data = self.cat_file.read(
+                f"{revision}:{filename}"
+            )
+        except CatFileError:
             raise StorageNotFound
-        # initialize data and helper
-        blamedata = []
+        if objtype != "blob":
+            raise StorageNotFound
+        # the blame only depends on the history up to the last commit that
+        # changed the file, use it as cache key, so that the result can be
+        # reused until the file is changed again.
+        if revision == "HEAD":
+            metadata = self.commit_index.last(filename)
+            hexshas = [metadata["revision-full"]] if metadata else []
+        else:
+            hexshas = self.commit_index.resolve(revision)
+        if len(hexshas) != 1:
+            raise StorageNotFound
+        text = data.decode("utf-8", "replace")
+        lines = text.split("\n")
+        if text == "" or text.endswith("\n"):
+            lines.pop()
+        # like GitPython, trailing whitespace is stripped from the lines
+        lines = [line.rstrip() for line in lines]
+        runs = self.blame_cache.runs(blob, hexshas[0], filename, len(lines))
+        return self._blame_runs(runs, lines)
+
+    def _blame_runs(self, runs, lines):
         metadata_cache = {}
         n = 1
-        # blame can return an iterable blame if incremental=True
-        # casting to keep it obvious we aren't doing that
-        # can be removed if gitpython adds an overload on incremental
-        for commit, lines in cast(
-            List[List[git.Commit | List[str | bytes] | None]], commits
-        ):
-            try:
-                metadata = metadata_cache[commit]
-            except KeyError:
-                metadata = self._get_metadata_of_commit(commit)
-                metadata_cache[commit] = metadata
-            for line in cast(List[str | bytes], lines) or []:
-                blamedata.append(
-                    (
-                        metadata["revision"],
-                        metadata["author_name"],
-                        metadata["datetime"],
-                        n,
-                        line,
-                        metadata["message"],
+        try:
+            for hexsha, count in runs:
+                try:
+                    metadata = metadata_cache[hexsha]
+                except KeyError:
+                    metadata = self.commit_index.get(hexsha)
+                    if metadata is None:
+                        metadata = self._get_metadata_of_commit(
+                            self.repo.commit(hexsha)
+                        )
+                    metadata_cache[hexsha] = metadata
+                yield metadata, [
+                    (i, lines[i - 1]) for i in range(n, n + count)
+                ]
+                n += count
+        except BlameError as e:
+            raise StorageError(str(e))
+
+    def blame(self, filename, revision=None):
+        blamedata = []
+        try:
+            for metadata, lines in self.blame_runs(filename, revision):
+                for n, line in lines:
+                    blamedata.append(
+                        (
+                            metadata["revision"],
+                            metadata["author_name"],
+                            metadata["datetime"],
+                            n,
+                            line,
+                            metadata["message"],
+                        )
                     )
-                )
-                # increase linenumber
-                n += 1
+        except StorageError:
+            raise StorageNotFound
         return blamedata
 
     def metadata(self, filename, revision=None):
-        # sha = repo.head.object.hexsha
-        # short_sha = repo.git.rev_parse(sha, short=6)
-        commit = self._get_commit(filename, revision)
-
-        return self._get_metadata_of_commit(commit)
-
-    def _get_metadata_of_log(self, logentry: str):
-        logentry_lines = logentry.split("\n")
-        # Get revision
-        revision = re.findall(r"commit ([a-z0-9]*)", logentry_lines[0])[0]
-        # Check if a offset for entries is necessary
-        offset = 0
-        if logentry_lines[1].startswith("Merge:"):
-            offset = 1
-        # Find author data
-        author_info = re.findall(
-            r"Author: ([^\<]*) <([^\>]*)>", logentry_lines[offset + 1]
-        )[0]
-        author_name = author_info[0]
-        author_email = author_info[1]
-        # Get and convert Datetime
-        datetime_str = re.findall("Date: (.*)", logentry_lines[offset + 2])[
-            0
-        ].strip()
-        datetime_obj = datetime.strptime(
-            datetime_str, "%a %b %d %H:%M:%S %Y %z"
-        )
-        # Get commit msg
-        message = "\n".join(
-            [x.strip() for x in logentry_lines[offset + 4 : -2]]
-        )
-
-        files = logentry_lines[-1].split("\x00")
-
-        # TODO: make an object?
-        metadata = {
-            "revision-full": revision,
-            "revision": revision[0:6],
-            "author_name": author_name,
-            "author_email": author_email,
-            "datetime": datetime_obj,
-            "files": files,
-            "message": message,
-        }
+        self._check_reload()
+        if revision is None:
+            metadata = self.commit_index.last(filename)
+        else:
+            metadata = self._metadata_at_revision(filename, revision)
+        if metadata is None:
+            raise StorageNotFound
 
         return metadata
 
     def log(self, filename=None, fail_on_git_error=False, max_count=None):
+        self._check_reload()
         if filename is None:
-            try:
-                if max_count:
-                    rawlog = self.repo.git.log(
-                        "--name-only", "-z", f"--max-count={max_count}"
-                    )
-                else:
-                    rawlog = self.repo.git.log("--name-only", "-z")
-            except git.exc.GitCommandError as e:
-                if fail_on_git_error:
+            if fail_on_git_error:
+                # the log is answered from the commit index, make sure git
+                # itself is able to read the repository
+                try:
+                    self.repo.git.rev_parse("--verify", "HEAD")
+                except git.exc.GitCommandError as e:
                     raise StorageNotFound(str(e))
-                return []
-        else:
-            try:
-                if max_count:
-                    rawlog = self.repo.git.log(
-                        "--name-only",
-                        "-z",
-                        "--follow",
-                        f"--max-count={max_count}",
-                        "--",
-                        filename,
-                    )
-                else:
-                    rawlog = self.repo.git.log(
-                        "--name-only", "-z", "--follow", "--", filename
-                    )
-            except git.exc.GitCommandError as e:
-                raise StorageNotFound(str(e))
-
-        # clean up artifacts
-        rawlog = [
-            entry
-            for entry in re.split(r'\x00\x00|\n\x00', rawlog.strip("\x00"))
-            if len(entry) > 0
-        ]
+            return self.commit_index.log(max_count=max_count)
+
+        log = self.commit_index.log_path(filename, max_count=max_count)
         # raise Exception of no log entry has been found
-        if len(rawlog) < 1:
+        if len(log) < 1:
             raise StorageNotFound
 
-        return [self._get_metadata_of_log(entry) for entry in rawlog]
+        return log
 
     def log_slow(self, filename=None):
         if filename is None:
@@ -343,14 +443,40 @@ class GitStorage(object):
             if len(commits) == 0:
                 raise StorageNotFound
         # build and return logfile
-        return [self._get_metadata_of_commit(commit) for commit in commits]
+        return CommitMetadata.batch(
+            self._get_metadata_of_commit(commit) for commit in commits
+        )
 
-    def update(
-        self,
-        filename,
-        content,
-        mode="w",
-    ):
+    def enable_group_commit(self, window=None):
+        """
+        Hand store() and commit() to a single writer thread, which batches
+        the saves arriving within `window` seconds. See groupcommit.py.
+        """
+        from otterwiki.groupcommit import GroupCommitWriter, WINDOW
+
+        if self._group_commit is None:
+            self._group_commit = GroupCommitWriter(
+                self, window=WINDOW if window is None else window
+            )
+
+    def disable_group_commit(self):
+        if self._group_commit is not None:
+            self._group_commit.stop()
+            self._group_commit = None
+
+    def connect_writer(self, socket_path):
+        """
+        Send all changes of the repository to the writer process listening
+        on `socket_path` instead of writing them. See writer.py.
+        """
+        from otterwiki.writer import WriterClient
+
+        self.writer = WriterClient(socket_path)
+
+    def disconnect_writer(self):
+        self.writer = None
+
+    def _write(self, filename, content, mode="w"):
         dirname = os.path.dirname(filename)
         if dirname != "":
             os.makedirs(
@@ -359,17 +485,30 @@ class GitStorage(object):
         # store file on filesystem
         with open(os.path.join(self.path, filename), mode) as f:
             f.write(content)
-        # check if file has changed
-        diff = self.repo.index.diff(None, paths=filename)
-        if len(diff) == 0 and filename not in self.repo.untracked_files:
-            return False
+        self.tree.refresh([filename])
 
-        # add to git
-        index = self.repo.index
-        index.add([filename])
+    @_writer_operation
+    def update(
+        self,
+        filename,
+        content,
+        mode="w",
+    ):
+        with self._write_lock:
+            self._write(filename, content, mode)
+            # check if file has changed
+            diff = self.repo.index.diff(None, paths=filename)
+            if len(diff) == 0 and filename not in self.repo.untracked_files:
+                return False
+
+            # add to git
+            index = self.repo.index
+            index.add([filename])
+            self._bump_generation()
 
         return True
 
+    @_writer_operation
     def store(
         self,
         filename,
@@ -378,17 +517,28 @@ class GitStorage(object):
         author=("", ""),
         mode="w",
     ):
-        # write the file and stage the change in git
-        if not self.update(filename, content, mode):
-            return False
+        if self._group_commit is not None:
+            return self._group_commit.store(
+                filename, content, message, author, mode
+            )
 
-        if message is None:
-            message = ""
+        with self._write_lock:
+            # write the file and stage the change in git
+            if not self.update(filename, content, mode):
+                return False
 
-        # commit to git
-        index = self.repo.index
-        actor = git.Actor(author[0], author[1])
-        index.commit(message, author=actor)
+            if message is None:
+                message = ""
+
+            # commit to git
+            index = self.repo.index
+            actor = git.Actor(author[0], author[1])
+            index.commit(message, author=actor)
+
+        # catch up the commit index before anyone queries it
+        self.commit_index.update()
+        self.commit_graph.schedule()
+        self._bump_generation()
 
         plugin_manager.hook.repository_changed(changed_files=[filename])
 
@@ -399,22 +549,34 @@ class GitStorage(object):
 
         return True
 
+    @_writer_operation
     def commit(self, filenames, message="", author=("", ""), no_add=False):
-        index = self.repo.index
-        # add and commit to git
-        if no_add == False:
-            try:
-                index.add(filenames)
-            except Exception:
-                raise StorageError(
-                    "index.add {} in commit failed.".format(filenames)
-                )
-        actor = git.Actor(author[0], author[1])
-        index.commit(message, author=actor)
+        if self._group_commit is not None:
+            self._group_commit.commit(filenames, message, author, no_add)
+            return
+
+        with self._write_lock:
+            index = self.repo.index
+            # add and commit to git
+            if no_add == False:
+                try:
+                    index.add(filenames)
+                except Exception:
+                    raise StorageError(
+                        "index.add {} in commit failed.".format(filenames)
+                    )
+            actor = git.Actor(author[0], author[1])
+            index.commit(message, author=actor)
 
         changed_list = (
             filenames if isinstance(filenames, list) else [filenames]
         )
+        self.tree.refresh(changed_list)
+        # catch up the commit index before anyone queries it
+        self.commit_index.update()
+        self.commit_graph.schedule()
+        self._bump_generation()
+
         plugin_manager.hook.repository_changed(changed_files=changed_list)
 
         # auto-push after commit
@@ -447,6 +609,7 @@ class GitStorage(object):
         )
         return {p for p in known if p}
 
+    @_writer_operation
     def restore(self, paths, revision="HEAD"):
         """Discard staged and working-tree changes below `paths`, restoring
         them to `revision` (HEAD by default). Used to roll back a partially
@@ -461,37 +624,48 @@ class GitStorage(object):
         if not known:
             return
         try:
-            self.repo.git.restore(
-                "--source",
-                revision,
-                "--staged",
-                "--worktree",
-                "--",
-                *sorted(known),
-            )
+            with self._write_lock:
+                self.repo.git.restore(
+                    "--source",
+                    revision,
+                    "--staged",
+                    "--worktree",
+                    "--",
+                    *sorted(known),
+                )
         except git.exc.GitCommandError as e:
             raise StorageError(
                 "Restoring {} to {} failed: {}.".format(
                     ", ".join(sorted(known)), revision, e
                 )
             )
+        finally:
+            self.tree.refresh(known)
+            self._bump_generation()
 
+    @_writer_operation
     def revert(self, revision, message="", author=("", "")):
         self._validate_revision(revision)
         actor = git.Actor(author[0], author[1])
-        try:
-            self.repo.git.revert(revision, "--no-commit")
-        except git.exc.GitCommandError:
+        with self._write_lock:
             try:
-                self.repo.git.revert("--abort")
+                self.repo.git.revert(revision, "--no-commit")
             except git.exc.GitCommandError:
-                pass
-            raise StorageError("Revert failed.")
+                try:
+                    self.repo.git.revert("--abort")
+                except git.exc.GitCommandError:
+                    pass
+                raise StorageError("Revert failed.")
 
-        actor = git.Actor(author[0], author[1])
-        commit = self.repo.index.commit(message, author=actor)
+            commit = self.repo.index.commit(message, author=actor)
 
         changed_files = list(commit.stats.files.keys())
+        self.tree.refresh(changed_files)
+        # catch up the commit index before anyone queries it
+        self.commit_index.update()
+        self.commit_graph.schedule()
+        self._bump_generation()
+
         plugin_manager.hook.repository_changed(changed_files=changed_files)
 
         # auto-push after revert
@@ -505,6 +679,7 @@ class GitStorage(object):
         self._validate_revision(rev_b)
         return self.repo.git.diff(rev_a, rev_b)
 
+    @_writer_operation
     def delete(self, filename, message=None, author=("", "")):
         if not type(filename) == list:
             filename = [filename]
@@ -526,12 +701,19 @@ class GitStorage(object):
         for dirname in empty_dirs:
             os.rmdir(os.path.join(self.path, dirname))
 
-        # or this will raise an exception
-        self.repo.index.remove(filename_remove, working_tree=True, r=True)
         actor = git.Actor(author[0], author[1])
         if message is None:
             message = "Deleted {}.".format(filename_remove)
-        self.repo.index.commit(message, author=actor)
+        with self._write_lock:
+            # or this will raise an exception
+            self.repo.index.remove(filename_remove, working_tree=True, r=True)
+            self.repo.index.commit(message, author=actor)
+        self.tree.refresh(filename)
+
+        # catch up the commit index before anyone queries it
+        self.commit_index.update()
+        self.commit_graph.schedule()
+        self._bump_generation()
 
         plugin_manager.hook.repository_changed(changed_files=filename_remove)
 
@@ -540,6 +722,7 @@ class GitStorage(object):
         if repo_manager:
             repo_manager.auto_push_if_enabled()
 
+    @_writer_operation
     def rename(
         self,
         old_filename,
@@ -560,13 +743,16 @@ class GitStorage(object):
                 os.path.join(self.path, dirname), mode=0o775, exist_ok=True
             )
         try:
-            self.repo.git.mv(old_filename, new_filename)
+            with self._write_lock:
+                self.repo.git.mv(old_filename, new_filename)
         except Exception as e:
             raise StorageError(
                 "Renaming {} to {} failed: {}.".format(
                     old_filename, new_filename, e
                 )
             )
+        self.tree.refresh([old_filename, new_filename])
+        self._bump_generation()
         if message is None:
             message = "{} renamed to {}.".format(old_filename, new_filename)
         if not no_commit:
@@ -574,6 +760,27 @@ class GitStorage(object):
             self.commit(files_updated, message, author, no_add=True)
 
     def list(self, p=None, depth=None, exclude=[]):
+        """
+        The sorted files and directories below `p`, relative to `p`. The
+        listing is answered from the tree snapshot whenever `p` is a
+        directory it covers.
+        """
+        prefix = ""
+        if p is not None:
+            if os.path.isabs(p):
+                raise ValueError("p must not be an absolute path")
+            prefix = os.path.normpath(p)
+            if prefix == ".":
+                prefix = ""
+        result = self.tree.list(prefix, depth=depth, exclude=exclude)
+        if result is not None:
+            return result
+        if os.path.isdir(os.path.join(self.path, prefix)):
+            # outside of the snapshot, e.g. a symlink or the .git directory
+            return self._walk(p, depth=depth, exclude=exclude)
+        return [], []
+
+    def _walk(self, p=None, depth=None, exclude=[]):
         excludes = [".git"] + exclude
         # full path to search
         if p is not None:
@@ -640,42 +847,11 @@ class GitStorage(object):
         """
         Get the filename that was used at a specific revision.
         """
-        try:
-            # get the full log with --follow to understand the rename chain
-            full_log = self.repo.git.log(
-                "--follow",
-                "--name-only",
-                "-z",
-                "--format=format:%H",
-                "--",
-                current_filename,
-            )
-
-            if not full_log.strip():
-                return current_filename
-
-            entries = [
-                entry
-                for entry in full_log.strip('\x00').split('\x00\x00')
-                if entry
-            ]
-
-            for entry in entries:
-                # format: "commit_hash\nfilename"
-                lines = entry.strip('\x00').split('\n')
-                if len(lines) >= 2:
-                    entry_revision = lines[0]
-                    entry_filename = lines[1]
-
-                    if entry_revision.startswith(
-                        revision
-                    ) or revision.startswith(entry_revision[:6]):
-                        return entry_filename
-
-            return current_filename
-
-        except git.exc.GitCommandError as e:
-            return current_filename
+        for hexsha in self.commit_index.resolve(revision):
+            filename = self.commit_index.filename_at(current_filename, hexsha)
+            if filename is not None:
+                return filename
+        return current_filename
 
 
 storage = None
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+Group commits for GitStorage.
+
+With many concurrent saves every store() writes the git index and creates a
+commit on its own, all of them competing for .git/index.lock. In group
+commit mode the saves are handed to a single writer thread instead. The
+writer collects the saves arriving within a short window and applies them
+in order on one in-memory index: every save still becomes a commit of its
+own, but the index and HEAD are written once per batch, and the plugins and
+the auto-push are notified once per batch. The index entries of a failed
+save are reset, so they are not committed with the next save.
+"""
+
+import queue
+import time
+from threading import Event, Thread
+
+import git
+
+from otterwiki.gitstorage import StorageError
+from otterwiki.plugins import plugin_manager
+from otterwiki.repomgmt import get_repo_manager
+
+# seconds the writer waits for further saves after the first of a batch
+WINDOW = 0.05
+# the maximum number of saves in a batch
+MAX_BATCH = 100
+
+
+class _Request:
+    __slots__ = ("kind", "args", "done", "result", "error", "files")
+
+    def __init__(self, kind, **args):
+        self.kind = kind
+        self.args = args
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.files = []
+
+
+class GroupCommitWriter:
+    """
+    The writer thread of a GitStorage in group commit mode. store() and
+    commit() block until the commit of the save has been written and HEAD
+    points to it.
+    """
+
+    def __init__(self, storage, window=WINDOW, max_batch=MAX_BATCH):
+        self.storage = storage
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _submit(self, request):
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def store(self, filename, content, message, author, mode):
+        return self._submit(
+            _Request(
+                "store",
+                filename=filename,
+                content=content,
+                message=message or "",
+                author=author,
+                mode=mode,
+            )
+        )
+
+    def commit(self, filenames, message, author, no_add):
+        return self._submit(
+            _Request(
+                "commit",
+                filenames=(
+                    filenames if isinstance(filenames, list) else [filenames]
+                ),
+                message=message,
+                author=author,
+                no_add=no_add,
+            )
+        )
+
+    def stop(self):
+        """Finish the queued saves and terminate the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self):
+        """Block for the first request, then collect a batch."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while batch[-1] is not None and len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is None
+            batch = [request for request in batch if request is not None]
+            if batch:
+                self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        storage = self.storage
+        try:
+            with storage._write_lock:
+                self._apply(batch)
+            # catch up the commit index before anyone queries it
+            storage.commit_index.update()
+            storage.commit_graph.schedule()
+            storage._bump_generation()
+        except Exception as e:
+            for request in batch:
+                if request.error is None:
+                    request.error = e
+        # the saves are durable, release the callers
+        changed_files = []
+        for request in batch:
+            if request.error is None and request.result is not False:
+                changed_files += request.files
+            request.done.set()
+        if not changed_files:
+            return
+        try:
+            plugin_manager.hook.repository_changed(changed_files=changed_files)
+            repo_manager = get_repo_manager()
+            if repo_manager:
+                repo_manager.auto_push_if_enabled()
+        except Exception as e:
+            try:
+                from otterwiki.server import app
+
+                app.logger.error(f"Group commit notification failed: {e}")
+            except ImportError:
+                pass
+
+    def _apply(self, batch):
+        storage = self.storage
+        repo = storage.repo
+        index = repo.index
+        try:
+            parent = repo.head.commit
+        except ValueError:
+            # no commit yet
+            parent = None
+        head = parent
+        for request in batch:
+            # a failed request must not leave its changes staged for the
+            # commit of the next one
+            entries = dict(index.entries)
+            try:
+                if request.kind == "store":
+                    if not self._stage_store(index, request):
+                        request.result = False
+                        continue
+                else:
+                    self._stage_commit(index, request)
+                author = request.args["author"]
+                head = git.Commit.create_from_tree(
+                    repo,
+                    index.write_tree(),
+                    request.args["message"],
+                    parent_commits=[head] if head is not None else [],
+                    head=False,
+                    author=git.Actor(author[0], author[1]),
+                )
+                if request.kind == "store":
+                    request.result = True
+            except Exception as e:
+                request.error = e
+                request.files = []
+                index.entries.clear()
+                index.entries.update(entries)
+        if head is parent:
+            return
+        index.write()
+        message = "commit: {}".format(head.summary)
+        try:
+            repo.head.set_commit(head, logmsg=message)
+        except ValueError:
+            # the branch HEAD points to does not exist yet
+            branch = git.Head.create(repo, repo.head.ref, head, logmsg=message)
+            repo.head.set_reference(branch, logmsg=message)
+
+    def _stage_store(self, index, request):
+        """
+        Write and stage the file of a store request. Returns False if the
+        content did not change.
+        """
+        filename = request.args["filename"]
+        self.storage._write(
+            filename, request.args["content"], request.args["mode"]
+        )
+        key = (filename, 0)
+        before = index.entries.get(key)
+        index.add([filename], write=False)
+        after = index.entries[key]
+        if before is not None and (before.binsha, before.mode) == (
+            after.binsha,
+            after.mode,
+        ):
+            return False
+        request.files = [filename]
+        return True
+
+    def _stage_commit(self, index, request):
+        filenames = request.args["filenames"]
+        if not request.args["no_add"]:
+            try:
+                index.add(filenames, write=False)
+            except Exception:
+                raise StorageError(
+                    "index.add {} in commit failed.".format(filenames)
+                )
+        self.storage.tree.refresh(filenames)
+        request.files = filenames
@@ -0,0 +1,623 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+The search in the history of the pages.
+
+A change of a page matches a plain-text query like `git log -S`, if it
+changes the number of occurrences of the query, and a regexp like
+`git log -G`, if it adds or removes a line matching the regexp. Searching
+the history with git means diffing every commit of the repository, for
+every search.
+
+The HistoryIndex keeps the lines every commit added to and removed from
+every page in a SQLite FTS5 table with the trigram tokenizer in the index
+directory. It is caught up with HEAD incrementally, only the diffs of the
+new commits are read, and a search only has to match the changes
+containing the trigrams of the query. A search gives the index half of
+its time budget to catch up, the progress is kept for the next one.
+Without FTS5, or until the index caught up, the history is searched via a
+single `git log -S` (or `git log -p` for a regexp, since git knows
+POSIX regexps only), which is read while git is still running and stopped
+as soon as a page of results has been found.
+"""
+
+import codecs
+import sqlite3
+import subprocess
+from threading import Lock
+from timeit import default_timer as timer
+
+import git.exc
+
+from otterwiki.commitindex import open_database
+from otterwiki.searchindex import trigram_query
+
+# bump this whenever the schema or the way the data is parsed changes,
+# the index is rebuilt from scratch if the stored version differs.
+SCHEMA_VERSION = 2
+
+# the number of changes shown on a page of results
+PAGE_SIZE = 20
+
+# the number of changes loaded from the index at once
+BATCH_SIZE = 200
+
+# the number of commits indexed in one transaction
+CATCH_UP_BATCH = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS commits (
+    hexsha TEXT PRIMARY KEY
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS changes USING fts5 (
+    date UNINDEXED,
+    seq UNINDEXED,
+    hexsha UNINDEXED,
+    path UNINDEXED,
+    deleted UNINDEXED,
+    added,
+    removed,
+    tokenize = 'trigram',
+    detail = none
+);
+"""
+
+# the format of a commit in `git log`, the lines of a patch never start
+# with a record separator
+_RS = "\x1e"
+_LOG_FORMAT = "%x1e%H"
+
+
+def _unquote(name):
+    """A path in a diff header as git prints it, without quotes."""
+    # git appends a tab to a name containing a space
+    name = name.removesuffix("\t")
+    if name.startswith('"') and name.endswith('"'):
+        raw = codecs.escape_decode(name[1:-1].encode("utf-8"))[0]
+        name = raw.decode("utf-8", "replace")
+    return name
+
+
+def stream_changes(git_dir, revisions, *options):
+    """
+    Run `git log -p` on `revisions` with the extra `options` and yield the
+    changes of the pages as (hexsha, path, deleted, added lines, removed
+    lines) tuples, in log order, as soon as git printed them. `revisions` is
+    a revision (range) or a list of commits, which are diffed in this order.
+    Closing the generator stops git.
+    """
+    if isinstance(revisions, str):
+        walk = [revisions]
+    else:
+        walk = ["--no-walk=unsorted", "--stdin"]
+    process = subprocess.Popen(
+        [
+            "git",
+            f"--git-dir={git_dir}",
+            "-c",
+            "core.quotepath=off",
+            "log",
+            "-p",
+            "-M",
+            "--unified=0",
+            "--no-color",
+            "--no-ext-diff",
+            f"--format={_LOG_FORMAT}",
+            *options,
+            *walk,
+            "--",
+            "*.md",
+        ],
+        stdin=None if isinstance(revisions, str) else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if process.stdin is not None:
+        # git reads all of stdin before it starts the output
+        try:
+            process.stdin.write("".join(f"{r}\n" for r in revisions).encode())
+            process.stdin.close()
+        except OSError:
+            pass
+    hexsha, path, deleted = None, None, False
+    added, removed = [], []
+    in_header = False
+    try:
+        for raw in process.stdout:  # pyright: ignore
+            line = raw.rstrip(b"\n").decode("utf-8", "replace")
+            if line.startswith(_RS) or line.startswith("diff --git "):
+                if path is not None and (added or removed):
+                    yield hexsha, path, deleted, added, removed
+                path, deleted = None, False
+                added, removed = [], []
+                if line.startswith(_RS):
+                    hexsha = line[1:]
+                    in_header = False
+                else:
+                    in_header = True
+            elif in_header:
+                if line.startswith("--- ") and path is None:
+                    name = _unquote(line[4:])
+                    if name != "/dev/null":
+                        path = name[2:]
+                elif line.startswith("+++ "):
+                    name = _unquote(line[4:])
+                    if name == "/dev/null":
+                        deleted = True
+                    else:
+                        path = name[2:]
+                elif line.startswith("@@"):
+                    in_header = False
+            elif line.startswith("+"):
+                added.append(line[1:])
+            elif line.startswith("-"):
+                removed.append(line[1:])
+        if path is not None and (added or removed):
+            yield hexsha, path, deleted, added, removed
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()  # pyright: ignore
+
+
+class HistoryTimeout(Exception):
+    pass
+
+
+class HistorySearch:
+    """
+    Find the changes of the pages matching `pattern`, the compiled regexp
+    of the search for `query`.
+    """
+
+    def __init__(
+        self,
+        pattern,
+        query,
+        is_regexp=False,
+        is_casesensitive=False,
+        time_budget=None,
+    ):
+        self.pattern = pattern
+        self.query = query
+        self.is_regexp = is_regexp
+        self.is_casesensitive = is_casesensitive
+        self.time_budget = time_budget
+        self.timed_out = False
+        self.more = False
+        self._deadline = None
+
+    def _timeout(self):
+        if self._deadline is None:
+            return None
+        remaining = self._deadline - timer()
+        if remaining <= 0:
+            raise HistoryTimeout()
+        return remaining
+
+    def _matching(self, lines):
+        """The lines matching, with the number of matches in all lines."""
+        result, count = [], 0
+        try:
+            for line in lines:
+                n = len(self.pattern.findall(line, timeout=self._timeout()))
+                if n:
+                    result.append(line)
+                    count += n
+        except TimeoutError:
+            raise HistoryTimeout()
+        return result, count
+
+    def match(self, added, removed):
+        """
+        The matching lines of a change as ("+" | "-", line) tuples, None if
+        the change does not match.
+        """
+        added, n_added = self._matching(added)
+        removed, n_removed = self._matching(removed)
+        if self.is_regexp:
+            if not added and not removed:
+                return None
+        elif n_added == n_removed:
+            return None
+        return [("-", line) for line in removed] + [
+            ("+", line) for line in added
+        ]
+
+    def _stream(self, storage):
+        """The changes that might match, read from `git log`."""
+        options = []
+        if not self.is_regexp:
+            options.append(f"-S{self.query}")
+            if not self.is_casesensitive:
+                options.append("--regexp-ignore-case")
+        return stream_changes(storage.repo.git_dir, "HEAD", *options)
+
+    def run(self, storage, index=None, offset=0, limit=PAGE_SIZE):
+        """
+        The matching changes from the `offset`th on, at most `limit`, as
+        dicts with the revision, filename, if the page has been deleted and
+        the matching lines. The changes are read from the HistoryIndex
+        `index`, if it is available, or from git. `more` tells if there are
+        more matches.
+        """
+        if self.time_budget:
+            self._deadline = timer() + self.time_budget
+        changes = None
+        if index is not None:
+            deadline = None
+            if self.time_budget:
+                # leave half of the budget to search via git, if the index
+                # did not catch up by then
+                deadline = timer() + self.time_budget / 2
+            changes = index.candidates(self.query, self.is_regexp, deadline)
+        if changes is None:
+            changes = self._stream(storage)
+        result = []
+        skipped = 0
+        try:
+            for hexsha, path, deleted, added, removed in changes:
+                lines = self.match(added, removed)
+                if lines is None:
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                if len(result) >= limit:
+                    self.more = True
+                    break
+                result.append(
+                    {
+                        "revision": hexsha,
+                        "filename": path,
+                        "deleted": deleted,
+                        "lines": lines,
+                    }
+                )
+        except HistoryTimeout:
+            self.timed_out = True
+        finally:
+            changes.close()
+        return result
+
+
+class HistoryIndex:
+    """
+    The lines added and removed by the commits of the repository of
+    `storage` to the pages.
+
+    The commits are indexed in batches, each in a transaction of its own,
+    and only the commits not indexed yet are diffed, so a catch-up can stop
+    at a deadline and continue later. Until the index caught up with HEAD,
+    the history is searched via git. The changes are ordered by the commit
+    date and, within a second, by the position of the commit in the log,
+    counted from the oldest commit.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        # guards the database connection
+        self._lock = Lock()
+        # held while catching up
+        self._update_lock = Lock()
+        self._db = None
+        self._git_dir = None
+        self._head = None
+        self.available = True
+
+    @property
+    def db(self):
+        """The database, reopened whenever the repository changed."""
+        git_dir = self.storage.repo.git_dir
+        if self._db is None or self._git_dir != git_dir:
+            if self._db is not None:
+                self._db.close()
+            self._db = open_database(git_dir, "history.sqlite3")
+            self._git_dir = git_dir
+            self._head = None
+            self._create()
+        return self._db
+
+    def _create(self):
+        db = self._db
+        try:
+            db.executescript(_SCHEMA)
+        except sqlite3.OperationalError:
+            # SQLite has been built without FTS5
+            self.available = False
+            return
+        if self._get_meta(db, "version") != str(SCHEMA_VERSION):
+            db.execute("BEGIN IMMEDIATE")
+            self._clear(db)
+            self._set_meta(db, "version", str(SCHEMA_VERSION))
+            db.execute("COMMIT")
+
+    @staticmethod
+    def _get_meta(db, key):
+        row = db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_meta(db, key, value):
+        if value is None:
+            db.execute("DELETE FROM meta WHERE key = ?", (key,))
+        else:
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+
+    @staticmethod
+    def _clear(db):
+        db.execute("DELETE FROM changes")
+        db.execute("DELETE FROM commits")
+        db.execute(
+            "DELETE FROM meta WHERE key IN"
+            " ('head', 'base', 'base_commits', 'head_commits', 'complete')"
+        )
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _is_ancestor(self, indexed, head):
+        try:
+            self.storage.repo.git.merge_base("--is-ancestor", indexed, head)
+        except git.exc.GitCommandError:
+            return False
+        return True
+
+    def _start(self, db, head):
+        """
+        Record that the index catches up with `head`. Returns if it is
+        complete already, the head the missing commits descend from, None
+        if the whole history has to be indexed, and the number of commits
+        in the log of that head.
+        """
+        indexed = self._get_meta(db, "head")
+        base = self._get_meta(db, "base")
+        base_commits = int(self._get_meta(db, "base_commits") or 0)
+        if indexed == head:
+            return self._get_meta(db, "complete") == "1", base, base_commits
+        if indexed is None or not self._is_ancestor(indexed, head):
+            self._clear(db)
+            base, base_commits = None, 0
+        elif self._get_meta(db, "complete") == "1":
+            base = indexed
+            base_commits = int(self._get_meta(db, "head_commits"))
+        # otherwise an interrupted catch-up is continued from its base
+        self._set_meta(db, "head", head)
+        self._set_meta(db, "base", base)
+        self._set_meta(db, "base_commits", str(base_commits))
+        self._set_meta(db, "complete", "0")
+        return False, base, base_commits
+
+    def _store(self, changes, hexshas, commits, head_commits=None):
+        """
+        Add the `changes` of the commits `hexshas` in one transaction,
+        skipping the commits indexed in the meantime. `commits` maps the
+        commits to their date and position in the log. Marks the index
+        complete, if the number of commits in the log of the head is given.
+        Returns the number of added changes.
+        """
+        added_changes = 0
+        with self._lock:
+            db = self.db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                known = {
+                    row[0]
+                    for row in db.execute(
+                        "SELECT hexsha FROM commits WHERE hexsha IN ({})".format(
+                            ",".join("?" * len(hexshas))
+                        ),
+                        hexshas,
+                    )
+                }
+                db.executemany(
+                    "INSERT INTO commits (hexsha) VALUES (?)",
+                    [(hexsha,) for hexsha in hexshas if hexsha not in known],
+                )
+                for hexsha, path, deleted, added, removed in changes:
+                    if hexsha in known:
+                        continue
+                    db.execute(
+                        "INSERT INTO changes (date, seq, hexsha, path,"
+                        " deleted, added, removed)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            *commits[hexsha],
+                            hexsha,
+                            path,
+                            int(deleted),
+                            "".join(line + "\n" for line in added),
+                            "".join(line + "\n" for line in removed),
+                        ),
+                    )
+                    added_changes += 1
+                if head_commits is not None:
+                    self._set_meta(db, "head_commits", str(head_commits))
+                    self._set_meta(db, "complete", "1")
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return added_changes
+
+    def _missing(self, revisions, base_commits):
+        """
+        The commits of `revisions` not indexed yet, newest first, their
+        date and position in the log, and the number of commits in the log.
+        """
+        with self._lock:
+            known = {
+                row[0] for row in self.db.execute("SELECT hexsha FROM commits")
+            }
+        log = self.storage.repo.git.log(
+            "--format=%H %ct", revisions
+        ).splitlines()
+        missing, commits = [], {}
+        for i, line in enumerate(log):
+            hexsha, date = line.split(" ")
+            if hexsha not in known:
+                missing.append(hexsha)
+                commits[hexsha] = (int(date), base_commits + len(log) - i)
+        return missing, commits, base_commits + len(log)
+
+    def _catch_up(self, head, deadline=None):
+        """
+        Index the changes of the commits up to `head`, the ones added since
+        the indexed head if HEAD moved on from there. Returns the number of
+        indexed changes, None if `deadline` passed first.
+        """
+        with self._lock:
+            db = self.db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                complete, base, base_commits = self._start(db, head)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        if complete:
+            return 0
+        missing, commits, head_commits = self._missing(
+            head if base is None else f"{base}..{head}", base_commits
+        )
+        if not missing:
+            return self._store([], [], commits, head_commits)
+        position = {hexsha: i for i, hexsha in enumerate(missing)}
+        indexed_changes = 0
+        # the changes of missing[done:] not stored yet
+        batch, done = [], 0
+        changes = stream_changes(self._git_dir, missing)
+        try:
+            for change in changes:
+                i = position[change[0]]
+                if not batch or change[0] != batch[-1][0]:
+                    # the commits before missing[i] are complete
+                    if deadline is not None and timer() > deadline:
+                        self._store(batch, missing[done:i], commits)
+                        return None
+                    if i - done >= CATCH_UP_BATCH:
+                        indexed_changes += self._store(
+                            batch, missing[done:i], commits
+                        )
+                        batch, done = [], i
+                batch.append(change)
+            indexed_changes += self._store(
+                batch, missing[done:], commits, head_commits
+            )
+        finally:
+            changes.close()
+        return indexed_changes
+
+    def update(self, deadline=None, blocking=True):
+        """
+        Catch up with HEAD. Returns the number of indexed changes, None if
+        FTS5 is not available or the index did not catch up: `deadline`
+        passed or, unless `blocking`, another thread is catching up.
+        """
+        if not self._update_lock.acquire(blocking=blocking):
+            return None
+        try:
+            with self._lock:
+                self.db
+                if not self.available:
+                    return None
+            head = self.storage.commit_index.head()
+            if head == self._head:
+                return 0
+            if head is None:
+                with self._lock:
+                    db = self.db
+                    db.execute("BEGIN IMMEDIATE")
+                    self._clear(db)
+                    db.execute("COMMIT")
+                changes = 0
+            else:
+                changes = self._catch_up(head, deadline)
+                if changes is None:
+                    return None
+            self._head = head
+            return changes
+        finally:
+            self._update_lock.release()
+
+    def rebuild(self):
+        """Index the history from scratch."""
+        with self._update_lock, self._lock:
+            db = self.db
+            if not self.available:
+                return None
+            db.execute("BEGIN IMMEDIATE")
+            self._clear(db)
+            db.execute("COMMIT")
+            self._head = None
+        return self.update()
+
+    def candidates(self, query, is_regexp=False, deadline=None):
+        """
+        The changes with all the trigrams a match of `query` requires as
+        (hexsha, path, deleted, added lines, removed lines) tuples, newest
+        first. None if FTS5 is not available or the index did not catch up
+        with HEAD by `deadline`.
+        """
+        if self.update(deadline, blocking=False) is None:
+            return None
+        trigrams = trigram_query(query, is_regexp)
+        sql = "SELECT rowid FROM changes"
+        args = ()
+        if trigrams is not None:
+            sql += " WHERE changes MATCH ?"
+            args = (trigrams,)
+        sql += " ORDER BY date DESC, seq DESC, rowid"
+        with self._lock:
+            rowids = [row[0] for row in self.db.execute(sql, args)]
+        return self._load(rowids)
+
+    def _load(self, rowids):
+        # the changes are loaded in chunks, a search usually stops early
+        for i in range(0, len(rowids), BATCH_SIZE):
+            chunk = rowids[i : i + BATCH_SIZE]
+            with self._lock:
+                rows = {
+                    row[0]: row[1:]
+                    for row in self.db.execute(
+                        "SELECT rowid, hexsha, path, deleted, added, removed"
+                        " FROM changes WHERE rowid IN ({})".format(
+                            ",".join("?" * len(chunk))
+                        ),
+                        chunk,
+                    )
+                }
+            for rowid in chunk:
+                if rowid not in rows:
+                    # dropped by a rebuild in the meantime
+                    continue
+                hexsha, path, deleted, added, removed = rows[rowid]
+                yield (
+                    hexsha,
+                    path,
+                    bool(deleted),
+                    added.split("\n")[:-1],
+                    removed.split("\n")[:-1],
+                )
+
+    def count(self):
+        """The number of indexed changes."""
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM changes").fetchone()[
+                0
+            ]
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+A streaming HTML balancer.
+
+The rendered html is cleaned up as the last step, so that stray tags of
+the markdown or of plugins can not break the page: unclosed tags are
+closed, end tags without a matching start tag are dropped. This used to be
+done by parsing the whole document with BeautifulSoup(html, 'html.parser')
+and serializing it again. The balancer produces the same output in a
+single pass over the tokens of html.parser, without building a tree: it
+only keeps the stack of open tags.
+
+The output is identical to str(BeautifulSoup(html, 'html.parser')),
+including its normalizations: attributes are sorted and quoted, entities
+are decoded and the text is escaped minimally, strings consisting only of
+whitespace are collapsed (except in <pre> and <textarea>) and empty
+elements are written as <br/>.
+"""
+
+import re
+from html.entities import html5
+from html.parser import HTMLParser
+
+# the tags BeautifulSoup considers empty-element tags
+VOID_ELEMENTS = frozenset(
+    [
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "keygen",
+        "link",
+        "menuitem",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+        "basefont",
+        "bgsound",
+        "command",
+        "frame",
+        "image",
+        "isindex",
+        "nextid",
+        "spacer",
+    ]
+)
+
+# whitespace is kept as is inside of these tags
+PRESERVE_WHITESPACE = frozenset(["pre", "textarea"])
+
+# the text inside of these tags is not escaped
+CDATA_CONTAINING = frozenset(["script", "style"])
+
+# attributes with a whitespace-separated list of values, which are
+# normalized to values separated by a single space
+LIST_ATTRIBUTES = {
+    "*": frozenset(["class", "accesskey", "dropzone"]),
+    "a": frozenset(["rel", "rev"]),
+    "link": frozenset(["rel", "rev"]),
+    "td": frozenset(["headers"]),
+    "th": frozenset(["headers"]),
+    "form": frozenset(["accept-charset"]),
+    "object": frozenset(["archive"]),
+    "area": frozenset(["rel"]),
+    "icon": frozenset(["sizes"]),
+    "iframe": frozenset(["sandbox"]),
+    "output": frozenset(["for"]),
+}
+
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+_NONWHITESPACE_RE = re.compile(r"\S+")
+_ESCAPE_RE = re.compile(r"[<>&]")
+_ESCAPES = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+_META_CHARSET_RE = re.compile(r"((^|;)\s*charset=)([^;]*)", re.M)
+
+# entity name (without the semicolon) -> characters
+_ENTITIES = {}
+for _name, _character in sorted(html5.items()):
+    _ENTITIES.setdefault(_name.removesuffix(";"), _character)
+
+
+def _escape(text):
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES[m.group(0)], text)
+
+
+def _quote(value):
+    value = _escape(value)
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"{}"'.format(value.replace('"', "&quot;"))
+
+
+def _format_attributes(tag, attrs):
+    # duplicate attributes: the last value wins
+    values = {}
+    for key, value in attrs:
+        values[key] = "" if value is None else value
+    if tag == "meta":
+        # the document is always delivered as utf-8
+        if "charset" in values:
+            values["charset"] = "utf-8"
+        elif (
+            "content" in values
+            and values.get("http-equiv", "").lower() == "content-type"
+        ):
+            values["content"] = _META_CHARSET_RE.sub(
+                lambda m: m.group(1) + "utf-8", values["content"]
+            )
+    list_attributes = LIST_ATTRIBUTES.get(tag, frozenset())
+    result = []
+    for key in sorted(values):
+        value = values[key]
+        if key in LIST_ATTRIBUTES["*"] or key in list_attributes:
+            value = " ".join(_NONWHITESPACE_RE.findall(value))
+        result.append(f" {key}={_quote(value)}")
+    return "".join(result)
+
+
+class HtmlBalancer(HTMLParser):
+    """
+    Feed html via feed(), call close() and collect the balanced html from
+    `output`. The output of the parts of the document that can not change
+    anymore is written while feeding.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.output = []
+        self._stack = []
+        # the number of open <pre> and <textarea> tags
+        self._preserve = 0
+        # the text collected since the last tag
+        self._data = []
+        # the start tag of an empty-element tag, which is written as <br/>
+        # unless something is added to it
+        self._pending = None
+        # empty-element tags closed right away, e.g. <br>, so that a
+        # following </br> is ignored
+        self._closed_empty = []
+
+    def result(self):
+        return "".join(self.output)
+
+    def _open_pending(self):
+        if self._pending is not None:
+            self.output.append(f"<{self._pending}>")
+            self._pending = None
+
+    def _end_data(self):
+        """Returns the text collected since the last tag."""
+        if not self._data:
+            return None
+        data = "".join(self._data)
+        self._data = []
+        if not self._preserve and not data.strip(_ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+        # the text is added to the current tag
+        self._open_pending()
+        return data
+
+    def _flush_data(self):
+        data = self._end_data()
+        if data is None:
+            return
+        if self._stack and self._stack[-1] in CDATA_CONTAINING:
+            self.output.append(data)
+        else:
+            self.output.append(_escape(data))
+
+    def _pop(self):
+        tag = self._stack.pop()
+        if tag in PRESERVE_WHITESPACE:
+            self._preserve -= 1
+        if self._pending is not None:
+            self.output.append(f"<{self._pending}/>")
+            self._pending = None
+        else:
+            self.output.append(f"</{tag}>")
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True):
+        self._flush_data()
+        self._open_pending()
+        start = tag + _format_attributes(tag, attrs)
+        if tag in VOID_ELEMENTS:
+            self._pending = start
+        else:
+            self.output.append(f"<{start}>")
+        self._stack.append(tag)
+        if tag in PRESERVE_WHITESPACE:
+            self._preserve += 1
+        if tag in VOID_ELEMENTS and handle_empty_element:
+            self.handle_endtag(tag, check_already_closed=False)
+            self._closed_empty.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        if check_already_closed and tag in self._closed_empty:
+            self._closed_empty.remove(tag)
+            return
+        self._flush_data()
+        if tag not in self._stack:
+            # an end tag without start tag
+            return
+        while self._stack[-1] != tag:
+            self._pop()
+        self._pop()
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        if name[0] in "xX":
+            codepoint = int(name[1:], 16)
+        else:
+            codepoint = int(name)
+        data = None
+        if codepoint < 256:
+            try:
+                data = bytes([codepoint]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(codepoint)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        self.handle_data(_ENTITIES.get(name, f"&{name}"))
+
+    def _special(self, prefix, data, suffix):
+        """Comments, declarations etc. are written without escaping."""
+        self._flush_data()
+        self._data.append(data)
+        self.output.append(prefix + self._end_data() + suffix)
+
+    def handle_comment(self, data):
+        self._special("<!--", data, "-->")
+
+    def handle_decl(self, data):
+        self._special("<!DOCTYPE ", data[len("DOCTYPE ") :], ">\n")
+
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self._special("<![CDATA[", data[len("CDATA[") :], "]]>")
+        else:
+            self._special("<?", data, "?>")
+
+    def handle_pi(self, data):
+        self._special("<?", data, ">")
+
+    def close(self):
+        super().close()
+        self._flush_data()
+        while self._stack:
+            self._pop()
+
+
+def balance_html(html):
+    """Close unclosed tags and drop unmatched end tags in `html`."""
+    balancer = HtmlBalancer()
+    balancer.feed(html)
+    balancer.close()
+    return balancer.result()
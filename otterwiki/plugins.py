@@ -9,8 +9,10 @@ that will be expanded in the future.
 See docs/plugin_examples for examples.
 """
 
+import threading
 from collections import OrderedDict
 from dataclasses import dataclass, field
+from time import perf_counter
 from werkzeug.datastructures import MultiDict
 
 import pluggy
@@ -119,6 +121,21 @@ class OtterWikiPluginSpec:
             preview: bool True if page is previewed
         """
 
+    @hookspec
+    def page_render_cacheable(self, page) -> bool | None:
+        """
+        The rendered markdown of a page is cached and reused as long as the
+        page, the configuration and the plugins do not change. Plugins whose
+        rendering depends on anything else, e.g. the current user or the
+        request, return False to render the page on every view.
+
+        Args:
+            page: The otterwiki.wiki.Page object
+
+        Returns:
+            False if the page must not be cached
+        """
+
     @hookspec
     def embedding_parse(
         self, embedding, embedding_options={}, embedding_args=[]
@@ -412,20 +429,168 @@ class OtterWikiPluginSpec:
         """
 
 
+class HookTiming:
+    """
+    Records the calls of the hooks dispatched via chain_hooks(), call_hook()
+    and collect_hook(): the number of calls, the cumulative and the maximum
+    time per plugin and hook, in total and for the current request.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        # (plugin, hook) -> [calls, total, max]
+        self._stats = {}
+        self._local = threading.local()
+
+    @staticmethod
+    def _add(stats, key, duration):
+        entry = stats.get(key)
+        if entry is None:
+            stats[key] = [1, duration, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+            if duration > entry[2]:
+                entry[2] = duration
+
+    def record(self, plugin, hook, duration):
+        with self._lock:
+            self._add(self._stats, (plugin, hook), duration)
+        request = getattr(self._local, "request", None)
+        if request is not None:
+            self._add(request, (plugin, hook), duration)
+
+    def start_request(self):
+        self._local.request = {}
+
+    def end_request(self):
+        """The stats of the current request, stops recording them."""
+        request = getattr(self._local, "request", None)
+        self._local.request = None
+        return self._format(request or {})
+
+    def stats(self):
+        with self._lock:
+            return self._format(self._stats)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    @staticmethod
+    def _format(stats):
+        """The stats as list of dicts, the most expensive first."""
+        result = [
+            {
+                "plugin": plugin,
+                "hook": hook,
+                "calls": calls,
+                "total": total,
+                "max": max_,
+            }
+            for (plugin, hook), (calls, total, max_) in stats.items()
+        ]
+        result.sort(key=lambda entry: entry["total"], reverse=True)
+        return result
+
+
+def _plugin_label(impl):
+    """A readable name of the plugin of the HookImpl `impl`."""
+    if not impl.plugin_name.isdigit():
+        return impl.plugin_name
+    # plugins registered without a name are named after their id()
+    plugin = impl.plugin
+    return getattr(plugin, "__name__", type(plugin).__name__)
+
+
+class OtterwikiPluginManager(pluggy.PluginManager):
+    """
+    A PluginManager that keeps the functions of the implementations of
+    every hook in a table, so that hooks called once per element of a page
+    don't look up their implementations every time. The table is dropped
+    whenever plugins or hookspecs are added or removed.
+
+    With hook timing enabled the table holds wrappers of the functions that
+    record their calls in `hook_timing`, so that the timing doesn't cost
+    anything while it is disabled.
+    """
+
+    def __init__(self, project_name):
+        super().__init__(project_name)
+        self._hook_functions = {}
+        self.hook_timing = HookTiming()
+
+    def register(self, plugin, name=None):
+        try:
+            return super().register(plugin, name=name)
+        finally:
+            self._hook_functions = {}
+
+    def unregister(self, plugin=None, name=None):
+        try:
+            return super().unregister(plugin=plugin, name=name)
+        finally:
+            self._hook_functions = {}
+
+    def add_hookspecs(self, module_or_class):
+        try:
+            super().add_hookspecs(module_or_class)
+        finally:
+            self._hook_functions = {}
+
+    def enable_hook_timing(self, enabled=True):
+        self.hook_timing.enabled = enabled
+        self._hook_functions = {}
+
+    def _timed(self, hook_name, impl):
+        function = impl.function
+        record = self.hook_timing.record
+        plugin = _plugin_label(impl)
+
+        def timed(*args, **kwargs):
+            t_start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(plugin, hook_name, perf_counter() - t_start)
+
+        return timed
+
+    def hook_functions(self, hook_name):
+        """
+        The functions implementing `hook_name` in the order of
+        get_hookimpls(). Raises AttributeError for unknown hooks.
+        """
+        table = self._hook_functions
+        try:
+            return table[hook_name]
+        except KeyError:
+            pass
+        impls = getattr(self.hook, hook_name).get_hookimpls()
+        if self.hook_timing.enabled:
+            functions = tuple(self._timed(hook_name, impl) for impl in impls)
+        else:
+            functions = tuple(impl.function for impl in impls)
+        table[hook_name] = functions
+        return functions
+
+
 # pluggy doesn't by default handle chaining the output of one plugin into
 # another, so this is a small utility function to do this.
 # this utility function will chain the result of each hook into the first
 # argument of the next hook.
 def chain_hooks(hook_name, value, *args, **kwargs):
-    for impl in getattr(plugin_manager.hook, hook_name).get_hookimpls():
-        fn = getattr(impl, 'function')
+    functions = plugin_manager.hook_functions(hook_name)
+    if not functions:
+        return value
+    for fn in functions:
         value = fn(value, *args, **kwargs)
     return value
 
 
 def call_hook(hook_name, *args, **kwargs):
-    for impl in getattr(plugin_manager.hook, hook_name).get_hookimpls():
-        fn = getattr(impl, 'function')
+    for fn in plugin_manager.hook_functions(hook_name):
         value = fn(*args, **kwargs)
         if value is not None:
             return value
@@ -435,8 +600,7 @@ def call_hook(hook_name, *args, **kwargs):
 def collect_hook(hook_name, *args, **kwargs):
     result = []
     try:
-        for impl in getattr(plugin_manager.hook, hook_name).get_hookimpls():
-            fn = getattr(impl, 'function')
+        for fn in plugin_manager.hook_functions(hook_name):
             value = fn(*args, **kwargs)
             if value is not None:
                 result.append(value)
@@ -447,6 +611,6 @@ def collect_hook(hook_name, *args, **kwargs):
 
 # this plugin_manager is exported so the normal pluggy API can be used in
 # addition to the utility function above.
-plugin_manager = pluggy.PluginManager("otterwiki")
+plugin_manager = OtterwikiPluginManager("otterwiki")
 plugin_manager.add_hookspecs(OtterWikiPluginSpec)
 plugin_manager.load_setuptools_entrypoints("otterwiki")
@@ -16,8 +16,10 @@ from flask import (
 from flask_login import (
     current_user,
 )
-from otterwiki.server import app, db, update_app_config, Preferences
+from otterwiki.server import app, db, storage, update_app_config, Preferences
 from otterwiki.sidebar import SidebarPageIndex, SidebarMenu
+from otterwiki.plugins import plugin_manager
+from otterwiki.pluginmgmt import collect_plugin_info
 from otterwiki.helper import (
     toast,
     send_mail,
@@ -657,9 +659,43 @@ def repository_management_form(git_action_result=None):
         title="Repository Management",
         git_action_result=git_action_result,
         webhook_url=webhook_url,
+        commit_graph=storage.commit_graph.status(),
     )
 
 
+def plugins_form():
+    if not has_permission("ADMIN"):
+        abort(403)
+    return render_template(
+        "admin/plugins.html",
+        title="Plugins",
+        plugin_info=collect_plugin_info(),
+        plugin_distinfo=[
+            dist for _, dist in plugin_manager.list_plugin_distinfo()
+        ],
+        hook_timing_enabled=plugin_manager.hook_timing.enabled,
+        hook_timing=plugin_manager.hook_timing.stats(),
+    )
+
+
+def handle_plugins(form):
+    if not has_permission("ADMIN"):
+        abort(403)
+    action = form.get("hook_timing")
+    if action == "enable":
+        plugin_manager.enable_hook_timing(True)
+        toast("Recording the time spent in plugin hooks.")
+    elif action == "disable":
+        plugin_manager.enable_hook_timing(False)
+        toast("Stopped recording the time spent in plugin hooks.")
+    elif action == "reset":
+        plugin_manager.hook_timing.reset()
+        toast("The recorded plugin hook timing has been reset.")
+    else:
+        abort(400)
+    return redirect(url_for("admin_plugins"))
+
+
 def permissions_and_registration_form():
     if not has_permission("ADMIN"):
         abort(403)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+Incremental rendering of the editor preview.
+
+The editor sends the whole page for every preview, while most of a long
+page is unchanged between two previews. The PreviewRenderer splits the
+markdown where the mistune block parser finds a new top-level block after
+blank lines, and keeps the html of every block, keyed by a hash of the
+block. Only new and changed blocks are rendered, the html of the document
+is balanced as a whole. The result is identical to
+OtterwikiRenderer.markdown():
+
+- A block is rendered with the heading anchors of the blocks above it, so
+  that duplicate headings are numbered the same way. The html of a block
+  is only reused when its headings find the same anchors above them.
+- The toc entries of the blocks are renumbered.
+- The link reference definitions and abbreviations of the page are passed
+  to every block.
+- Pages with footnotes or frontmatter and html postprocessing plugins
+  require rendering the whole page.
+
+The html is returned in slices, roughly one per block, so that the
+editor can request only the slices it doesn't already show.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+
+from mistune.block_parser import BlockParser
+from mistune.core import BlockState
+
+from otterwiki.htmlbalancer import HtmlBalancer
+from otterwiki.plugins import chain_hooks, plugin_manager
+from otterwiki.renderer import RenderContext
+from otterwiki.util import cursormagicword, slugify
+
+# the maximum size of the rendered blocks kept in memory, in characters
+PREVIEW_CACHE_SIZE = 8 * 1024 * 1024
+
+# a rough estimate of the memory used by a block besides the html
+ENTRY_OVERHEAD = 256
+
+# the environment of mistune the blocks share: the link reference
+# definitions and the abbreviations
+SHARED_KEYS = ("ref_links", "ref_abbrs")
+
+# the environment of mistune that requires rendering the whole document:
+# the footnotes are numbered and appended to the end, the frontmatter can
+# add a title
+DOCUMENT_KEYS = ("def_footnotes", "frontmatter")
+
+
+class _BlockState(BlockState):
+    """
+    Records where the top-level blocks after blank lines start. Everything
+    before such a position is parsed the same way without the rest of the
+    document, and the rest the same way without what is before.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.block_starts = []
+        self._after_blank_line = None
+
+    def _new_token(self, token_type):
+        if self.parent is not None:
+            return
+        if self._after_blank_line is not None:
+            self.block_starts.append(self._after_blank_line)
+            self._after_blank_line = None
+        if token_type == "blank_line":
+            # the blank lines are parsed in one go, the next token starts
+            # after them. Other blocks, e.g. abbreviations, add blank_line
+            # tokens too.
+            m = BlockParser.BLANK_LINE.match(self.src, self.cursor)
+            if m is not None:
+                self._after_blank_line = m.end()
+
+    def append_token(self, token):
+        self._new_token(token["type"])
+        super().append_token(token)
+
+    def add_paragraph(self, text):
+        last_token = self.last_token()
+        if not last_token or last_token["type"] != "paragraph":
+            self._new_token("paragraph")
+        super().add_paragraph(text)
+
+
+def split_blocks(md, text):
+    """
+    Split the markdown `text` into the top-level blocks the mistune parser
+    `md` finds. Returns the blocks and the environment they share, or None
+    if the text uses constructs that require rendering the whole document.
+    """
+    # the same preparations as in mistune.Markdown.parse()
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if not text.endswith("\n"):
+        text += "\n"
+    state = _BlockState()
+    state.process(text)
+    for hook in md.before_parse_hooks:
+        hook(md, state)
+    md.block.parse(state)
+    for key in DOCUMENT_KEYS:
+        if key in state.env and (key == "frontmatter" or state.env[key]):
+            return None
+    env = {key: state.env.get(key) or {} for key in SHARED_KEYS}
+    # a block starting with --- would be parsed as frontmatter
+    starts = [0] + [
+        start
+        for start in state.block_starts
+        if not state.src.startswith("---\n", start)
+    ]
+    starts.append(len(state.src))
+    blocks = [state.src[a:b] for a, b in zip(starts, starts[1:]) if a < b]
+    return blocks, env
+
+
+class _Block:
+    __slots__ = ("html", "toc", "anchors", "seed", "requirements", "size")
+
+    def __init__(self, html, toc, anchors, seed, requirements):
+        self.html = html
+        self.toc = toc
+        # the anchors of the headings before numbering duplicates and the
+        # numbers of these anchors in the blocks above at render time
+        self.anchors = anchors
+        self.seed = seed
+        self.requirements = requirements
+        self.size = len(html) + ENTRY_OVERHEAD
+
+
+class PreviewRenderer:
+    """
+    Renders previews with `renderer`, an OtterwikiRenderer or a
+    RendererPool. The optional `render_cache` provides the signature of
+    the configuration and the plugins, which is part of the block keys.
+    """
+
+    def __init__(
+        self, renderer, render_cache=None, max_size=PREVIEW_CACHE_SIZE
+    ):
+        self.renderer = renderer
+        self.render_cache = render_cache
+        self.max_size = max_size
+        self._lock = Lock()
+        self._blocks = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, anchors):
+        """The block for `key` rendered with the same `anchors` above."""
+        with self._lock:
+            # the renders of a block, by the anchors above
+            renders = self._blocks.get(key)
+            if renders is None:
+                return None
+            self._blocks.move_to_end(key)
+            block_anchors = next(iter(renders.values())).anchors
+            return renders.get(
+                tuple(anchors.get(anchor) for anchor in block_anchors)
+            )
+
+    def _put(self, key, block):
+        if block.size > self.max_size:
+            return
+        with self._lock:
+            renders = self._blocks.setdefault(key, {})
+            self._blocks.move_to_end(key)
+            previous = renders.pop(block.seed, None)
+            if previous is not None:
+                self._size -= previous.size
+            renders[block.seed] = block
+            self._size += block.size
+            while self._size > self.max_size:
+                _, dropped = self._blocks.popitem(last=False)
+                self._size -= sum(block.size for block in dropped.values())
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    def _render_block(self, text, env, anchors, kwargs):
+        """
+        Render the block `text` with the shared `env` and the heading
+        `anchors` of the blocks above. Returns None if the block redefines
+        the shared environment.
+        """
+        renderer = self.renderer
+        context = RenderContext()
+        context.toc_anchors = dict(anchors)
+        state = BlockState()
+        for key, value in env.items():
+            state.env[key] = dict(value)
+        html = renderer.render_markdown(
+            text, context=context, state=state, **kwargs
+        )
+        if any(state.env[key] != value for key, value in env.items()):
+            # e.g. an abbreviation defined twice
+            return None, False
+        if cursormagicword in html:
+            html = renderer.show_cursor(html)
+        block_anchors = [slugify(raw) for _, _, _, raw, _ in context.toc_tree]
+        block = _Block(
+            html,
+            context.toc_tree,
+            block_anchors,
+            tuple(anchors.get(anchor) for anchor in block_anchors),
+            renderer.library_requirements(context),
+        )
+        return block, context.has_embeddings
+
+    def _markdown(self, text, cursor, kwargs):
+        html, toc, library_requirements = self.renderer.markdown(
+            text, cursor=cursor, **kwargs
+        )
+        return [html], toc, library_requirements
+
+    def render(self, text, cursor=None, **kwargs):
+        """
+        The preview of `text` as (slices, toc, library_requirements), the
+        joined slices are the html renderer.markdown() returns.
+        """
+        if plugin_manager.hook_functions("renderer_html_postprocess"):
+            return self._markdown(text, cursor, kwargs)
+        renderer = self.renderer
+        source = text
+        text = chain_hooks("renderer_markdown_preprocess", text)
+        if len(text) < 1 or text[-1] != "\n":
+            text += "\n"
+        line = 0
+        if cursor is not None:
+            text, line = renderer.place_cursor(text, cursor)
+        split = split_blocks(renderer.mistune, text)
+        if split is None:
+            return self._markdown(source, cursor, kwargs)
+        blocks, env = split
+        signature = json.dumps(env, sort_keys=True)
+        if self.render_cache is not None:
+            signature += self.render_cache.key("", **kwargs)
+
+        htmls = []
+        if cursor is not None and line == 0:
+            htmls.append(renderer.htmlcursor)
+        toc = []
+        anchors = {}
+        library_requirements = renderer.library_requirements(RenderContext())
+        for block_text in blocks:
+            key = hashlib.sha1(
+                (signature + "\0" + block_text).encode("utf-8")
+            ).hexdigest()
+            block = self._get(key, anchors)
+            if block is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                block, has_embeddings = self._render_block(
+                    block_text, env, anchors, kwargs
+                )
+                if block is None:
+                    return self._markdown(source, cursor, kwargs)
+                # embeddings might show other content of the repository
+                if not has_embeddings:
+                    self._put(key, block)
+            htmls.append(block.html)
+            for anchor in block.anchors:
+                anchors[anchor] = (
+                    anchors[anchor] + 1 if anchor in anchors else 0
+                )
+            toc += [
+                (
+                    len(toc) + i,
+                    title.replace(cursormagicword, ""),
+                    level,
+                    raw.replace(cursormagicword, ""),
+                    anchor,
+                )
+                for i, (_, title, level, raw, anchor) in enumerate(block.toc)
+            ]
+            for name, value in block.requirements.items():
+                library_requirements[name] = (
+                    library_requirements[name] or value
+                )
+
+        # balance the html as a whole and cut it after every block
+        balancer = HtmlBalancer()
+        slices = []
+        start = 0
+        for html in htmls:
+            balancer.feed(html)
+            slices.append("".join(balancer.output[start:]))
+            start = len(balancer.output)
+        balancer.close()
+        slices.append("".join(balancer.output[start:]))
+        return [s for s in slices if s], toc, library_requirements
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+A cache of rendered pages.
+
+Rendering a page (parsing the markdown, highlighting the code blocks and
+cleaning the html) is by far the most expensive part of a page view, while
+most views are repeated reads of unchanged pages. The cache stores the
+result of OtterwikiRenderer.markdown(), the html, the toc and the library
+requirements, and the meta description of the page, in a LRU in memory and
+in a SQLite database in the index directory shared by all processes. Both
+tiers are bounded by size.
+
+The key is the blob SHA of the markdown, a hash of the configuration, the
+loaded plugins with their versions and the arguments of markdown(). A
+changed page or a changed preference simply results in a different key.
+Embeddings can render other content of the repository, e.g. a table from
+an attachment, so pages with embeddings are only valid for the repository
+generation they were rendered in. They are dropped via the
+repository_changed hook, other processes notice the changed generation.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from otterwiki.commitindex import open_database
+from otterwiki.plugins import hookimpl, plugin_manager
+
+# the maximum size of the rendered pages kept in memory and on disk, in bytes
+MEMORY_SIZE = 32 * 1024 * 1024
+DISK_SIZE = 256 * 1024 * 1024
+
+# a rough estimate of the memory used by an entry besides the html
+ENTRY_OVERHEAD = 1024
+
+# the version of the stored values, part of the key
+FORMAT = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    filename TEXT,
+    generation INTEGER,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_filename ON pages (filename);
+CREATE INDEX IF NOT EXISTS pages_used ON pages (used);
+"""
+
+
+def blob_sha(content):
+    """The SHA git assigns to a blob with `content`."""
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    sha = hashlib.sha1(b"blob %d\0" % len(data))
+    sha.update(data)
+    return sha.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("result", "description", "filename", "generation", "size")
+
+    def __init__(self, result, description, filename, generation):
+        self.result = result
+        self.description = description
+        self.filename = filename
+        self.generation = generation
+        self.size = len(result[0]) + len(description) + ENTRY_OVERHEAD
+
+
+class RenderCache:
+    """
+    The rendered pages of the repository of `storage`. `config` is the
+    app.config the renderer uses.
+    """
+
+    def __init__(
+        self, storage, config, memory_size=MEMORY_SIZE, disk_size=DISK_SIZE
+    ):
+        self.storage = storage
+        self.config = config
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._lock = Lock()
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._db = None
+        self._git_dir = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def db(self):
+        """The disk tier, reopened whenever the repository changed."""
+        git_dir = self.storage.repo.git_dir
+        if self._db is None or self._git_dir != git_dir:
+            if self._db is not None:
+                self._db.close()
+            self._memory.clear()
+            self._memory_used = 0
+            self._db = open_database(git_dir, "render.sqlite3")
+            self._db.executescript(_SCHEMA)
+            self._git_dir = git_dir
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _config_signature(self):
+        # only values that can change the rendering, complex objects like
+        # the session lifetime are skipped
+        return sorted(
+            (key, value)
+            for key, value in self.config.items()
+            if isinstance(value, (str, int, float, bool, type(None)))
+        )
+
+    @staticmethod
+    def _plugin_signature():
+        versions = {
+            plugin: f"{dist.project_name}-{dist.version}"
+            for plugin, dist in plugin_manager.list_plugin_distinfo()
+        }
+        return sorted(
+            (name, versions.get(plugin, ""))
+            for name, plugin in plugin_manager.list_name_plugin()
+        )
+
+    def key(self, content, **kwargs):
+        """The cache key of rendering `content` with `kwargs`."""
+        signature = json.dumps(
+            [
+                FORMAT,
+                blob_sha(content),
+                self._config_signature(),
+                self._plugin_signature(),
+                sorted(kwargs.items()),
+            ],
+            default=str,
+        )
+        return hashlib.sha256(signature.encode()).hexdigest()
+
+    def _remember(self, key, entry):
+        """Add `entry` to the memory tier. Expects the lock to be held."""
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= previous.size
+        if entry.size > self.memory_size:
+            return
+        self._memory[key] = entry
+        self._memory_used += entry.size
+        while self._memory_used > self.memory_size:
+            _, dropped = self._memory.popitem(last=False)
+            self._memory_used -= dropped.size
+
+    def _forget(self, key):
+        """Drop `key` from the memory tier. Expects the lock to be held."""
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_used -= entry.size
+
+    def get(self, key):
+        """The cached (html, toc, library_requirements) or None."""
+        page = self.get_page(key)
+        return None if page is None else page[:3]
+
+    def get_page(self, key):
+        """
+        The cached (html, toc, library_requirements, description) or None.
+        """
+        generation = self.storage.generation
+        with self._lock:
+            db = self.db
+            entry = self._memory.get(key)
+            if entry is None:
+                row = db.execute(
+                    "SELECT filename, generation, value FROM pages"
+                    " WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None:
+                    html, toc, library_requirements, description = json.loads(
+                        row[2]
+                    )
+                    toc = [tuple(item) for item in toc]
+                    entry = _Entry(
+                        (html, toc, library_requirements),
+                        description,
+                        row[0],
+                        row[1],
+                    )
+                    db.execute(
+                        "UPDATE pages SET used = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    self._remember(key, entry)
+            else:
+                self._memory.move_to_end(key)
+            if entry is not None and entry.generation not in (
+                None,
+                generation,
+            ):
+                # rendered with embeddings in an older generation
+                self._forget(key)
+                db.execute("DELETE FROM pages WHERE key = ?", (key,))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        html, toc, library_requirements = entry.result
+        return html, list(toc), dict(library_requirements), entry.description
+
+    def put(
+        self, key, result, filename=None, embeddings=False, description=""
+    ):
+        """
+        Store the `result` of markdown() and the `description` of the page.
+        If the page has `embeddings` it is only valid for the current
+        generation of the repository.
+        """
+        generation = self.storage.generation if embeddings else None
+        entry = _Entry(result, description, filename, generation)
+        value = json.dumps([*result, description])
+        with self._lock:
+            self._remember(key, entry)
+            db = self.db
+            db.execute(
+                "INSERT OR REPLACE INTO pages"
+                " (key, filename, generation, size, used, value)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, filename, generation, len(value), time.time(), value),
+            )
+            # drop the least recently used pages beyond the size limit
+            db.execute(
+                "DELETE FROM pages WHERE key IN ("
+                " SELECT key FROM ("
+                "  SELECT key, SUM(size) OVER (ORDER BY used DESC) AS total"
+                "  FROM pages"
+                " ) WHERE total > ?"
+                ")",
+                (self.disk_size,),
+            )
+
+    def render(self, renderer, content, filename=None, **kwargs):
+        """
+        renderer.markdown(content, **kwargs), answered from the cache if
+        possible. `filename` is the file the content was loaded from.
+        """
+        return self.render_page(renderer, content, filename, **kwargs)[:3]
+
+    def render_page(self, renderer, content, filename=None, **kwargs):
+        """
+        Like render(), returns (html, toc, library_requirements,
+        description) with the meta description of the page.
+        """
+        key = self.key(content, **kwargs)
+        page = self.get_page(key)
+        if page is None:
+            result = renderer.markdown(content, **kwargs)
+            description = renderer.description
+            self.put(
+                key,
+                result,
+                filename,
+                renderer.has_embeddings,
+                description=description,
+            )
+            page = (*result, description)
+        return page
+
+    def invalidate(self, filenames):
+        """Drop the pages rendered from `filenames` and with embeddings."""
+        filenames = set(filenames)
+        with self._lock:
+            for key, entry in list(self._memory.items()):
+                if entry.filename in filenames or entry.generation is not None:
+                    self._forget(key)
+            db = self.db
+            db.execute("DELETE FROM pages WHERE generation IS NOT NULL")
+            db.executemany(
+                "DELETE FROM pages WHERE filename = ?",
+                [(filename,) for filename in filenames],
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            self.db.execute("DELETE FROM pages")
+
+    @hookimpl
+    def repository_changed(self, changed_files):
+        self.invalidate(changed_files)
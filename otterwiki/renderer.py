@@ -2,9 +2,15 @@
 # vim: set et ts=8 sts=4 sw=4 ai:
 
 import re
+import hashlib
+import textwrap
 import mistune
 import urllib.parse
+from collections import OrderedDict
+from functools import lru_cache
 from html import unescape
+from html.parser import HTMLParser
+from threading import Lock, local
 from bs4 import BeautifulSoup
 from markupsafe import Markup, escape
 from mistune.plugins.formatting import strikethrough as plugin_strikethrough
@@ -17,6 +23,7 @@ from pygments import highlight
 from pygments.lexers import get_lexer_by_name
 from pygments.util import ClassNotFound
 
+from otterwiki.htmlbalancer import balance_html
 from otterwiki.plugins import chain_hooks
 from otterwiki.renderer_plugins import (
     mistunePluginAlerts,
@@ -54,6 +61,10 @@ mistune.helpers.LINK_TITLE_RE = re.compile(  # pyright: ignore
 )
 
 
+# the maximum size of the highlighted code blocks kept in memory, in characters
+HIGHLIGHT_CACHE_SIZE = 8 * 1024 * 1024
+
+
 def _pre_copy_to_clipboard_tag():
     return f"""<div class="copy-to-clipboard-outer"><div class="copy-to-clipboard-inner"><button class="btn alt-dm btn-xsm copy-to-clipboard" type="button"  onclick="otterwiki.copy_to_clipboard(this);"><i class="fa fa-copy" aria-hidden="true" alt="Copy to clipboard""></i></button></div><pre class="copy-to-clipboard code">"""
 
@@ -66,10 +77,79 @@ class CodeHtmlFormatter(HtmlFormatter):
         yield 0, '</pre></div>'
 
 
-def pygments_render(code, lang, linenumbers=False):
+@lru_cache(maxsize=256)
+def _get_lexer(lang):
+    # the lexers don't keep state between calls, so one instance per
+    # language is shared by all renders. None for unknown languages.
     try:
-        lexer = get_lexer_by_name(lang.strip(), stripall=False)
+        return get_lexer_by_name(lang, stripall=False)
     except ClassNotFound:
+        return None
+
+
+@lru_cache(maxsize=2)
+def _get_formatter(linenumbers):
+    linenos = "table" if linenumbers else None
+    return CodeHtmlFormatter(classprefix=".highlight ", linenos=linenos)
+
+
+class HighlightCache:
+    """
+    A LRU of highlighted code blocks, bounded by the size of the html in
+    characters. Shared by the renderer and the source and blame views.
+    """
+
+    def __init__(self, max_size=HIGHLIGHT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(code, lang, linenumbers):
+        return (
+            hashlib.sha1(code.encode("utf-8")).hexdigest(),
+            lang,
+            bool(linenumbers),
+        )
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        if len(html) > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = html
+            self._size += len(html)
+            while self._size > self.max_size:
+                _, dropped = self._entries.popitem(last=False)
+                self._size -= len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+highlight_cache = HighlightCache()
+
+
+def pygments_render(code, lang, linenumbers=False):
+    lexer = _get_lexer(lang.strip())
+    if lexer is None:
         return (
             '\n'
             + _pre_copy_to_clipboard_tag()
@@ -79,15 +159,18 @@ def pygments_render(code, lang, linenumbers=False):
                 mistune.escape(code),
             )
         )
-    linenos = "table" if linenumbers else None
-    formatter = CodeHtmlFormatter(classprefix=".highlight ", linenos=linenos)
-    html = highlight(code, lexer, formatter)
+    key = highlight_cache.key(code, lang.strip(), linenumbers)
+    html = highlight_cache.get(key)
+    if html is not None:
+        return html
+    html = highlight(code, lexer, _get_formatter(bool(linenumbers)))
     # make sure wikilinks are not present in the code block
     html = (
         html.replace("&#39;", "&apos;")
         .replace("[", "&#91;")
         .replace("]", "&#93;")
     )
+    highlight_cache.put(key, html)
     return html
 
 
@@ -167,7 +250,7 @@ def normalize_url_for_protocol_check(value: str) -> str:
     the protocol of an url: decode html entities, drop control characters
     and whitespace, lowercase.
 
-    BeautifulSoup already decodes entities while parsing, the additional
+    The html parser already decodes entities while parsing, the additional
     unescape() guards against values that carry another layer of encoding.
     """
     # decode entities the parser may have left behind, e.g. "&amp;#106;"
@@ -178,6 +261,142 @@ def normalize_url_for_protocol_check(value: str) -> str:
     return _URL_STRIP_RE.sub("", decoded).lower()
 
 
+# tags and attrs are logically groupped by types
+# fmt: off
+ALLOWED_TAGS = [
+    'p', 'br', 'hr', 'span', 'div', 'i',
+    'strong', 'em', 'b', 'i', 'u', 's', 'strike', 'del', 'ins', 'sub', 'sup', 'mark', 'small',
+    'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'code', 'pre', 'kbd', 'samp', 'var',
+    'blockquote', 'q', 'cite',
+    'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th', 'caption', 'col', 'colgroup',
+    'a', 'img',
+    'abbr', 'address', 'time', 'details', 'summary',
+    'video', 'audio', 'source',
+    'input','label'
+]
+
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title', 'name', 'id', 'class'],
+    'img': ['src', 'alt', 'title', 'width', 'height', 'class'],
+    'abbr': ['title'],
+    'time': ['datetime'],
+    'td': ['colspan', 'rowspan', 'align', 'valign', 'width'],
+    'th': ['colspan', 'rowspan', 'align', 'valign', 'scope', 'width'],
+    'col': ['span', 'width'],
+    'colgroup': ['span', 'width'],
+    'table': ['border', 'cellpadding', 'cellspacing', 'width'],
+    'video': ['controls', 'width', 'height', 'poster'],
+    'source': ['src', 'type'],
+    'audio': ['controls', 'src'],
+    'input': ['type', 'checked', 'id', 'value'],
+    'label': ['for'],
+    'span' : ['role'],
+    # generic attributes allowed on most tags
+    '*': ['id', 'class', 'title', 'style'],
+}
+# fmt: on
+
+DANGEROUS_PROTOCOLS = (
+    'javascript:',
+    'data:',
+    'vbscript:',
+    'file:',
+    'about:',
+)
+
+# a single tag without attributes, e.g. <br>, <br />, <kbd> or </kbd>
+_TRIVIAL_TAG_RE = re.compile(r"</?([a-zA-Z][a-zA-Z0-9]*)\s*/?>")
+
+
+class _UnsafeHtml(Exception):
+    pass
+
+
+class _SanitizerParser(HTMLParser):
+    """Stops at the first tag or attribute the `sanitizer` doesn't allow."""
+
+    def __init__(self, sanitizer):
+        super().__init__()
+        self.sanitizer = sanitizer
+
+    def handle_starttag(self, tag, attrs):
+        if not self.sanitizer.allowed_tag(tag, attrs):
+            raise _UnsafeHtml(tag)
+
+
+class HtmlSanitizer:
+    """
+    Checks html fragments against an allowlist of tags and attributes,
+    computed once from the defaults and the `custom_tags` and
+    `custom_attributes` of RENDERER_HTML_ALLOWLIST. Fragments consisting of
+    a single allowed tag without attributes are accepted without parsing,
+    everything else is checked in a single pass of the tokenizer.
+    """
+
+    def __init__(self, custom_tags=None, custom_attributes=None):
+        tags = set(ALLOWED_TAGS)
+        tags.update(tag for tag in custom_tags or [] if tag)
+        self.tags = frozenset(tags)
+        attributes = {
+            tag: list(attrs) for tag, attrs in ALLOWED_ATTRIBUTES.items()
+        }
+        for tag_name, attrs in (custom_attributes or {}).items():
+            attributes[tag_name] = attributes.get(tag_name, []) + attrs
+        generic = attributes.get('*', [])
+        self.attributes = {
+            tag: frozenset(attrs + generic)
+            for tag, attrs in attributes.items()
+        }
+        self.generic_attributes = frozenset(generic)
+
+    def allowed_tag(self, tag, attrs):
+        tag = tag.lower()
+        if tag not in self.tags:
+            return False
+        allowed_attrs = self.attributes.get(tag, self.generic_attributes)
+        for name, value in attrs:
+            name = name.lower()
+            if name not in allowed_attrs:
+                return False
+            # every value is checked, browsers use the first of duplicate
+            # attributes
+            if name in URL_ATTRIBUTES and value:
+                if normalize_url_for_protocol_check(value).startswith(
+                    DANGEROUS_PROTOCOLS
+                ):
+                    return False
+        return True
+
+    def is_safe(self, html):
+        m = _TRIVIAL_TAG_RE.fullmatch(html)
+        if m is not None and m.group(1).lower() in self.tags:
+            return True
+        parser = _SanitizerParser(self)
+        try:
+            parser.feed(html)
+            parser.close()
+        except _UnsafeHtml:
+            return False
+        return True
+
+    def clean(self, html):
+        """`html` if it is safe, escaped otherwise."""
+        if self.is_safe(html):
+            return html
+        # take no prisoners
+        return escape(html)
+
+
+@lru_cache(maxsize=16)
+def _get_sanitizer(custom_tags, custom_attributes):
+    return HtmlSanitizer(
+        list(custom_tags),
+        {tag: list(attrs) for tag, attrs in custom_attributes},
+    )
+
+
 def clean_html(
     html: str, custom_tags: list = None, custom_attributes: dict = None
 ) -> str:
@@ -189,144 +408,129 @@ def clean_html(
     - Dangerous protocols (javascript:, data:)
     - Dangerous tags (object, embed, iframe, svg with events, etc.)
     """
+    sanitizer = _get_sanitizer(
+        tuple(custom_tags or ()),
+        tuple(
+            (tag, tuple(attrs))
+            for tag, attrs in (custom_attributes or {}).items()
+        ),
+    )
+    return sanitizer.clean(html)
 
-    # tags and attrs are logically groupped by types
-    # fmt: off
-    ALLOWED_TAGS = [
-        'p', 'br', 'hr', 'span', 'div', 'i',
-        'strong', 'em', 'b', 'i', 'u', 's', 'strike', 'del', 'ins', 'sub', 'sup', 'mark', 'small',
-        'ul', 'ol', 'li', 'dl', 'dt', 'dd',
-        'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-        'code', 'pre', 'kbd', 'samp', 'var',
-        'blockquote', 'q', 'cite',
-        'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th', 'caption', 'col', 'colgroup',
-        'a', 'img',
-        'abbr', 'address', 'time', 'details', 'summary',
-        'video', 'audio', 'source',
-        'input','label'
-    ]
 
-    ALLOWED_ATTRIBUTES = {
-        'a': ['href', 'title', 'name', 'id', 'class'],
-        'img': ['src', 'alt', 'title', 'width', 'height', 'class'],
-        'abbr': ['title'],
-        'time': ['datetime'],
-        'td': ['colspan', 'rowspan', 'align', 'valign', 'width'],
-        'th': ['colspan', 'rowspan', 'align', 'valign', 'scope', 'width'],
-        'col': ['span', 'width'],
-        'colgroup': ['span', 'width'],
-        'table': ['border', 'cellpadding', 'cellspacing', 'width'],
-        'video': ['controls', 'width', 'height', 'poster'],
-        'source': ['src', 'type'],
-        'audio': ['controls', 'src'],
-        'input': ['type', 'checked', 'id', 'value'],
-        'label': ['for'],
-        'span' : ['role'],
-        # generic attributes allowed on most tags
-        '*': ['id', 'class', 'title', 'style'],
-    }
-    # fmt: on
-
-    DANGEROUS_PROTOCOLS = [
-        'javascript:',
-        'data:',
-        'vbscript:',
-        'file:',
-        'about:',
+class RenderContext:
+    """
+    The state of a single OtterwikiRenderer.markdown() call: the table of
+    contents and the javascript libraries the page requires.
+    """
+
+    def __init__(self):
+        self.toc_count = 0
+        self.toc_tree = []
+        self.toc_anchors = {}
+        self.requires_mermaid = False
+        self.requires_mathjax = False
+        # set when an embedding was rendered, their output might depend on
+        # other content of the repository
+        self.has_embeddings = False
+        self.description = ""
+
+
+# the maximum length of the description of a page, used in og:description
+DESCRIPTION_LENGTH = 254
+
+# the inline tokens, all other tokens with children are blocks, which are
+# separated by a new line in the text of the description
+_INLINE_TOKENS = frozenset(
+    [
+        "text",
+        "emphasis",
+        "strong",
+        "codespan",
+        "link",
+        "strikethrough",
+        "mark",
+        "wikilink",
+        "math_inline",
+        "math_display_inline",
+        "abbr",
+        "footnote_ref",
     ]
+)
 
-    # extend with custom user-defined tags and attributes
-    if custom_tags:
-        for tag_name in custom_tags:
-            if tag_name and tag_name not in ALLOWED_TAGS:
-                ALLOWED_TAGS.append(tag_name)
-
-    if custom_attributes:
-        for tag_name, attrs in custom_attributes.items():
-            if tag_name in ALLOWED_ATTRIBUTES:
-                ALLOWED_ATTRIBUTES[tag_name] = (
-                    ALLOWED_ATTRIBUTES[tag_name] + attrs
-                )
-            else:
-                ALLOWED_ATTRIBUTES[tag_name] = attrs
+# tokens without text in the description
+_DESCRIPTION_SKIP = frozenset(
+    [
+        "image",
+        "inline_html",
+        "embedding_block",
+        "frontmatter",
+        "footnotes",
+    ]
+)
 
-    soup = BeautifulSoup(html, 'html.parser')
-    _escape = False
 
-    for element in soup.find_all(True):
-        if not hasattr(element, 'name') or element.name is None:
+def _description_text(tokens, parts, length):
+    """Collect the text of `tokens` in `parts` until it exceeds `length`."""
+    for token in tokens:
+        if length < 0:
+            return length
+        token_type = token["type"]
+        if token_type in _DESCRIPTION_SKIP:
             continue
-
-        if element.name.lower() not in ALLOWED_TAGS:
-            _escape = True
-            break
-
-        if hasattr(element, 'attrs'):
-            tag_name_lower = element.name.lower()
-            allowed_attrs = ALLOWED_ATTRIBUTES.get(
-                tag_name_lower, []
-            ) + ALLOWED_ATTRIBUTES.get('*', [])
-
-            for attr_name, attr_value in list(element.attrs.items()):
-                attr_name_lower = attr_name.lower()
-
-                if attr_name_lower not in allowed_attrs:
-                    _escape = True
-                    break
-
-                if attr_name_lower in URL_ATTRIBUTES:
-                    if isinstance(attr_value, str):
-                        attr_normalized = normalize_url_for_protocol_check(
-                            attr_value
-                        )
-                        for protocol in DANGEROUS_PROTOCOLS:
-                            if attr_normalized.startswith(protocol):
-                                _escape = True
-                                break
-
-                if _escape:
-                    break
-
-        if _escape:
-            break
-
-    if _escape:
-        # take no prisoners
-        html = escape(html)
-
-    return html
+        if token_type in ("softbreak", "linebreak"):
+            parts.append("\n")
+            length -= 1
+        elif "children" in token:
+            length = _description_text(token["children"], parts, length)
+        elif token_type == "block_html":
+            text = unescape(mistune_striptags(token.get("raw", "")))
+            parts.append(text)
+            length -= len(text)
+        elif isinstance(token.get("raw"), str):
+            parts.append(token["raw"])
+            length -= len(token["raw"])
+        if token_type not in _INLINE_TOKENS:
+            parts.append("\n")
+    return length
+
+
+def page_description(tokens, length=DESCRIPTION_LENGTH):
+    """
+    The text of the page parsed into the mistune `tokens`, used as meta
+    description: without the heading the page starts with, the lines
+    separated by middle dots and shortened to `length`.
+    """
+    tokens = [token for token in tokens if token["type"] != "blank_line"]
+    if tokens and tokens[0]["type"] == "heading":
+        tokens = tokens[1:]
+    parts = []
+    _description_text(tokens, parts, 2 * length)
+    description = re.sub(r"[\n]+", "\n", "".join(parts).strip())
+    # add a seperator for better readability, but not directly after a
+    # punctuation mark
+    description = description.replace("\n", "·")
+    description = re.sub(r"([!.:,])\s*·", r"\1 ", description)
+    return textwrap.shorten(description, width=length, placeholder="…")
 
 
 class OtterwikiMdRenderer(mistune.HTMLRenderer):
-    toc_count = 0
-    toc_tree = []
-    toc_anchors = {}
-
     def __init__(self, env, custom_allowlist=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.env = env
+        self.context = RenderContext()
         self.custom_tags, self.custom_attributes = parse_custom_allowlist(
             custom_allowlist
         )
+        self.sanitizer = HtmlSanitizer(
+            self.custom_tags, self.custom_attributes
+        )
 
     def inline_html(self, html):
-        return clean_html(
-            html,
-            custom_tags=self.custom_tags,
-            custom_attributes=self.custom_attributes,
-        )
+        return self.sanitizer.clean(html)
 
     def block_html(self, html):
-        return clean_html(
-            html,
-            custom_tags=self.custom_tags,
-            custom_attributes=self.custom_attributes,
-        )
-
-    def reset_toc(self):
-        self.toc_count = 0
-        self.toc_tree = []
-        self.toc_anchors = {}
+        return self.sanitizer.clean(html)
 
     def image(self, text, url="", title=None):
         # text is rendered alt children; strip tags for the alt attribute
@@ -374,7 +578,7 @@ class OtterwikiMdRenderer(mistune.HTMLRenderer):
 
         # escape the url again for the html attribute context. escape_url
         # leaves a bare '&' behind (its internal unescape undoes the escaping
-        # done by safe_url), which the final BeautifulSoup pass would otherwise
+        # done by safe_url), which the final balance_html pass would otherwise
         # decode as an html entity, e.g. a trailing &reg becoming ® (issue #545)
         attrs.append('href="{}"'.format(mistune.escape(link)))
 
@@ -454,15 +658,16 @@ class OtterwikiMdRenderer(mistune.HTMLRenderer):
     def heading(self, text, level, **attrs):
         raw = Markup(text).striptags()
         anchor = slugify(raw)
+        toc_anchors = self.context.toc_anchors
         try:
-            self.toc_anchors[anchor] += 1
-            anchor = "{}-{}".format(anchor, self.toc_anchors[anchor])
+            toc_anchors[anchor] += 1
+            anchor = "{}-{}".format(anchor, toc_anchors[anchor])
         except KeyError:
-            self.toc_anchors[anchor] = 0
+            toc_anchors[anchor] = 0
 
         rv = '<h{level} id="{anchor}">{text}<a href="#{anchor}" class="anchor"><i class="fas fa-link"></i></a></h{level}>\n'.format(
             level=level,
-            count=self.toc_count,
+            count=self.context.toc_count,
             text=text,
             anchor=anchor,
         )
@@ -476,8 +681,10 @@ class OtterwikiMdRenderer(mistune.HTMLRenderer):
             self.env.get('page'),
         )
 
-        self.toc_tree.append((self.toc_count, text, level, raw, anchor))
-        self.toc_count += 1
+        self.context.toc_tree.append(
+            (self.context.toc_count, text, level, raw, anchor)
+        )
+        self.context.toc_count += 1
         return processed_html
 
 
@@ -612,8 +819,6 @@ class OtterwikiRenderer:
         self.env = {
             "config": config,
         }
-        self.requires_mermaid = False
-        self.requires_mathjax = False
         self.requires_datatables = True
 
         custom_allowlist = (
@@ -669,10 +874,137 @@ class OtterwikiRenderer:
         # we can enable tables in lists
         table_in_list(self.mistune)
 
+    @property
+    def context(self):
+        """The RenderContext of the current or last markdown() call."""
+        return self.md_renderer.context
+
+    @property
+    def requires_mermaid(self):
+        return self.context.requires_mermaid
+
+    @requires_mermaid.setter
+    def requires_mermaid(self, value):
+        self.context.requires_mermaid = value
+
+    @property
+    def requires_mathjax(self):
+        return self.context.requires_mathjax
+
+    @requires_mathjax.setter
+    def requires_mathjax(self, value):
+        self.context.requires_mathjax = value
+
+    @property
+    def has_embeddings(self):
+        return self.context.has_embeddings
+
+    @has_embeddings.setter
+    def has_embeddings(self, value):
+        self.context.has_embeddings = value
+
+    @property
+    def description(self):
+        """The meta description of the last page rendered."""
+        return self.context.description
+
+    def place_cursor(self, text, cursor):
+        """
+        Add the cursormagicword to the line `cursor` of `text`, or the
+        nearest line above it which can hold the cursor. Returns the text
+        and the line, 0 if the cursor is placed in front of the page.
+        """
+        text_arr = text.splitlines()
+        try:
+            line = min(len(text_arr) - 1, int(cursor) + 1)
+        except ValueError:
+            line = 0
+        # find a line to place the cursor
+        while line > 0 and (
+            (
+                not len(self.lastword.findall(text_arr[line])) > 0
+                and not any(
+                    p.search(text_arr[line]) for p in self.contentlines
+                )
+            )
+            or text_arr[line].startswith("---")  # --- (hr) needs extra space
+        ):
+            line -= 1
+        if line > 0:
+            if len(self.lastword.findall(text_arr[line])) > 0:
+                # add empty span after the last word of the edited line
+                text_arr[line] = self.lastword.sub(
+                    r"\1{}".format(cursormagicword),
+                    text_arr[line],
+                    count=1,
+                )
+            else:
+                # no trailing word (e.g. a line ending with an image
+                # or link), append the cursor right after it
+                text_arr[line] = text_arr[line] + cursormagicword
+            text = "\n".join(text_arr)
+        return text, line
+
+    def show_cursor(self, html):
+        """Replace the cursormagicword in `html` with the cursor span."""
+        # we have to make sure that the cursormagicword is not placed inside an element
+        # which might break the html after replacing it with self.htmlcursor
+
+        # find the line with the magic word
+        lines = html.splitlines(True)
+        for i, line in enumerate(lines):
+            if cursormagicword in line:
+                # parse with bs4
+                soup = BeautifulSoup(line, 'html.parser')
+                prepend_cursor = False
+                for element in soup.find_all():
+                    for attr_key, attr_value in element.attrs.items():
+                        if cursormagicword in attr_value:
+                            prepend_cursor = True
+                            # remove cursormagicword from attr
+                            element.attrs[attr_key] = attr_value.replace(
+                                cursormagicword, ""
+                            )
+                    if prepend_cursor:
+                        element.insert_before(cursormagicword)
+                # only use the bs4 string if it has been used
+                if prepend_cursor:
+                    line = str(soup)
+                lines[i] = line.replace(cursormagicword, self.htmlcursor)
+                # dont check other lines, there is only one cursor.
+                break
+
+        return "".join(lines)
+
+    def render_markdown(self, text, context=None, state=None, **kwargs):
+        """
+        Render the preprocessed `text` with mistune, without the final
+        postprocessing. The state of the render is kept in `context`, the
+        state of the parser in the mistune BlockState `state`.
+        """
+        self.md_renderer.context = context or RenderContext()
+        # store extra kwargs in environment
+        for k, v in kwargs.items():
+            self.env[k.upper()] = v
+        try:
+            html, state = self.mistune.parse(text, state)
+            # the tokens are complete after rendering
+            self.context.description = page_description(state.tokens)
+            return html
+        finally:
+            # clean extra kwargs from environment
+            for k in kwargs:
+                self.env.pop(k.upper(), None)
+
+    def library_requirements(self, context=None):
+        context = context or self.context
+        return {
+            'requires_mermaid': context.requires_mermaid,
+            'requires_mathjax': context.requires_mathjax,
+            'requires_datatables': self.requires_datatables,
+        }
+
     def markdown(self, text, cursor=None, **kwargs):
-        self.md_renderer.reset_toc()
-        self.requires_mermaid = False
-        self.requires_mathjax = False
         # do the preparsing
         text = chain_hooks("renderer_markdown_preprocess", text)
         # to avoid that preparsing removes the trailing newline and to be
@@ -683,80 +1015,16 @@ class OtterwikiRenderer:
 
         # add cursor position
         if cursor is not None:
-            text_arr = text.splitlines()
-            try:
-                line = min(len(text_arr) - 1, int(cursor) + 1)
-            except ValueError:
-                line = 0
-            # find a line to place the cursor
-            while line > 0 and (
-                (
-                    not len(self.lastword.findall(text_arr[line])) > 0
-                    and not any(
-                        p.search(text_arr[line]) for p in self.contentlines
-                    )
-                )
-                or text_arr[line].startswith(
-                    "---"
-                )  # --- (hr) needs extra space
-            ):
-                line -= 1
-            if line > 0:
-                if len(self.lastword.findall(text_arr[line])) > 0:
-                    # add empty span after the last word of the edited line
-                    text_arr[line] = self.lastword.sub(
-                        r"\1{}".format(cursormagicword),
-                        text_arr[line],
-                        count=1,
-                    )
-                else:
-                    # no trailing word (e.g. a line ending with an image
-                    # or link), append the cursor right after it
-                    text_arr[line] = text_arr[line] + cursormagicword
-                text = "\n".join(text_arr)
+            text, line = self.place_cursor(text, cursor)
         else:
             line = 0
 
-        # store extra kwargs in environment
-        for k, v in kwargs.items():
-            self.env[k.upper()] = v
-        html = self.mistune(text)
-        # clean extra kwargs from environment
-        for k, v in kwargs.items():
-            del self.env[k.upper()]
+        html = self.render_markdown(text, **kwargs)
         # generate the toc
-        toc = self.md_renderer.toc_tree.copy()
+        toc = self.context.toc_tree.copy()
         if cursor is not None and line > 0:
             # replace the magic word with the cursor span
-
-            # we have to make sure that the cursormagicword is not placed inside an element
-            # which might break the html after replacing it with self.htmlcursor
-
-            # find the line with the magic word
-            lines = html.splitlines(True)
-            for i, line in enumerate(lines):
-                if cursormagicword in line:
-                    # parse with bs4
-                    soup = BeautifulSoup(line, 'html.parser')
-                    prepend_cursor = False
-                    for element in soup.find_all():
-                        for attr_key, attr_value in element.attrs.items():
-                            if cursormagicword in attr_value:
-                                prepend_cursor = True
-                                # remove cursormagicword from attr
-                                element.attrs[attr_key] = attr_value.replace(
-                                    cursormagicword, ""
-                                )
-                        if prepend_cursor:
-                            element.insert_before(cursormagicword)
-                    # only use the bs4 string if it has been used
-                    if prepend_cursor:
-                        line = str(soup)
-                    lines[i] = line.replace(cursormagicword, self.htmlcursor)
-                    # dont check other lines, there is only one cursor.
-                    break
-
-            html = "".join(lines)
+            html = self.show_cursor(html)
         elif cursor is not None:
             html = self.htmlcursor + html
 
@@ -774,22 +1042,40 @@ class OtterwikiRenderer:
             for (a, b, c, d, e) in toc
         ]
 
-        # make sure the page content is clean html.
-        # we shove it through BeautifulSoup.prettify this will get rid
-        # of wrong placed tags, too many closed tags and so on.
-        soup = BeautifulSoup(html, 'html.parser')
-        html = str(soup)
+        # make sure the page content is clean html: close unclosed tags,
+        # drop unmatched end tags and so on.
+        html = balance_html(html)
 
-        return (
-            html,
-            toc,
-            {
-                'requires_mermaid': self.requires_mermaid,
-                'requires_mathjax': self.requires_mathjax,
-                'requires_datatables': self.requires_datatables,
-            },
-        )
+        return html, toc, self.library_requirements()
+
+
+class RendererPool:
+    """
+    The renderers are not thread-safe: a markdown() call keeps its state,
+    e.g. the toc and the arguments, in the renderer. The pool creates one
+    OtterwikiRenderer per thread and passes all calls and attributes on to
+    the renderer of the current thread.
+    """
+
+    def __init__(self, config={}):
+        self.config = config
+        self._local = local()
+
+    @property
+    def renderer(self):
+        """The OtterwikiRenderer of the current thread."""
+        renderer = getattr(self._local, "renderer", None)
+        if renderer is None:
+            renderer = OtterwikiRenderer(config=self.config)
+            self._local.renderer = renderer
+        return renderer
+
+    def markdown(self, text, cursor=None, **kwargs):
+        return self.renderer.markdown(text, cursor=cursor, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.renderer, name)
 
 
 # unconfigured renderer for testing and rendering about()
-render = OtterwikiRenderer()
+render = RendererPool()
@@ -745,9 +745,6 @@ class mistunePluginWikiLink:
     )
     WIKI_LINK_MOD_RE = re.compile(WIKI_LINK_MOD)
 
-    def __init__(self):
-        self.env = {}
-
     def parse_wikilink(self, inline, m, state):
         # Re-match with standalone regex to access sub-groups
         # (in the combined scanner, unnamed sub-groups shift and return None)
@@ -779,9 +776,6 @@ class mistunePluginWikiLink:
 
         # quote link (and just in case someone encoded already: unquote)
         link = urllib.parse.quote(urllib.parse.unquote(link), safe="/#")
-        # store env for later use in render
-        self.env = inline.env
-
         new_state = state.copy()
         new_state.src = title
         children = inline.render(new_state)
@@ -826,7 +820,6 @@ class mistunePluginWikiLink:
         )
 
         if md.renderer.NAME == 'html':
-            plugin = self
 
             def render_html_wikilink(_renderer, text, link):
                 wikilink_html = '<a href="' + link + '">' + text + '</a>'
@@ -835,7 +828,7 @@ class mistunePluginWikiLink:
                     wikilink_html,
                     link,
                     text,
-                    plugin.env.get('page'),
+                    getattr(_renderer, 'env', {}).get('page'),
                 )
                 return processed_html
 
@@ -1126,9 +1119,15 @@ class mistunePluginEmbeddings:
         )
 
         if md.renderer.NAME == "html":
-            md.renderer.register(
-                "embedding_block", _rm(self.render_html_block)
-            )
+            md.renderer.register("embedding_block", self._render_html_block)
+
+    def _render_html_block(self, md_renderer, text, **attrs):
+        # mark the page on the OtterwikiRenderer wrapper, see
+        # mistunePluginMath._mark_required
+        parent = getattr(md_renderer, 'renderer', None)
+        if parent is not None:
+            parent.has_embeddings = True
+        return self.render_html_block(text, **attrs)
 
 
 class mistunePluginStrictTables:
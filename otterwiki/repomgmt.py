@@ -110,11 +110,22 @@ class RepositoryManager:
         if original_ssh_auth_sock is not None:
             os.environ['SSH_AUTH_SOCK'] = original_ssh_auth_sock
 
+    def _call_writer(self, operation, *args):
+        """Run `operation` in the writer process, see writer.py."""
+        try:
+            return tuple(self.storage.writer.call(operation, *args))
+        except Exception as e:
+            return False, str(e)
+
     def push_to_remote(self, remote_url, private_key=None, force=False):
         """
         Push the current branch to a remote repository.
         Returns (success, output) tuple.
         """
+        if self.storage.writer is not None:
+            return self._call_writer(
+                "push_to_remote", remote_url, private_key, force
+            )
         if not remote_url:
             return False, "No remote URL provided"
 
@@ -172,6 +183,10 @@ class RepositoryManager:
         Pull from a remote repository.
         Returns (success, output) tuple.
         """
+        if self.storage.writer is not None:
+            return self._call_writer(
+                "pull_from_remote", remote_url, private_key
+            )
         if not remote_url:
             return False, "No remote URL provided"
 
@@ -223,6 +238,10 @@ class RepositoryManager:
         discarding all local commits and uncommitted changes.
         Returns (success, output) tuple.
         """
+        if self.storage.writer is not None:
+            return self._call_writer(
+                "reset_to_remote", remote_url, private_key
+            )
         if not remote_url:
             return False, "No remote URL provided"
 
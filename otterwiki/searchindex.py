@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+A persistent full-text index of the pages for the search.
+
+Searching by loading every page and matching every line takes time
+proportional to the size of the wiki. The index keeps the name, the
+headings and the markdown of every page in a SQLite FTS5 table in the index
+directory, used to rank the pages containing the words of a query with
+BM25.
+
+A second FTS5 table indexes the trigrams, the substrings of three
+characters, of the pagename and markdown, in the style of Google Code
+Search. A plain-text query or a regexp is turned into the trigrams a
+matching page has to contain, e.g. `N[eE]+dle` requires "dle", so only the
+pages containing them have to be matched line by line. The table only
+stores the postings of every trigram, delta-encoded lists of page ids
+without positions, and is read via mmap.
+
+The index is brought up to date before it is queried: the pages reported
+via the repository_changed hook are reindexed and, whenever the generation
+of the repository or the tree snapshot changed, the size and mtime of all
+pages are compared with the indexed ones to pick up changes made by other
+processes or outside of otterwiki. `flask search-index` builds it ahead of
+time.
+"""
+
+import re
+import sqlite3
+from re import _parser as sre_parse  # the parser of the re module
+from threading import Lock
+
+from otterwiki.commitindex import open_database
+from otterwiki.gitstorage import StorageError
+from otterwiki.plugins import hookimpl
+
+# bump this whenever the schema or the indexed content changes, the index is
+# rebuilt from scratch if the stored version differs.
+SCHEMA_VERSION = 2
+
+# the weights of the pagename, headers and body columns in the ranking
+WEIGHTS = (10.0, 5.0, 1.0)
+
+_REPEATS = (
+    sre_parse.MAX_REPEAT,
+    sre_parse.MIN_REPEAT,
+    sre_parse.POSSESSIVE_REPEAT,
+)
+
+# the size of the database read via mmap, in bytes
+MMAP_SIZE = 256 * 1024 * 1024
+
+# the number of strings a part of a regexp can match, up to which they are
+# enumerated when looking for the required trigrams
+MAX_ALTERNATIVES = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5 (
+    pagename, headers, body, tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_trigram USING fts5 (
+    pagename, body, tokenize = 'trigram', detail = none, content = ''
+);
+"""
+
+# the characters the unicode61 tokenizer keeps in a token
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_HEADER_RE = re.compile(r"^ {0,3}#{1,6}[ \t]+(.*?)[ \t#]*$", re.MULTILINE)
+# syntax of the regex module the re parser reads differently, e.g. POSIX
+# character classes or fuzzy matching, and literal braces
+_UNSUPPORTED_RE = re.compile(r"\[:|\{(?!\d*,?\d*\})")
+
+
+def fts_query(query):
+    """
+    The FTS5 query finding the pages with the words of `query` in this
+    order, the last word may be incomplete. None if `query` has no words.
+    """
+    tokens = _TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    phrase = '"' + " ".join(tokens) + '"'
+    if _TOKEN_RE.fullmatch(query[-1]):
+        phrase += " *"
+    return phrase
+
+
+def page_headers(content):
+    """The text of the ATX headings in the markdown `content`."""
+    return "\n".join(_HEADER_RE.findall(content))
+
+
+# A trigram query is None, if it matches every page, a trigram or a tuple
+# ("AND" | "OR", [queries]).
+
+
+def _combine(operator, queries):
+    if operator == "OR" and None in queries:
+        return None
+    flat = []
+    for query in queries:
+        if isinstance(query, tuple) and query[0] == operator:
+            flat.extend(q for q in query[1] if q not in flat)
+        elif query is not None and query not in flat:
+            flat.append(query)
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else (operator, flat)
+
+
+def _trigrams(string):
+    """The query for the pages containing `string`."""
+    return _combine("AND", [string[i : i + 3] for i in range(len(string) - 2)])
+
+
+def _any_of(strings):
+    """The query for the pages containing one of `strings`."""
+    return _combine("OR", [_trigrams(string) for string in sorted(strings)])
+
+
+def _product(left, right):
+    product = {a + b for a in left for b in right}
+    return product if len(product) <= MAX_ALTERNATIVES else None
+
+
+def _repetitions(strings, count):
+    """The strings of `count` repetitions of `strings`, None if too many."""
+    repeated = {""}
+    for _ in range(count):
+        if repeated is None or strings is None:
+            return None
+        repeated = _product(repeated, strings)
+    return repeated
+
+
+def _analyze_node(op, av):
+    """
+    Returns (strings, query): the set of strings the node matches, if there
+    are only a few, otherwise None and the query the node requires.
+    """
+    if op is sre_parse.LITERAL:
+        return {chr(av)}, None
+    if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        # matches the empty string
+        return {""}, None
+    if op is sre_parse.IN:
+        chars = set()
+        for item, value in av:
+            if item is sre_parse.LITERAL:
+                chars.add(chr(value))
+            elif item is sre_parse.RANGE and value[1] - value[0] < 16:
+                chars.update(map(chr, range(value[0], value[1] + 1)))
+            else:
+                return None, None
+        if len(chars) > MAX_ALTERNATIVES:
+            return None, None
+        return chars, None
+    if op is sre_parse.SUBPATTERN:
+        return _analyze(av[-1])
+    if op is sre_parse.ATOMIC_GROUP:
+        return _analyze(av)
+    if op is sre_parse.BRANCH:
+        branches = [_analyze(branch) for branch in av[1]]
+        if all(strings is not None for strings, _ in branches):
+            union = set().union(*(strings for strings, _ in branches))
+            if len(union) <= MAX_ALTERNATIVES:
+                return union, None
+        return None, _combine(
+            "OR",
+            [
+                query if strings is None else _any_of(strings)
+                for strings, query in branches
+            ],
+        )
+    if op in _REPEATS:
+        low, high, pattern = av
+        strings, query = _analyze(pattern)
+        if strings is None:
+            return None, query if low > 0 else None
+        # enumerate the strings of up to `high` repetitions, e.g. for `u?`
+        repeated, alternatives = {""}, set()
+        for count in range(min(high, MAX_ALTERNATIVES) + 1):
+            if count >= low:
+                alternatives |= repeated
+            if count == high or len(alternatives) > MAX_ALTERNATIVES:
+                break
+            repeated = _product(repeated, strings)
+            if repeated is None:
+                break
+        if count == high and len(alternatives) <= MAX_ALTERNATIVES:
+            return alternatives, None
+        if low == 0:
+            return None, None
+        required = _repetitions(strings, low)
+        return None, _any_of(strings if required is None else required)
+    # anything else, e.g. the any character or a backreference
+    return None, None
+
+
+def _analyze(pattern):
+    """Like _analyze_node() for a sequence of nodes."""
+    strings = {""}
+    queries = []
+    exact = True
+    for op, av in pattern:
+        node_strings, node_query = _analyze_node(op, av)
+        affix = None
+        if node_strings is None and op in _REPEATS and av[0] > 0:
+            # a match of `x{2,}` starts and ends with `xx`
+            affix = _repetitions(_analyze(av[2])[0], av[0])
+        if node_strings is not None:
+            product = _product(strings, node_strings)
+            if product is not None:
+                strings = product
+                continue
+            queries.append(_any_of(strings))
+            strings = node_strings
+        elif affix is not None:
+            product = _product(strings, affix)
+            queries.append(_any_of(strings if product is None else product))
+            strings = affix
+        else:
+            queries += [_any_of(strings), node_query]
+            strings = {""}
+        exact = False
+    if exact:
+        return strings, None
+    return None, _combine("AND", queries + [_any_of(strings)])
+
+
+def _to_fts(query, nested=False):
+    if isinstance(query, str):
+        return '"' + query.replace('"', '""') + '"'
+    operator, queries = query
+    fts = f" {operator} ".join(_to_fts(q, nested=True) for q in queries)
+    return f"({fts})" if nested else fts
+
+
+def trigram_query(query, is_regexp=False):
+    """
+    The FTS5 query finding the pages containing all trigrams a match of
+    `query` contains. None if there are none or the regexp can not be
+    analyzed, i.e. the pages have to be searched one by one.
+    """
+    if not is_regexp:
+        trigrams = _trigrams(query)
+    else:
+        if _UNSUPPORTED_RE.search(query):
+            return None
+        try:
+            pattern = sre_parse.parse(query)
+        except Exception:
+            return None
+        strings, trigrams = _analyze(pattern)
+        if strings is not None:
+            trigrams = _any_of(strings)
+    return None if trigrams is None else _to_fts(trigrams)
+
+
+class SearchIndex:
+    """
+    The full-text index of the markdown files in the repository of
+    `storage`.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._lock = Lock()
+        self._db = None
+        self._git_dir = None
+        self._synced = None
+        self._pending = set()
+        self.available = True
+
+    @property
+    def db(self):
+        """The database, reopened whenever the repository changed."""
+        git_dir = self.storage.repo.git_dir
+        if self._db is None or self._git_dir != git_dir:
+            if self._db is not None:
+                self._db.close()
+            self._db = open_database(git_dir, "search.sqlite3")
+            self._db.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            self._git_dir = git_dir
+            self._synced = None
+            self._create()
+        return self._db
+
+    def _create(self):
+        db = self._db
+        try:
+            db.executescript(_SCHEMA)
+        except sqlite3.OperationalError:
+            # SQLite has been built without FTS5
+            self.available = False
+            return
+        row = db.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        if row is None or row[0] != str(SCHEMA_VERSION):
+            db.execute("BEGIN IMMEDIATE")
+            self._clear(db)
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value)"
+                " VALUES ('version', ?)",
+                (str(SCHEMA_VERSION),),
+            )
+            db.execute("COMMIT")
+
+    @staticmethod
+    def _clear(db):
+        db.execute("DELETE FROM pages")
+        db.execute("DELETE FROM pages_fts")
+        # the trigram table does not store the content to delete it by rowid
+        db.execute(
+            "INSERT INTO pages_trigram (pages_trigram) VALUES ('delete-all')"
+        )
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _stamp(self):
+        # storage.list() checks the tree snapshot, which bumps its version
+        # when a change has been noticed
+        files, _ = self.storage.list()
+        return (
+            self._git_dir,
+            self.storage.generation,
+            self.storage.tree.version,
+        ), [filename for filename in files if filename.endswith(".md")]
+
+    def _index(self, db, filename, stat, page_id):
+        """Add or replace the page `filename`. Returns False if unreadable."""
+        try:
+            content = self.storage.load(filename)
+        except (StorageError, UnicodeDecodeError):
+            return False
+        if page_id is None:
+            page_id = db.execute(
+                "INSERT INTO pages (filename, size, mtime) VALUES (?, ?, ?)",
+                (filename, *stat),
+            ).lastrowid
+        else:
+            db.execute(
+                "UPDATE pages SET size = ?, mtime = ? WHERE id = ?",
+                (*stat, page_id),
+            )
+            self._unindex(db, page_id)
+        pagename = filename[:-3]
+        db.execute(
+            "INSERT INTO pages_fts (rowid, pagename, headers, body)"
+            " VALUES (?, ?, ?, ?)",
+            (page_id, pagename, page_headers(content), content),
+        )
+        db.execute(
+            "INSERT INTO pages_trigram (rowid, pagename, body)"
+            " VALUES (?, ?, ?)",
+            (page_id, pagename, content),
+        )
+        return True
+
+    def _unindex(self, db, page_id):
+        """Drop the content of the page `page_id` from both tables."""
+        row = db.execute(
+            "SELECT pagename, body FROM pages_fts WHERE rowid = ?", (page_id,)
+        ).fetchone()
+        if row is None:
+            return
+        db.execute(
+            "INSERT INTO pages_trigram (pages_trigram, rowid, pagename, body)"
+            " VALUES ('delete', ?, ?, ?)",
+            (page_id, *row),
+        )
+        db.execute("DELETE FROM pages_fts WHERE rowid = ?", (page_id,))
+
+    def _remove(self, db, page_id):
+        self._unindex(db, page_id)
+        db.execute("DELETE FROM pages WHERE id = ?", (page_id,))
+
+    def _sync(self, filenames, forced=()):
+        """
+        Make the index match the pages `filenames`, reindexing the pages
+        whose size or mtime changed and the pages in `forced`. Expects the
+        lock to be held, returns the number of reindexed pages.
+        """
+        db = self.db
+        reindexed = 0
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            indexed = {
+                filename: (page_id, (size, mtime))
+                for page_id, filename, size, mtime in db.execute(
+                    "SELECT id, filename, size, mtime FROM pages"
+                )
+            }
+            for filename in filenames:
+                stat = self.storage.tree.stat(filename) or (0, 0.0)
+                page_id, indexed_stat = indexed.pop(filename, (None, None))
+                if indexed_stat == stat and filename not in forced:
+                    continue
+                if self._index(db, filename, stat, page_id):
+                    reindexed += 1
+                elif page_id is not None:
+                    self._remove(db, page_id)
+            for page_id, _ in indexed.values():
+                self._remove(db, page_id)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return reindexed
+
+    def update(self):
+        """
+        Bring the index up to date with the repository. Returns the number of
+        reindexed pages, None if FTS5 is not available.
+        """
+        with self._lock:
+            self.db
+            if not self.available:
+                return None
+            stamp, filenames = self._stamp()
+            if stamp == self._synced and not self._pending:
+                return 0
+            pending, self._pending = self._pending, set()
+            try:
+                reindexed = self._sync(filenames, forced=pending)
+            except BaseException:
+                self._pending |= pending
+                raise
+            self._synced = stamp
+            return reindexed
+
+    def rebuild(self):
+        """Index all pages from scratch."""
+        with self._lock:
+            db = self.db
+            if not self.available:
+                return None
+            db.execute("BEGIN IMMEDIATE")
+            self._clear(db)
+            db.execute("COMMIT")
+            self._synced = None
+            self._pending = set()
+        return self.update()
+
+    def search(self, query, is_regexp=False):
+        """
+        The (filename, content) of the pages that might match `query`: the
+        pages with all the trigrams a match requires or, if it requires
+        none, all pages. The pages with the words of a plain-text query come
+        first, best match first. None if FTS5 is not available.
+        """
+        if self.update() is None:
+            return None
+        trigrams = trigram_query(query, is_regexp)
+        words = None if is_regexp else fts_query(query)
+        with self._lock:
+            db = self.db
+            if trigrams is None:
+                pages = db.execute(
+                    "SELECT pages.filename, pages_fts.body"
+                    " FROM pages JOIN pages_fts ON pages_fts.rowid = pages.id"
+                    " ORDER BY pages.filename"
+                ).fetchall()
+            else:
+                pages = db.execute(
+                    "SELECT pages.filename, pages_fts.body"
+                    " FROM pages_trigram"
+                    " JOIN pages ON pages.id = pages_trigram.rowid"
+                    " JOIN pages_fts ON pages_fts.rowid = pages.id"
+                    " WHERE pages_trigram MATCH ?"
+                    " ORDER BY pages.filename",
+                    (trigrams,),
+                ).fetchall()
+            if words is not None:
+                ranking = {
+                    filename: i
+                    for i, (filename,) in enumerate(
+                        db.execute(
+                            "SELECT pages.filename FROM pages_fts"
+                            " JOIN pages ON pages.id = pages_fts.rowid"
+                            " WHERE pages_fts MATCH ?"
+                            " ORDER BY bm25(pages_fts, ?, ?, ?)",
+                            (words, *WEIGHTS),
+                        )
+                    )
+                }
+                pages.sort(key=lambda page: ranking.get(page[0], len(ranking)))
+        return pages
+
+    def count(self):
+        """The number of indexed pages."""
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    @hookimpl
+    def repository_changed(self, changed_files):
+        with self._lock:
+            self._pending.update(
+                filename
+                for filename in changed_files
+                if filename.endswith(".md")
+            )
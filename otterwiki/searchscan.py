@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+The scan of the search: match a regexp against the lines of many pages.
+
+The pages are split into shards and matched in a thread pool, the regex
+module releases the GIL while matching. Instead of matching every line,
+the regexp is run over the whole page in MULTILINE mode to find the next
+line that might match, which is then matched on its own. That way lines
+are found with the same semantics as matching line by line, but most
+lines are skipped in C. Regexps that might look beyond the end of a line,
+e.g. lookarounds, possessive repeats or \\Z, are matched line by line.
+
+The scan stops once `max_results` pages matched, the pages are returned
+in the order they were given, so with ranked pages the best results are
+kept. All matching shares one time budget.
+"""
+
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+import regex
+
+# the number of pages matched in one task of the pool
+SHARD_SIZE = 32
+
+# constructs whose match might depend on what is beyond the line
+_CONTEXT_RE = re.compile(r"\\[AZzG]|\(\?(?:<?[=!]|>|[a-zA-Z-]*s)|[*+?}]\+")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 1),
+                thread_name_prefix="search",
+            )
+        return _pool
+
+
+def read_file(path):
+    """The utf-8 content of the file `path`, read via mmap."""
+    with open(path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return str(m, "utf-8")
+        except ValueError:
+            # an empty file can not be mapped
+            return ""
+
+
+class ScanTimeout(Exception):
+    pass
+
+
+class Scan:
+    """
+    Find the lines of pages matching `line_re`, a compiled regexp, and the
+    pagenames matching `name_re`.
+    """
+
+    def __init__(self, line_re, name_re, max_results=0, time_budget=None):
+        self.line_re = line_re
+        self.name_re = name_re
+        self.buffer_re = None
+        if not _CONTEXT_RE.search(line_re.pattern):
+            self.buffer_re = regex.compile(
+                line_re.pattern, line_re.flags | regex.MULTILINE
+            )
+        self.max_results = max_results
+        self.time_budget = time_budget
+        self.timed_out = False
+        self.truncated = False
+        self._deadline = None
+        self._stop = threading.Event()
+
+    def _timeout(self):
+        if self._deadline is None:
+            return None
+        remaining = self._deadline - timer()
+        if remaining <= 0:
+            raise ScanTimeout()
+        return remaining
+
+    def _search(self, pattern, string, pos=0):
+        try:
+            return pattern.search(
+                string, pos, timeout=self._timeout(), concurrent=True
+            )
+        except TimeoutError:
+            raise ScanTimeout()
+
+    def match_lines(self, content):
+        """The (line number, line) of the lines of `content` matching."""
+        lines = content.splitlines()
+        # the lines are found between \n, unless splitlines() knows other
+        # line breaks, too, which end a line or add to the number of lines
+        last = content[-1:]
+        if (
+            "\r" in content
+            or (last != "\n" and last.isspace())
+            or len(lines) != content.count("\n") + (last != "\n")
+        ):
+            content = "".join(line + "\n" for line in lines)
+        if self.buffer_re is None:
+            return [
+                (i, line)
+                for i, line in enumerate(lines)
+                if self._search(self.line_re, line)
+            ]
+        result = []
+        pos, line_no, counted = 0, 0, 0
+        # splitlines() knows no empty line after a final line break
+        length = len(content) - content.endswith("\n")
+        while pos < len(content):
+            restart = False
+            try:
+                matches = self.buffer_re.finditer(
+                    content, pos, timeout=self._timeout(), concurrent=True
+                )
+                for m in matches:
+                    if m.start() > length:
+                        break
+                    if m.start() < pos:
+                        # another match in a line already found
+                        if m.end() > pos:
+                            restart = True
+                            break
+                        continue
+                    start = content.rfind("\n", 0, m.start()) + 1
+                    end = content.find("\n", m.start())
+                    if end < 0:
+                        end = len(content)
+                    line_no += content.count("\n", counted, start)
+                    counted = start
+                    line = content[start:end]
+                    # a match within the line is a match of the line alone
+                    if m.end() <= end or self._search(self.line_re, line):
+                        result.append((line_no, line))
+                    pos = end + 1
+                    if m.end() > pos:
+                        # the match spans lines, the next line might match
+                        # on its own
+                        restart = True
+                        break
+            except TimeoutError:
+                raise ScanTimeout()
+            if not restart:
+                break
+        return result
+
+    def _scan_page(self, name, content, path):
+        name_matched = self._search(self.name_re, name) is not None
+        if content is None:
+            try:
+                content = read_file(path)
+            except (OSError, UnicodeDecodeError):
+                return name_matched, []
+        return name_matched, self.match_lines(content)
+
+    def _scan_shard(self, shard):
+        results = []
+        for filename, name, content, path in shard:
+            if self._stop.is_set():
+                break
+            try:
+                results.append(
+                    (filename, *self._scan_page(name, content, path))
+                )
+            except ScanTimeout:
+                self.timed_out = True
+                self._stop.set()
+                break
+        return results
+
+    def run(self, pages):
+        """
+        Scan `pages`, a list of (filename, pagename, content, path), the
+        content is read from `path` if it is None. Returns the (filename,
+        pagename matched, [(line number, line)]) of the matching pages in
+        the order of `pages`.
+        """
+        if self.time_budget:
+            self._deadline = timer() + self.time_budget
+        shards = [
+            pages[i : i + SHARD_SIZE] for i in range(0, len(pages), SHARD_SIZE)
+        ]
+        matches = []
+        results = _get_pool().map(self._scan_shard, shards)
+        try:
+            for shard_results in results:
+                for filename, name_matched, lines in shard_results:
+                    if not name_matched and not lines:
+                        continue
+                    matches.append((filename, name_matched, lines))
+                    if self.max_results and len(matches) >= self.max_results:
+                        self.truncated = True
+                        return matches
+                if self.timed_out:
+                    break
+        finally:
+            # stop the shards still running, the pending ones are cancelled
+            self._stop.set()
+            results.close()
+        return matches
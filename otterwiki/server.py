@@ -6,7 +6,7 @@ import os
 import sys
 import logging
 
-from flask import Flask
+from flask import Flask, request
 from flask_mail import Mail
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect
@@ -15,7 +15,11 @@ import otterwiki.gitstorage
 import otterwiki.util
 from otterwiki import __version__, fatal_error
 from otterwiki.plugins import plugin_manager
-from otterwiki.renderer import OtterwikiRenderer
+from otterwiki.renderer import RendererPool
+from otterwiki.rendercache import RenderCache
+from otterwiki.searchindex import SearchIndex
+from otterwiki.historysearch import HistoryIndex
+from otterwiki.preview import PreviewRenderer
 
 app = Flask(__name__)
 # default configuration settings
@@ -68,6 +72,8 @@ app.config.update(
     COMMIT_MESSAGE="REQUIRED",  # OPTIONAL DISABLED
     DEFAULT_COMMIT_MESSAGE="",
     GIT_WEB_SERVER=False,
+    GIT_GROUP_COMMIT=False,
+    GIT_WRITER_SOCKET="",
     GIT_REMOTE_PUSH_ENABLED=False,
     GIT_REMOTE_PUSH_URL="",
     GIT_REMOTE_PUSH_PRIVATE_KEY="",
@@ -90,6 +96,10 @@ app.config.update(
     SECURITY_HEADERS=True,
     WTF_CSRF_ENABLED=True,
     WTF_CSRF_TIME_LIMIT=86400,
+    PLUGIN_HOOK_TIMING=False,
+    SEARCH_MAX_RESULTS=1000,
+    SEARCH_TIMEOUT=10,
+    SEARCH_RESULTS_PER_PAGE=50,
 )
 app.config.from_envvar("OTTERWIKI_SETTINGS", silent=True)
 
@@ -189,6 +199,13 @@ if (len(storage.list()[0]) < 1) and (  # pyright: ignore never unbound
             )
             app.logger.info(f"server: Created initial page /{filename[:-3]}.")
 
+# hand all writes to the writer process started via `flask writer`
+if app.config["GIT_WRITER_SOCKET"]:
+    storage.connect_writer(app.config["GIT_WRITER_SOCKET"])  # pyright: ignore
+# batch concurrent saves into group commits
+elif app.config["GIT_GROUP_COMMIT"]:
+    storage.enable_group_commit()  # pyright: ignore
+
 
 #
 # app.config from db preferences
@@ -255,7 +272,19 @@ update_app_config()
 # a renderer configured with the app.config
 #
 # initialize renderer
-app_renderer = OtterwikiRenderer(config=app.config)
+app_renderer = RendererPool(config=app.config)
+# cache the rendered pages, invalidated via the repository_changed hook
+app_render_cache = RenderCache(
+    storage, config=app.config  # pyright: ignore never unbound
+)
+plugin_manager.register(app_render_cache, name="otterwiki.rendercache")
+# the editor preview renders only the changed blocks of a page
+app_preview_renderer = PreviewRenderer(app_renderer, app_render_cache)
+# the full-text index of the search, updated via the repository_changed hook
+app_search_index = SearchIndex(storage)  # pyright: ignore never unbound
+plugin_manager.register(app_search_index, name="otterwiki.searchindex")
+# the changes of the history, caught up with HEAD when searched
+app_history_index = HistoryIndex(storage)  # pyright: ignore never unbound
 
 
 #
@@ -270,6 +299,9 @@ for plugin, dist in plugininfo:
 plugin_manager.hook.setup(
     app=app, storage=storage, db=db  # pyright: ignore never unbound
 )
+# record the time spent in the hooks of every plugin, can be toggled in
+# the admin interface
+plugin_manager.enable_hook_timing(app.config["PLUGIN_HOOK_TIMING"])
 
 
 #
@@ -344,6 +376,29 @@ def slugify(s, keep_slashes=True):
 app.jinja_env.globals.update(os_getenv=os.getenv)
 
 
+@app.before_request
+def start_hook_timing():
+    if plugin_manager.hook_timing.enabled:
+        plugin_manager.hook_timing.start_request()
+
+
+@app.after_request
+def log_hook_timing(response):
+    hook_timing = plugin_manager.hook_timing.end_request()
+    if hook_timing:
+        app.logger.debug(
+            "Plugin hooks of {} took {:.3f} seconds: {}".format(
+                request.path,
+                sum(entry["total"] for entry in hook_timing),
+                ", ".join(
+                    "{plugin}.{hook} {calls}x {total:.3f}s".format(**entry)
+                    for entry in hook_timing
+                ),
+            )
+        )
+    return response
+
+
 @app.after_request
 def set_security_headers(response):
     if app.config['SECURITY_HEADERS']:
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+An in-memory snapshot of the working tree of the repository.
+
+Listing the wiki with os.walk touches every directory on every call. The
+snapshot keeps the sorted paths of all files and directories, so that a
+listing of any directory is a bisect on the sorted path array. It is
+patched whenever GitStorage changes the tree and checks the modification
+times of the directories it knows about to notice changes made by others.
+"""
+
+import os
+import time
+from bisect import bisect_left, insort
+from threading import Lock
+
+# how often (in seconds) all known directories are checked for changes
+# made outside of GitStorage. The root directory and the git index are
+# checked on every query.
+CHECK_INTERVAL = 2.0
+
+
+def _prefix_range(path):
+    """Paths below the directory `path` sort between these two strings."""
+    return path + "/", path + "0"
+
+
+def _join(directory, name):
+    return f"{directory}/{name}" if directory else name
+
+
+class TreeSnapshot:
+    """
+    The files and directories of the working tree below `path`, except the
+    .git directories. All paths are relative to `path` and use "/" as
+    separator.
+    """
+
+    def __init__(self, repo, path, exclude=(".git",)):
+        self.repo = repo
+        self.path = path
+        self.exclude = set(exclude)
+        self._lock = Lock()
+        self._built = False
+        self._files = []
+        self._directories = []
+        # file -> (size, mtime)
+        self._stat = {}
+        # directory -> mtime_ns when it was last scanned
+        self._scanned = {}
+        self._stamp = None
+        self._checked = 0.0
+        # bumped on every change, used to memoize the listings
+        self.version = 0
+        self._memo = {}
+
+    def _fullpath(self, relpath):
+        return os.path.join(self.path, relpath) if relpath else self.path
+
+    def _mtime_ns(self, relpath):
+        try:
+            return os.stat(self._fullpath(relpath)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _current_stamp(self):
+        try:
+            index = os.stat(os.path.join(self.repo.git_dir, "index"))
+            index_mtime = index.st_mtime_ns
+        except OSError:
+            index_mtime = None
+        return index_mtime, self._mtime_ns("")
+
+    def _changed(self):
+        self.version += 1
+        self._memo = {}
+
+    def _scandir(self, directory):
+        """
+        The files (with their stat) and directories directly in `directory`,
+        classified like os.walk does: symlinks to directories are listed as
+        directories, but not descended into.
+        """
+        files, directories = {}, {}
+        try:
+            entries = list(os.scandir(self._fullpath(directory)))
+        except OSError:
+            return None
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            name = _join(directory, entry.name)
+            if is_dir:
+                if entry.name in self.exclude:
+                    continue
+                try:
+                    directories[name] = not entry.is_symlink()
+                except OSError:
+                    directories[name] = False
+            else:
+                try:
+                    st = entry.stat()
+                    files[name] = (st.st_size, st.st_mtime)
+                except OSError:
+                    # e.g. a dangling symlink
+                    files[name] = (0, 0.0)
+        return files, directories
+
+    def _add_tree(self, directory, files, directories):
+        """Recursively scan `directory` and collect everything below it."""
+        mtime = self._mtime_ns(directory)
+        scanned = self._scandir(directory)
+        if scanned is None:
+            return
+        self._scanned[directory] = mtime
+        subfiles, subdirectories = scanned
+        files.update(subfiles)
+        for name, descend in subdirectories.items():
+            directories.append(name)
+            if descend:
+                self._add_tree(name, files, directories)
+
+    def _build(self):
+        files, directories = {}, []
+        self._scanned = {}
+        self._add_tree("", files, directories)
+        self._files = sorted(files)
+        self._stat = files
+        self._directories = sorted(directories)
+        self._built = True
+        self._changed()
+
+    def _remove_below(self, directory):
+        """Drop the directory and everything below it from the snapshot."""
+        start, end = _prefix_range(directory)
+        for paths in (self._files, self._directories):
+            lo, hi = bisect_left(paths, start), bisect_left(paths, end)
+            if paths is self._files:
+                for name in paths[lo:hi]:
+                    self._stat.pop(name, None)
+            del paths[lo:hi]
+        if self._contains(self._directories, directory):
+            del self._directories[bisect_left(self._directories, directory)]
+        for name in [d for d in self._scanned if d.startswith(start)]:
+            del self._scanned[name]
+        self._scanned.pop(directory, None)
+
+    @staticmethod
+    def _contains(paths, name):
+        i = bisect_left(paths, name)
+        return i < len(paths) and paths[i] == name
+
+    def _children(self, paths, directory):
+        if directory:
+            start, end = _prefix_range(directory)
+            lo, hi = bisect_left(paths, start), bisect_left(paths, end)
+            offset = len(start)
+        else:
+            lo, hi, offset = 0, len(paths), 0
+        return {name for name in paths[lo:hi] if "/" not in name[offset:]}
+
+    def _rescan(self, directory):
+        """
+        Bring the direct children of `directory` up to date, new
+        subdirectories are scanned recursively.
+        """
+        mtime = self._mtime_ns(directory)
+        scanned = self._scandir(directory)
+        if scanned is None:
+            if directory:
+                self._remove_below(directory)
+            return
+        self._scanned[directory] = mtime
+        files, directories = scanned
+        for name in self._children(self._files, directory) - set(files):
+            del self._files[bisect_left(self._files, name)]
+            del self._stat[name]
+        for name in self._children(self._directories, directory) - set(
+            directories
+        ):
+            self._remove_below(name)
+        for name, stat in files.items():
+            if name not in self._stat:
+                insort(self._files, name)
+            self._stat[name] = stat
+        for name, descend in directories.items():
+            if self._contains(self._directories, name):
+                continue
+            insort(self._directories, name)
+            if descend:
+                subfiles, subdirectories = {}, []
+                self._add_tree(name, subfiles, subdirectories)
+                for subfile in subfiles:
+                    insort(self._files, subfile)
+                self._stat.update(subfiles)
+                for subdirectory in subdirectories:
+                    insort(self._directories, subdirectory)
+
+    def _revalidate(self):
+        """Rescan all directories modified since they were scanned."""
+        modified = [
+            directory
+            for directory, mtime in list(self._scanned.items())
+            if self._mtime_ns(directory) != mtime
+        ]
+        # parents first, a rescan of the parent might remove the child
+        for directory in sorted(modified):
+            if directory == "" or directory in self._scanned:
+                self._rescan(directory)
+        if modified:
+            self._changed()
+
+    def _check(self):
+        """Make sure the snapshot matches the working tree."""
+        stamp = self._current_stamp()
+        now = time.monotonic()
+        if not self._built:
+            self._build()
+        elif stamp != self._stamp or now - self._checked > CHECK_INTERVAL:
+            self._revalidate()
+        else:
+            return
+        self._stamp = stamp
+        self._checked = now
+
+    def invalidate(self):
+        """Rebuild the snapshot on the next query."""
+        with self._lock:
+            self._built = False
+            self._memo = {}
+
+    def expire(self):
+        """Check all known directories for changes on the next query."""
+        with self._lock:
+            self._stamp = None
+
+    def refresh(self, paths):
+        """
+        Patch the snapshot after `paths` (files or directories) have been
+        written, moved or removed.
+        """
+        with self._lock:
+            if not self._built:
+                return
+            directories = set()
+            for path in paths:
+                path = os.path.normpath(path).strip("/")
+                if path.startswith(".."):
+                    continue
+                parent = os.path.dirname(path)
+                # rescan the closest ancestor that is known to the snapshot,
+                # new directories are picked up recursively from there
+                while parent and parent not in self._scanned:
+                    parent = os.path.dirname(parent)
+                directories.add(parent)
+                if path in self._scanned:
+                    directories.add(path)
+            for directory in sorted(directories):
+                if directory == "" or directory in self._scanned:
+                    self._rescan(directory)
+            self._changed()
+            self._stamp = self._current_stamp()
+
+    def stat(self, filename):
+        """The (size, mtime) of `filename`, None if it is not a file."""
+        with self._lock:
+            self._check()
+            return self._stat.get(filename)
+
+    def list(self, prefix="", depth=None, exclude=()):
+        """
+        The sorted files and directories below the directory `prefix`,
+        relative to `prefix`. With `depth` only entries at most `depth`
+        directories deep are listed. Directories named like an entry in
+        `exclude` are skipped with everything below them.
+
+        Returns None if the content of `prefix` is not part of the snapshot,
+        e.g. for excluded directories and symlinks to directories.
+        """
+        key = (prefix, depth, tuple(exclude))
+        with self._lock:
+            self._check()
+            if prefix not in self._scanned:
+                return None
+            try:
+                files, directories = self._memo[key]
+            except KeyError:
+                files = self._filter(self._files, prefix, depth, exclude)
+                directories = self._filter(
+                    self._directories, prefix, depth, exclude, True
+                )
+                self._memo[key] = files, directories
+        return list(files), list(directories)
+
+    @staticmethod
+    def _filter(paths, prefix, depth, exclude, directories=False):
+        """
+        Select the entries of `paths` below `prefix`. The depth of an entry
+        is the number of directories it is inside of. A file is excluded if
+        one of its parent directories is, a directory also by its own name.
+        """
+        if prefix:
+            start, end = _prefix_range(prefix)
+            lo, hi = bisect_left(paths, start), bisect_left(paths, end)
+            offset = len(start)
+        else:
+            lo, hi, offset = 0, len(paths), 0
+        if depth is None and not exclude:
+            return [name[offset:] for name in paths[lo:hi]]
+        exclude = set(exclude)
+        result = []
+        for name in paths[lo:hi]:
+            relpath = name[offset:]
+            parts = relpath.split("/")
+            if depth is not None and len(parts) - 1 > depth:
+                continue
+            if exclude and not exclude.isdisjoint(
+                parts if directories else parts[:-1]
+            ):
+                continue
+            result.append(relpath)
+        return result
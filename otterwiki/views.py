@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # vim: set et ts=8 sts=4 sw=4 ai:
 
+import json
 import os
 from timeit import default_timer as timer
 
@@ -330,6 +331,17 @@ def admin_repository_management():
         return otterwiki.preferences.handle_repository_management(request.form)
 
 
+@app.route(
+    "/-/admin/plugins", methods=["POST", "GET"]
+)  # pyright: ignore -- false positive
+@login_required
+def admin_plugins():
+    if request.method == "GET":
+        return otterwiki.preferences.plugins_form()
+    else:
+        return otterwiki.preferences.handle_plugins(request.form)
+
+
 @app.route(
     "/-/admin/mail_preferences", methods=["POST", "GET"]
 )  # pyright: ignore -- false positive
@@ -592,9 +604,16 @@ def save(path):
 @app.route("/<path:path>/preview", methods=["POST", "GET"])
 def preview(path):
     p = Page(path)
+    preview_blocks = request.form.get("preview_blocks")
+    if preview_blocks is not None:
+        try:
+            preview_blocks = set(json.loads(preview_blocks))
+        except (ValueError, TypeError):
+            preview_blocks = set()
     return p.preview(
         content=request.form.get("content"),
         cursor_line=request.form.get("cursor_line"),
+        preview_blocks=preview_blocks,
     )
 
 
@@ -714,10 +733,24 @@ def search(query=None):
         is_casesensitive=request.form.get("is_casesensitive") == "y",
         is_regexp=request.form.get("is_regexp") == "y",
         in_history=request.form.get("in_history") == "y",
+        history_page=request.form.get("history_page", 1),
+        cursor=request.form.get("cursor"),
     )
     return s.render()
 
 
+@app.route("/-/api/v1/search", methods=["GET"])
+def api_search():
+    s = Search(
+        query=request.args.get("query"),
+        is_casesensitive=request.args.get("is_casesensitive") == "y",
+        is_regexp=request.args.get("is_regexp") == "y",
+        cursor=request.args.get("cursor"),
+        limit=request.args.get("limit"),
+    )
+    return s.json()
+
+
 #
 # git remote http server
 #
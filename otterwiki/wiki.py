@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # vim: set et ts=8 sts=4 sw=4 ai:
 
+import base64
+import hashlib
+import json
 import os
 import regex
+from bisect import bisect_right
 from datetime import UTC, datetime, timedelta
 
 from io import BytesIO
@@ -10,7 +14,6 @@ from time import strftime
 from timeit import default_timer as timer
 from typing import List, cast
 from urllib.parse import unquote
-import textwrap
 
 import PIL.Image
 from flask import (
@@ -21,6 +24,7 @@ from flask import (
     render_template,
     request,
     send_file,
+    stream_template,
     url_for,
 )
 from markupsafe import escape as html_escape
@@ -28,7 +32,6 @@ from werkzeug.http import http_date
 from werkzeug.utils import secure_filename
 
 from feedgen.feed import FeedGenerator
-from bs4 import BeautifulSoup
 
 from otterwiki.auth import current_user, has_permission
 from otterwiki.gitstorage import StorageError, StorageNotFound
@@ -55,9 +58,20 @@ from otterwiki.plugins import (
 )
 from otterwiki.pluginmgmt import collect_plugin_info
 from otterwiki.renderer import pygments_render
-from otterwiki.server import app, app_renderer, db, storage
+from otterwiki.server import (
+    app,
+    app_preview_renderer,
+    app_render_cache,
+    app_history_index,
+    app_renderer,
+    app_search_index,
+    db,
+    storage,
+)
 from otterwiki.sidebar import SidebarMenu, SidebarPageIndex
 from otterwiki.pageindex import PageIndex
+from otterwiki.searchscan import Scan
+from otterwiki.historysearch import PAGE_SIZE, HistorySearch
 from otterwiki.util import (
     empty,
     get_header,
@@ -557,10 +571,21 @@ class Page:
         # send context of the page rendered to plugins
         call_hook("page_render_context", page=self, preview=False)
 
-        # render markdown
-        htmlcontent, toc, library_requirements = app_renderer.markdown(
-            self.content, page_url=self.page_view_url
-        )
+        # render markdown, unless a plugin depends on the request
+        if False in collect_hook("page_render_cacheable", page=self):
+            htmlcontent, toc, library_requirements = app_renderer.markdown(
+                self.content, page_url=self.page_view_url
+            )
+            description = app_renderer.description
+        else:
+            htmlcontent, toc, library_requirements, description = (
+                app_render_cache.render_page(
+                    app_renderer,
+                    self.content,
+                    filename=self.filename,
+                    page_url=self.page_view_url,
+                )
+            )
         update_ftoc_cache(self.filename, ftoc=toc)
 
         if len(toc) > 0:
@@ -586,25 +611,6 @@ class Page:
             "page_view_htmlcontent_postprocess", htmlcontent, self
         )
 
-        # generate a description for the meta tag og:description
-        soup = BeautifulSoup(htmlcontent[0:1024], "html.parser")
-        # turn html into text
-        description = soup.text
-        # strip the title if the description starts with it
-        description = description.removeprefix(title)
-        # replace new lines with middle dots
-        description = regex.sub(r'[\n]+', '\n', description.strip())
-        # add a seperator for better readability
-        description = description.replace("\n", "·")
-        # make sure the sperator does directly follow a punctuation mark
-        description = regex.sub(r"([!.:,])\s*·", r"\1 ", description)
-        # finally shorten the description and use it as SITE_DESCRIPTION
-        description = textwrap.shorten(
-            description,
-            width=254,
-            placeholder="…",
-        )
-
         # generate canonical URL (without trailing slash)
         # special case: if this is the configured home page, canonical should point to root "/"
         home_page = app.config.get("HOME_PAGE", "")
@@ -657,7 +663,12 @@ class Page:
             extra_js=extra_js,
         )
 
-    def preview(self, content=None, cursor_line=None):
+    def preview(self, content=None, cursor_line=None, preview_blocks=None):
+        """
+        Render the preview of `content`. If the editor sends the ids of
+        the `preview_blocks` it shows, only the html of the other blocks
+        is returned and the editor puts the page together.
+        """
         if not has_permission("WRITE"):
             abort(403)
         if content is None:
@@ -669,10 +680,21 @@ class Page:
         # send context of the page rendered to plugins
         call_hook("page_render_context", page=self, preview=True)
 
-        # render preview html from markdown
-        content_html, toc, library_requirements = app_renderer.markdown(
+        # render preview html from markdown, only the changed blocks
+        # are rendered again
+        slices, toc, library_requirements = app_preview_renderer.render(
             content, cursor=cursor_line, page_url=self.page_view_url
         )
+        content_html = "".join(slices)
+        blocks = None
+        if preview_blocks is not None:
+            blocks = []
+            for html in slices:
+                block_id = hashlib.sha1(html.encode("utf-8")).hexdigest()
+                blocks.append(
+                    [block_id, None if block_id in preview_blocks else html]
+                )
+            content_html = ""
         # update pagename from toc
         if len(toc) > 0:
             # use first headline to overwrite pagename
@@ -698,12 +720,15 @@ class Page:
 
         preview_js = "".join(collect_hook("renderer_javascript"))
 
-        return {
+        result = {
             "preview_content": preview_html,
             "preview_toc": toc_html,
             "library_requirements": library_requirements,
             "preview_js": preview_js,
         }
+        if blocks is not None:
+            result["preview_blocks"] = blocks
+        return result
 
     def editor(self, author, handle_draft=None):
         if not has_permission("WRITE"):
@@ -854,7 +879,7 @@ class Page:
         self.exists_or_404(in_git=True)
 
         try:
-            data = storage.blame(self.filename, self.revision)
+            runs = storage.blame_runs(self.filename, self.revision)
         except StorageError:
             abort(404)
 
@@ -865,55 +890,50 @@ class Page:
         )
         markup_lines = markup_lines.replace("</pre></div>", "")
         markup_lines = markup_lines.splitlines()
-        # filter data
-        fdata = []
-        # helper
-        last = None
-        last_index = 0
-        oddeven = "odd"
-        # use highlighted lines
-        for row in data:
-            try:
-                line = markup_lines[int(row[3]) - 1]
-            except IndexError:
-                # this happens when the file has trailing empty lines that were removed by the pygments_render
-                line = ""
-            if row[0] != last:
+
+        def rows():
+            # the runs are rendered while the blame is still running
+            oddeven = "odd"
+            for metadata, lines in runs:
                 oddeven = "odd" if oddeven == "even" else "even"
-                fdata.append(
-                    [
-                        row[0],  # revision
-                        row[1],  # author
-                        row[2],  # datetime
-                        int(row[3]),  # linenumber
-                        line,  # the actual line
-                        f"chunk-start chunk-start-{oddeven}",  # alternating css class
-                        row[0],  # revision used as border-color
-                        row[5],  # commit message
-                        1,  # lines covered by the meta
-                    ]
-                )
-                last = row[0]
-                last_index = len(fdata) - 1
-            else:
-                fdata.append(
-                    ("", "", "", int(row[3]), line, oddeven, row[0], "", 0)
-                )
-                fdata[last_index][8] += 1
+                revision = metadata["revision"]
+                for i, (n, _) in enumerate(lines):
+                    try:
+                        line = markup_lines[n - 1]
+                    except IndexError:
+                        # this happens when the file has trailing empty lines that were removed by the pygments_render
+                        line = ""
+                    if i == 0:
+                        yield [
+                            revision,
+                            metadata["author_name"],
+                            metadata["datetime"],
+                            n,  # linenumber
+                            line,  # the actual line
+                            f"chunk-start chunk-start-{oddeven}",  # alternating css class
+                            revision,  # revision used as border-color
+                            metadata["message"],
+                            len(lines),  # lines covered by the meta
+                        ]
+                    else:
+                        yield ("", "", "", n, line, oddeven, revision, "", 0)
+
         menutree = SidebarPageIndex(self.pagepath)
         title = "{} - blame".format(self.pagename)
         if self.revision is not None:
             title = "{} ({})".format(title, self.revision)
-        return render_template(
-            "blame.html",
-            title=title,
-            pagepath=self.pagepath,
-            pagename=self.pagename,
-            blame=fdata,
-            menutree=menutree.query(),
-            custom_menu=SidebarMenu().query(),
-            breadcrumbs=self.breadcrumbs(),
-            revision=self.revision,
+        return app.response_class(
+            stream_template(
+                "blame.html",
+                title=title,
+                pagepath=self.pagepath,
+                pagename=self.pagename,
+                blame=rows(),
+                menutree=menutree.query(),
+                custom_menu=SidebarMenu().query(),
+                breadcrumbs=self.breadcrumbs(),
+                revision=self.revision,
+            )
         )
 
     def diff(self, rev_a=None, rev_b=None):
@@ -1700,13 +1720,45 @@ class Attachment:
 
 class Search:
     def __init__(
-        self, query, is_casesensitive=False, is_regexp=False, in_history=False
+        self,
+        query,
+        is_casesensitive=False,
+        is_regexp=False,
+        in_history=False,
+        history_page=1,
+        cursor=None,
+        limit=None,
     ):
         self.query = query
         self.in_history = in_history
         self.is_regexp = is_regexp
         self.is_casesensitive = is_casesensitive
         self.re = None
+        self.ranking = None
+        self.error = None
+        self.warnings = []
+        try:
+            self.history_page = max(1, int(history_page))
+        except (TypeError, ValueError):
+            self.history_page = 1
+        self.history = None
+        self.history_more = False
+        self.cursor = cursor
+        try:
+            self.max_results = int(app.config["SEARCH_MAX_RESULTS"])
+        except ValueError:
+            self.max_results = 0
+        try:
+            self.limit = int(limit or app.config["SEARCH_RESULTS_PER_PAGE"])
+        except ValueError:
+            self.error = "Invalid limit: {}".format(limit)
+            self.limit = 50
+        # a page can not hold more results than the search returns
+        self.limit = max(1, self.limit)
+        if self.max_results > 0:
+            self.limit = min(self.limit, self.max_results)
+        self.matches = []
+        self.next_cursor = None
 
     def compile(self):
         if empty(self.query):
@@ -1723,119 +1775,147 @@ class Search:
                 self.re = regex.compile(self.needle, regex.IGNORECASE)
             self.rei = regex.compile(self.needle, regex.IGNORECASE)
         except Exception as e:
-            toast("Error in search term: {}".format(e), "error")
+            self.error = "Error in search term: {}".format(e)
             return
 
+    def _pages(self):
+        """
+        The (filename, content) of the pages to search, the content is None
+        if it has to be loaded. The full-text index narrows them down to the
+        pages containing the trigrams of the query and ranks the results of
+        a plain-text query by relevance.
+        """
+        self.ranking = None
+        pages = app_search_index.search(self.query, self.is_regexp)
+        if pages is not None:
+            if not self.is_regexp:
+                self.ranking = {fn: i for i, (fn, _) in enumerate(pages)}
+            return pages
+        # find all markdown files
+        files, _ = storage.list()
+        return [(fn, None) for fn in files if fn.endswith(".md")]
+
+    def _count(self, pattern, line):
+        try:
+            return len(pattern.findall(line, timeout=_REGEX_TIMEOUT))
+        except TimeoutError:
+            app.logger.warning("Search regex timed out on findall")
+            self._regex_timed_out = True
+            return 0
+
     def search(self):
+        """
+        Find the matching pages, stored in `matches` as (sort key, lines)
+        ordered by the sort key (-name match, -number of matches, rank,
+        filename). The rank is the relevance of the page, if the index
+        ranked the results.
+        """
+        self.matches = []
         if self.re is None:
-            return {}
-        # find all markdown files
+            return self.matches
         t_start = timer()
-        files, _ = storage.list()
-        md_files = [filename for filename in files if filename.endswith(".md")]
+        pages = self._pages()
         app.logger.debug(
-            f"Search storage.list() and filter took {timer() - t_start:.3f} seconds."
+            f"Search finding the pages took {timer() - t_start:.3f} seconds."
         )
-        fn_result = {}
-        _regex_timed_out = False
+        self._regex_timed_out = False
+        try:
+            time_budget = float(app.config["SEARCH_TIMEOUT"])
+        except ValueError:
+            time_budget = None
 
         t_start = timer()
-        for fn in md_files:
-            # check if pagename matches
-            try:
-                mi = self.rei.search(get_pagename(fn), timeout=_REGEX_TIMEOUT)
-            except regex.TimeoutError:
-                app.logger.warning(f"Search regex timed out on pagename: {fn}")
-                _regex_timed_out = True
-                mi = None
-            if mi is not None:
-                fn_result[fn] = [
-                    True,
-                    get_pagename(
-                        fn,
-                        full=True,
-                    ),
-                ]
-            # open file, read file
-            try:
-                haystack = storage.load(fn)
-            except StorageError:
-                continue
-            lastlinematched = False
-            for i, line in enumerate(haystack.splitlines()):
-                try:
-                    m = self.re.search(line, timeout=_REGEX_TIMEOUT)
-                except regex.TimeoutError:
-                    app.logger.warning(f"Search regex timed out on file: {fn}")
-                    _regex_timed_out = True
-                    m = None
-                if m:
-                    if fn not in fn_result:
-                        fn_result[fn] = [False]
-                    if lastlinematched or i == 0:
-                        fn_result[fn] += [line]
-                    else:
-                        fn_result[fn] += ["[..]", line]
-                    lastlinematched = True
-                else:
-                    lastlinematched = False
+        scan = Scan(
+            self.re,
+            self.rei,
+            max_results=self.max_results,
+            time_budget=time_budget,
+        )
+        matches = scan.run(
+            [
+                (fn, get_pagename(fn), content, os.path.join(storage.path, fn))
+                for fn, content in pages
+            ]
+        )
+        for fn, name_matched, lines in matches:
+            n = 0
+            if name_matched:
+                # filenames are not casesensitive ...
+                n += self._count(self.rei, get_pagename(fn, full=True))
+            if self.is_regexp or "\n" in self.query:
+                n += sum(self._count(self.re, line) for _, line in lines)
+            elif lines:
+                # a plain-text query does not match across lines
+                n += self._count(self.re, "\n".join(line for _, line in lines))
+            rank = self.ranking.get(fn, 0) if self.ranking else 0
+            self.matches.append(((-int(name_matched), -n, rank, fn), lines))
+        self.matches.sort(key=lambda match: match[0])
+        if scan.timed_out:
+            app.logger.warning(f"Search for '{self.needle}' timed out.")
+            self._regex_timed_out = True
+        if scan.truncated:
+            self.warnings.append(
+                f"Search stopped after {scan.max_results} results."
+            )
         app.logger.debug(
-            f"Search storage.load() and re.search('{self.needle}') took {timer() - t_start:.3f} seconds."
+            f"Search scan for '{self.needle}' took {timer() - t_start:.3f} seconds."
         )
         if self.in_history:
-            # TODO
-            # use git log -S
-            # see https://git-scm.com/docs/git-log#Documentation/git-log.txt--Sltstringgt
-            # search through commits to find the one that added the string
-            pass
+            t_start = timer()
+            if not self.search_history(time_budget):
+                self._regex_timed_out = True
+            app.logger.debug(
+                f"Search in history for '{self.needle}' took {timer() - t_start:.3f} seconds."
+            )
+        if self._regex_timed_out:
+            self.warnings.append(
+                "Search regex timed out. Results may be incomplete."
+            )
+        return self.matches
+
+    @staticmethod
+    def encode_cursor(key):
+        return (
+            base64.urlsafe_b64encode(json.dumps(key).encode())
+            .decode()
+            .rstrip("=")
+        )
 
-        t_start = timer()
-        result = {}
-        # simplify result
-        for fn, matches in fn_result.items():
-            fnmatch = 1 if matches.pop(0) else 0
-            # count matches
-            n = 0
-            for i, line in enumerate(matches):
-                # filenames are not casesensitive ...
-                if i == 0 and fnmatch == 1:
-                    try:
-                        n += len(
-                            self.rei.findall(line, timeout=_REGEX_TIMEOUT)
-                        )
-                    except regex.TimeoutError:
-                        app.logger.warning(
-                            "Search regex timed out on findall (rei)"
-                        )
-                        _regex_timed_out = True
-                else:
-                    try:
-                        n += len(self.re.findall(line, timeout=_REGEX_TIMEOUT))
-                    except regex.TimeoutError:
-                        app.logger.warning(
-                            "Search regex timed out on findall (re)"
-                        )
-                        _regex_timed_out = True
-            key = [
-                fnmatch,
-                n,
-                fn,
-                get_pagename(fn, full=True),
-                get_pagename(fn, full=True),
-            ]
-            summary = []
-            if fnmatch == 1:
-                summary = [matches.pop(0)]
-                # overwrite key[4]
-                try:
-                    key[4] = self.rei.sub(
-                        r'<span class="page-match">\1</span>',
-                        cast(str, key[4]),
-                        timeout=_REGEX_TIMEOUT,
-                    )
-                except regex.TimeoutError:
-                    app.logger.warning("Search regex timed out on rei.sub")
-                    _regex_timed_out = True
+    @staticmethod
+    def decode_cursor(cursor):
+        """The sort key encoded in `cursor`, None if it is invalid."""
+        try:
+            key = json.loads(
+                base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            )
+            name_match, n, rank, fn = key
+            return (int(name_match), int(n), int(rank), str(fn))
+        except (ValueError, TypeError):
+            return None
+
+    def _summary(self, key, lines):
+        """The result of the page of the sort `key` with matching `lines`."""
+        name_match, n, _, fn = key
+        pagepath = get_pagename(fn, full=True)
+        title = str(html_escape(pagepath))
+        if name_match:
+            try:
+                title = self.rei.sub(
+                    r'<span class="page-match">\1</span>',
+                    title,
+                    timeout=_REGEX_TIMEOUT,
+                )
+            except TimeoutError:
+                app.logger.warning("Search regex timed out on rei.sub")
+        matches = []
+        previous = -1
+        for i, line in lines:
+            if i > 0 and i != previous + 1:
+                matches.append("[..]")
+            matches.append(line)
+            previous = i
+        summary = []
+        if matches:
             front, end = [], []
             while len("".join(front) + "".join(end)) < 200:
                 try:
@@ -1849,38 +1929,108 @@ class Search:
             match_summary += " ".join(end)
             # TODO: check if the number of words have to be limited, too
             match_summary = match_summary.replace("[..][..]", "[..]")
+            # are you kidding me? html_escape(l) is evaluated later so that
+            # the span below would be escaped too.
+            match_summary = str(html_escape(match_summary))
+            try:
+                match_summary = self.re.sub(
+                    r'<span class="text-match">\1</span>',
+                    match_summary,
+                    timeout=_REGEX_TIMEOUT,
+                )
+            except TimeoutError:
+                app.logger.warning("Search regex timed out on re.sub")
             summary.append(match_summary)
-            # colorize summary
-            for i, l in enumerate(summary):
-                # are you kidding me? html_escape(l) is evaluated later so that the span below
-                # would be escaped too.
-                l = str(html_escape(l))
-                # filenames are not casesensitive ...
-                if i == 0 and fnmatch == 1:
-                    summary[i] = None
-                else:
-                    try:
-                        summary[i] = self.re.sub(
-                            r'<span class="text-match">\1</span>',
-                            l,
-                            timeout=_REGEX_TIMEOUT,
-                        )
-                    except regex.TimeoutError:
-                        app.logger.warning("Search regex timed out on re.sub")
-                        _regex_timed_out = True
-                        summary[i] = l
-            # store summary with key
-            result[tuple(key)] = summary
-        app.logger.debug(
-            f"Search simplify result took {timer() - t_start:.3f} seconds."
+        return {
+            "pagepath": pagepath,
+            "title": title,
+            "name_match": bool(name_match),
+            "matches": -n,
+            "summary": summary,
+            "cursor": self.encode_cursor(key),
+        }
+
+    def results(self):
+        """
+        Yield the results of the page after `cursor`, at most `limit`, the
+        summaries are only built for them. `next_cursor` is set to the cursor
+        of the following page, if there is one.
+        """
+        start = 0
+        if self.cursor:
+            key = self.decode_cursor(self.cursor)
+            if key is not None:
+                start = bisect_right(
+                    self.matches, key, key=lambda match: match[0]
+                )
+        page = self.matches[start : start + self.limit]
+        self.next_cursor = None
+        if start + self.limit < len(self.matches):
+            self.next_cursor = self.encode_cursor(page[-1][0])
+        for key, lines in page:
+            yield self._summary(key, lines)
+
+    def search_history(self, time_budget=None):
+        """
+        Find the page of changes in the history matching the query, stored
+        in `history`. Returns False if the search timed out.
+        """
+        history = HistorySearch(
+            self.re,
+            self.query,
+            is_regexp=self.is_regexp,
+            is_casesensitive=self.is_casesensitive,
+            time_budget=time_budget,
         )
-        if _regex_timed_out:
-            toast(
-                "Search regex timed out. Results may be incomplete.",
-                "warning",
+        changes = history.run(
+            storage,
+            app_history_index,
+            offset=(self.history_page - 1) * PAGE_SIZE,
+        )
+        self.history_more = history.more
+        self.history = []
+        for change in changes:
+            metadata = storage.commit_index.get(change["revision"])
+            if metadata is None:
+                continue
+            pagename = get_pagename(change["filename"], full=True)
+            lines = []
+            for sign, line in change["lines"]:
+                line = str(html_escape(line))
+                try:
+                    line = self.re.sub(
+                        r'<span class="text-match">\1</span>',
+                        line,
+                        timeout=_REGEX_TIMEOUT,
+                    )
+                except TimeoutError:
+                    pass
+                lines.append((sign, line))
+            self.history.append(
+                {
+                    "revision": metadata["revision"],
+                    "datetime": metadata["datetime"],
+                    "author_name": metadata["author_name"],
+                    "message": metadata["message"],
+                    "pagename": pagename,
+                    # a deleted page can not be shown at this revision
+                    "url": (
+                        url_for(
+                            "pageview",
+                            path=pagename,
+                            revision=metadata["revision"],
+                        )
+                        if not change["deleted"]
+                        else None
+                    ),
+                    "lines": lines,
+                }
             )
-
-        return result
+        if history.timed_out:
+            app.logger.warning(
+                f"Search in history for '{self.needle}' timed out."
+            )
+        return not history.timed_out
 
     def render(self):
         if not has_permission("READ"):
@@ -1888,9 +2038,12 @@ class Search:
                 return redirect(url_for("login", next=request.full_path))
             abort(403)
         self.compile()
-        result = self.search()
-        # sort keys
-        keys = sorted(result.keys(), key=lambda x: (-x[0], -x[1], x[2]))
+        self.search()
+        results = list(self.results())
+        if self.error is not None:
+            toast(self.error, "error")
+        for warning in self.warnings:
+            toast(warning, "warning")
         return render_template(
             "search.html",
             title=(
@@ -1901,8 +2054,35 @@ class Search:
             query=self.query,
             is_regexp=self.is_regexp,
             is_casesensitive=self.is_casesensitive,
-            keys=keys,
-            result=result,
+            in_history=self.in_history,
+            total=len(self.matches),
+            results=results,
+            cursor=self.cursor,
+            next_cursor=self.next_cursor,
+            history=self.history,
+            history_page=self.history_page,
+            history_more=self.history_more,
+        )
+
+    def json(self):
+        if not has_permission("READ"):
+            abort(403)
+        self.compile()
+        if self.error is not None:
+            return jsonify({"error": self.error}), 400
+        self.search()
+        results = [
+            dict(result, url=url_for("view", path=result["pagepath"]))
+            for result in self.results()
+        ]
+        return jsonify(
+            {
+                "query": self.query,
+                "total": len(self.matches),
+                "results": results,
+                "next_cursor": self.next_cursor,
+                "warnings": self.warnings,
+            }
         )
 
 
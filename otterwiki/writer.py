@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+"""
+A single writer process for deployments with several worker processes.
+
+Every worker process holds its own GitStorage, and without coordination
+their writes race for the git index. With GIT_WRITER_SOCKET configured, the
+workers hand every change of the repository (store, commit, rename, delete,
+revert, restore and the pushes and pulls of the RepositoryManager) over a
+local Unix socket to a dedicated writer process, started via `flask writer`,
+which owns the only GitStorage that writes.
+
+The protocol is one JSON object per line: a request {"operation": ...,
+"args": [...], "kwargs": {...}} is answered with {"result": ...} or with
+{"error": <exception class>, "message": ...}. Bytes, e.g. the content of an
+uploaded attachment, are sent as {"__bytes__": <base64>}.
+"""
+
+import base64
+import json
+import os
+import socket
+import socketserver
+
+# the operations the writer process executes, by the object that owns them
+STORAGE_OPERATIONS = (
+    "update",
+    "store",
+    "commit",
+    "restore",
+    "revert",
+    "delete",
+    "rename",
+)
+REPOSITORY_OPERATIONS = (
+    "push_to_remote",
+    "pull_from_remote",
+    "reset_to_remote",
+)
+
+# seconds a worker waits for the writer to answer, pushes and pulls can take
+# a while.
+TIMEOUT = 300
+
+
+class WriterError(Exception):
+    pass
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (list, tuple, set)):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    return value
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and "__bytes__" in obj:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+
+def dumps(message):
+    return (json.dumps(_encode(message)) + "\n").encode()
+
+
+def loads(line):
+    return json.loads(line, object_hook=_decode_object)
+
+
+def _exception(name, message):
+    """Recreate an exception raised in the writer process."""
+    from otterwiki.gitstorage import (
+        StorageError,
+        StorageErrorEncoding,
+        StorageNotFound,
+    )
+
+    exception_class = {
+        "StorageError": StorageError,
+        "StorageErrorEncoding": StorageErrorEncoding,
+        "StorageNotFound": StorageNotFound,
+        "ValueError": ValueError,
+    }.get(name, StorageError)
+    return exception_class(message)
+
+
+class WriterClient:
+    """
+    Sends the write operations of a worker process to the writer process
+    listening on `socket_path`. Every call uses a connection of its own,
+    so the client can be shared between threads.
+    """
+
+    def __init__(self, socket_path, timeout=TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def call(self, operation, *args, **kwargs):
+        request = {"operation": operation, "args": args, "kwargs": kwargs}
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(dumps(request))
+                with sock.makefile("rb") as f:
+                    line = f.readline()
+        except OSError as e:
+            raise _exception(
+                "StorageError",
+                f"The writer process at {self.socket_path} failed: {e}",
+            )
+        if not line:
+            raise _exception(
+                "StorageError",
+                f"The writer process at {self.socket_path} did not answer.",
+            )
+        response = loads(line)
+        if "error" in response:
+            raise _exception(response["error"], response["message"])
+        return response["result"]
+
+
+class _WriterHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            self.wfile.write(dumps(self.server.execute(line)))
+            self.wfile.flush()
+
+
+class WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Executes the write operations received on `socket_path` with `storage`
+    and `repo_manager`. The connections are handled in threads of their
+    own, the GitStorage serializes the writes, or batches them when group
+    commit is enabled. `before` is called before every operation, e.g. to
+    reload the configuration.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, storage, socket_path, repo_manager=None, before=None):
+        self.storage = storage
+        self.repo_manager = repo_manager
+        self.before = before
+        # a socket left behind by a writer that did not shut down cleanly
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _WriterHandler)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)  # pyright: ignore
+        except OSError:
+            pass
+
+    def execute(self, line):
+        try:
+            request = loads(line)
+            operation = request["operation"]
+            if operation in STORAGE_OPERATIONS:
+                target = self.storage
+            elif (
+                operation in REPOSITORY_OPERATIONS
+                and self.repo_manager is not None
+            ):
+                target = self.repo_manager
+            else:
+                raise WriterError(f"Unknown operation: {operation!r}")
+            if self.before is not None:
+                self.before()
+            result = getattr(target, operation)(
+                *request.get("args", []), **request.get("kwargs", {})
+            )
+        except Exception as e:
+            return {"error": type(e).__name__, "message": str(e)}
+        return {"result": result}
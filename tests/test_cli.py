@@ -545,3 +545,23 @@ def test_list_json(runner_with_user):
         "last_seen",
     ]:
         assert field in u, f"Missing field: {field}"
+
+
+# ---------------------------------------------------------------------------
+# flask search-index
+# ---------------------------------------------------------------------------
+
+
+def test_search_index(runner):
+    """The search index is built and rebuilt on demand."""
+    from otterwiki.server import app_search_index
+
+    result = runner.invoke(args=["search-index", "--rebuild"])
+    assert result.exit_code == 0, result.output
+    count = app_search_index.count()
+    assert count > 0
+    assert f"Indexed {count} of {count} pages" in result.output
+    result = runner.invoke(args=["search-index"])
+    assert result.exit_code == 0, result.output
+    assert f"Indexed 0 of {count} pages" in result.output
+    assert "and 0 of" in result.output
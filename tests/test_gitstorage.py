@@ -2,8 +2,10 @@
 # vim: set et ts=8 sts=4 sw=4 ai:
 
 import os
+import git
 import pytest
 import tempfile
+import time
 from pprint import pprint
 
 from otterwiki import gitstorage
@@ -289,6 +291,45 @@ def test_list_path(storage):
     assert files == ["c", "d"]
 
 
+def test_list_matches_walk(storage):
+    author = ("Example Author", "mail@example.com")
+    for f in ["a.md", "a-b.md", "a/b.md", "a/c/d.md", "e/.git/f", "g/a/h"]:
+        os.makedirs(
+            os.path.dirname(os.path.join(storage.path, f)) or ".",
+            exist_ok=True,
+        )
+        with open(os.path.join(storage.path, f), "w") as fh:
+            fh.write(f)
+    storage.commit(["a.md", "a/b.md"], message="add", author=author)
+    for p in [None, "", "a", "a/", "g", "missing", "e/.git"]:
+        for depth in [None, 0, 1, 2]:
+            for exclude in [[], ["a"], ["c", "g"]]:
+                assert storage.list(p, depth, exclude) == storage._walk(
+                    p, depth, exclude
+                )
+
+
+def test_list_follows_changes(storage, monkeypatch):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a/b.md", content="b", author=author)
+    assert storage.list() == (["a/b.md"], ["a"])
+    # store, rename and delete patch the snapshot
+    storage.store("a/c/d.md", content="d", author=author)
+    assert storage.list("a") == (["b.md", "c/d.md"], ["c"])
+    storage.rename("a/c/d.md", "e/d.md", author=author)
+    assert storage.list() == (["a/b.md", "e/d.md"], ["a", "a/c", "e"])
+    storage.delete("a/b.md", author=author)
+    assert storage.list()[0] == ["e/d.md"]
+    assert storage.size("e/d.md") == 1
+    # files created outside of GitStorage show up after the next check
+    monkeypatch.setattr("otterwiki.treesnapshot.CHECK_INTERVAL", 0)
+    with open(os.path.join(storage.path, "e", "f.md"), "w") as f:
+        f.write("f")
+    assert storage.list("e")[0] == ["d.md", "f.md"]
+    os.remove(os.path.join(storage.path, "e", "f.md"))
+    assert storage.list("e")[0] == ["d.md"]
+
+
 def test_diff(storage):
     author = ("Example Author", "mail@example.com")
     filename = "test_revert.md"
@@ -593,3 +634,330 @@ def test_restore_handles_non_ascii_paths(storage):
     storage.restore([filename])
 
     assert storage.load(filename) == "original\n"
+
+
+def _git_log_hexshas(storage, *args):
+    return storage.repo.git.log("--format=%H", *args).split()
+
+
+def test_commit_index_log_matches_git(storage):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="a\n", author=author, message="add a")
+    storage.store("b.md", content="b\n", author=author, message="add b")
+    storage.store("a.md", content="aa\n", author=author, message="edit a")
+    storage.rename("a.md", "c.md", author=author)
+    storage.store("c.md", content="ccc\n", author=author, message="edit c")
+    storage.delete("b.md", author=author)
+
+    log = storage.log()
+    assert [x["revision-full"] for x in log] == _git_log_hexshas(storage)
+    assert log[0]["files"] == ["b.md"]
+    assert log[2]["files"] == ["c.md"]
+    assert log[-1]["message"] == "add a"
+    assert log[-1]["author_name"] == author[0]
+    assert log[-1]["author_email"] == author[1]
+    # the history of a file follows renames
+    log = storage.log("c.md")
+    assert [x["revision-full"] for x in log] == _git_log_hexshas(
+        storage, "--follow", "--", "c.md"
+    )
+    assert [x["files"] for x in log] == [
+        ["c.md"],
+        ["c.md"],
+        ["a.md"],
+        ["a.md"],
+    ]
+    assert len(storage.log("c.md", max_count=2)) == 2
+    # the metadata of a path does not follow renames
+    assert storage.metadata("a.md")["message"] == "a.md renamed to c.md."
+    assert storage.metadata("b.md")["revision"] == storage.log()[0]["revision"]
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.metadata("c.md", revision=log[-1]["revision"])
+
+
+def test_commit_index_catches_up(storage):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="a\n", author=author, message="add a")
+    assert len(storage.log()) == 1
+    # commit without otterwiki knowing about it
+    with open(os.path.join(storage.path, "a.md"), "w") as f:
+        f.write("external\n")
+    storage.repo.index.add(["a.md"])
+    storage.repo.index.commit(
+        "external change", author=git.Actor("Someone", "some@one.org")
+    )
+    log = storage.log()
+    assert len(log) == 2
+    assert log[0]["message"] == "external change"
+    assert storage.metadata("a.md")["author_name"] == "Someone"
+    # a reset to an older commit rebuilds the index
+    storage.repo.git.reset("--hard", "HEAD~1")
+    log = storage.log()
+    assert [x["message"] for x in log] == ["add a"]
+    assert storage.metadata("a.md")["message"] == "add a"
+
+
+def test_commit_index_is_persistent(storage, monkeypatch):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="a\n", author=author, message="add a")
+    storage.store("a.md", content="aa\n", author=author, message="edit a")
+    log = storage.log()
+    # a new storage on the same repository reuses the index, log and
+    # metadata are answered without running git at all
+    storage2 = gitstorage.GitStorage(path=storage.path)
+
+    def call_process(*args, **kwargs):
+        raise AssertionError("git called")
+
+    monkeypatch.setattr(git.cmd.Git, "_call_process", call_process)
+    assert storage2.log() == log
+    assert storage2.log("a.md") == log
+    assert storage2.metadata("a.md") == storage.metadata("a.md")
+    assert (
+        storage2.metadata("a.md", revision=log[1]["revision"])["message"]
+        == "add a"
+    )
+
+
+def test_load_revision_returns_exact_content(storage):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="first\n\n", author=author)
+    revision = storage.metadata("a.md")["revision"]
+    storage.store("a.md", content="second\n", author=author)
+    # trailing newlines are kept
+    assert storage.load("a.md", revision=revision) == "first\n\n"
+    assert storage.load("a.md", revision=revision, mode="rb") == b"first\n\n"
+    # binary content is returned as bytes, as it is, but can not be decoded
+    storage.store("b.bin", content=b"\xff\xfe\x00\n", author=author, mode="wb")
+    revision = storage.metadata("b.bin")["revision"]
+    assert storage.load("b.bin", revision=revision, mode="rb") == (
+        b"\xff\xfe\x00\n"
+    )
+    with pytest.raises(gitstorage.StorageErrorEncoding):
+        storage.load("b.bin", revision=revision)
+    # directories and unknown files are not found
+    storage.store("dir/c.md", content="c\n", author=author)
+    revision = storage.metadata("dir/c.md")["revision"]
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.load("dir", revision=revision)
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.load("dir/d.md", revision=revision)
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.load("dir/c.md\nHEAD:a.md", revision=revision)
+    # a name with a single space makes "<name> missing" three words
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.load("a b.md", revision=revision)
+    storage.store("a b.md", content="a b\n", author=author)
+    revision = storage.metadata("a b.md")["revision"]
+    assert storage.load("a b.md", revision=revision) == "a b\n"
+
+
+def test_load_revision_reuses_cat_file(storage):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="a\n", author=author)
+    revision = storage.metadata("a.md")["revision"]
+    assert storage.load("a.md", revision=revision) == "a\n"
+    (catfile,) = storage.cat_file._idle[False]
+    pid = catfile.process.pid
+    for _ in range(10):
+        assert storage.load("a.md", revision=revision) == "a\n"
+    assert [c.process.pid for c in storage.cat_file._idle[False]] == [pid]
+    # a dead process is replaced
+    catfile.process.kill()
+    catfile.process.wait()
+    assert storage.load("a.md", revision=revision) == "a\n"
+    (catfile,) = storage.cat_file._idle[False]
+    assert catfile.process.pid != pid
+    # reloading the repository restarts the processes
+    with open(os.path.join(storage.path, ".git/RELOAD_GIT"), "w") as f:
+        f.write("")
+    assert storage.load("a.md", revision=revision) == "a\n"
+    assert not catfile.alive()
+
+
+def test_commit_graph(storage):
+    author = ("Example Author", "mail@example.com")
+    assert storage.commit_graph.status()["exists"] is False
+    for i in range(3):
+        storage.store(f"page{i}.md", content=f"{i}", author=author)
+    assert storage.commit_graph.write()
+    status = storage.commit_graph.status()
+    assert status["exists"]
+    assert status["commits"] == 3
+    assert status["bloom_filters"]
+    # new commits are added as a new layer
+    storage.store("page3.md", content="3", author=author)
+    assert storage.commit_graph.write()
+    assert storage.commit_graph.status()["commits"] == 4
+    # path limited queries use the graph and still return the same history
+    assert [c.hexsha for c in storage.repo.iter_commits(paths="page1.md")] == [
+        storage.metadata("page1.md")["revision-full"]
+    ]
+
+
+def test_commit_graph_schedule(storage):
+    author = ("Example Author", "mail@example.com")
+    storage.commit_graph.delay = 0.05
+    storage.store("page.md", content="content", author=author)
+    storage.store("page.md", content="changed", author=author)
+    for _ in range(100):
+        status = storage.commit_graph.status()
+        if status["exists"] and not status["pending"]:
+            break
+        time.sleep(0.05)
+    assert storage.commit_graph.status()["commits"] == 2
+
+
+def test_revision_array():
+    import hashlib
+    from otterwiki.commitindex import RevisionArray
+
+    hexshas = [hashlib.sha1(str(i).encode()).hexdigest() for i in range(200)]
+    revisions = RevisionArray.from_hexshas(hexshas[:100])
+    revisions = revisions.merge(hexshas[100:])
+    assert len(revisions) == len(hexshas)
+    assert [revisions[i].hex() for i in range(len(revisions))] == sorted(
+        hexshas
+    )
+    for hexsha in hexshas:
+        assert revisions.resolve(hexsha[:30]) == [hexsha]
+        assert revisions.resolve(hexsha.upper()) == [hexsha]
+    assert revisions.resolve("0" * 40) == []
+    assert revisions.resolve("xyz") == []
+    assert len(revisions.resolve("a")) > 1
+
+
+def test_metadata_at_revision(storage):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="a", author=author, message="add a")
+    storage.store("b.md", content="b", author=author, message="add b")
+    storage.delete("a.md", author=author, message="delete a")
+    log = storage.log()
+    # a.md exists in the commit adding b.md without being touched by it
+    metadata = storage.metadata("a.md", revision=log[1]["revision"])
+    assert metadata["message"] == "add b"
+    assert metadata["files"] == ["b.md"]
+    # the commit deleting a.md touches it
+    assert (
+        storage.metadata("a.md", revision=log[0]["revision"])["message"]
+        == "delete a"
+    )
+    # b.md did not exist yet
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.metadata("b.md", revision=log[2]["revision"])
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.metadata("b.md", revision="HEAD")
+    # a name with a single space, missing at the revision
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.metadata("x y.md", revision=log[1]["revision"])
+    # the revision is case-insensitive, like in git
+    assert (
+        storage.metadata("a.md", revision=log[0]["revision"].upper())[
+            "message"
+        ]
+        == "delete a"
+    )
+
+
+def test_get_filename_at_revision(storage, monkeypatch):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="first\n" * 10, author=author)
+    storage.store("x.md", content="other\n" * 10, author=author)
+    storage.rename("a.md", "b.md", author=author)
+    storage.store("b.md", content="first\n" * 10 + "b", author=author)
+    storage.rename("b.md", "c.md", author=author)
+    # a new file takes over the old name
+    storage.rename("x.md", "a.md", author=author)
+    log = storage.log()
+    expected = {
+        "c.md": ["c.md", "c.md", "b.md", "b.md", "a.md", "a.md"],
+        "a.md": ["a.md", "x.md", "x.md", "x.md", "x.md", "x.md"],
+    }
+    # answered from the commit index without spawning git
+    monkeypatch.setattr(
+        git.cmd.Git,
+        "_call_process",
+        lambda *args, **kwargs: pytest.fail("git was called"),
+    )
+    for filename, names in expected.items():
+        assert [
+            storage.get_filename_at_revision(filename, entry["revision"])
+            for entry in log
+        ] == names
+    assert storage.get_filename_at_revision("c.md", "ffffff") == "c.md"
+
+
+def test_commit_metadata_files_are_lazy(storage):
+    from otterwiki.commitmetadata import CommitMetadata
+
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="a", author=author, message="add a")
+    storage.store("d/b.md", content="b", author=author, message="add b")
+    storage.rename("a.md", "c.md", author=author, message="rename")
+    # showing a commit does not compute its files
+    metadata, _ = storage.show_commit(storage.log()[2]["revision"])
+    assert metadata._files is None
+    assert metadata["message"] == "add a"
+    log = storage.log_slow()
+    assert all(isinstance(entry, CommitMetadata) for entry in log)
+    assert all(entry._files is None for entry in log[:2])
+    assert log[0]["message"] == "rename"
+    assert log[0]["revision"] == log[0]["revision-full"][0:6]
+    # the first access computes the files of the whole log
+    assert log[0]["files"] == ["a.md", "c.md"]
+    assert [entry._files for entry in log[1:]] == [["d/b.md"], ["a.md"]]
+    assert log[1].stats["d/b.md"]["insertions"] == 1
+    assert list(dict(log[2]).keys()) == list(CommitMetadata.KEYS)
+    assert metadata == dict(log[2])
+
+
+def test_blame_matches_git(storage):
+    author = ("Example Author", "mail@example.com")
+    lines = [f"line {i}" for i in range(20)]
+    storage.store("a.md", content="\n".join(lines) + "\n", author=author)
+    for i in [3, 4, 10, 19, 0]:
+        lines[i] = f"changed {i}  "
+        storage.store("a.md", content="\n".join(lines) + "\n", author=author)
+    expected = []
+    for commit, commit_lines in storage.repo.blame("HEAD", "a.md"):
+        expected += [(commit.hexsha[0:6], line) for line in commit_lines]
+    blame = storage.blame("a.md")
+    assert [(row[0], row[4]) for row in blame] == expected
+    assert [row[3] for row in blame] == list(range(1, 21))
+    # the runs are run-length encoded
+    runs = list(storage.blame_runs("a.md"))
+    assert sum(len(lines) for _, lines in runs) == 20
+    assert len(runs) == 8
+    # an old revision
+    revision = storage.log("a.md")[-1]["revision"]
+    assert {row[0] for row in storage.blame("a.md", revision)} == {revision}
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.blame("missing.md")
+    # a name with a single space, missing at the revision
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.blame("x y.md", revision)
+    storage.store("x y.md", content="x y\n", author=author)
+    assert [row[4] for row in storage.blame("x y.md")] == ["x y"]
+
+
+def test_blame_cache(storage, monkeypatch):
+    author = ("Example Author", "mail@example.com")
+    storage.store("a.md", content="a\nb\n", author=author)
+    storage.store("a.md", content="a\nc\n", author=author)
+    blame = storage.blame("a.md")
+    # unrelated commits do not invalidate the cached blame
+    storage.store("b.md", content="b\n", author=author)
+
+    def incremental_runs(*args, **kwargs):
+        pytest.fail("git blame was called")
+
+    monkeypatch.setattr(
+        "otterwiki.blamecache.incremental_runs", incremental_runs
+    )
+    assert storage.blame("a.md") == blame
+    # the cache is persistent
+    storage2 = gitstorage.GitStorage(path=storage.path)
+    assert storage2.blame("a.md") == blame
+    monkeypatch.undo()
+    storage.store("a.md", content="a\nc\nd\n", author=author)
+    assert [row[4] for row in storage.blame("a.md")] == ["a", "c", "d"]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import threading
+
+import pytest
+
+from otterwiki import gitstorage, groupcommit
+
+
+@pytest.fixture
+def storage(tmpdir):
+    storage = gitstorage.GitStorage(path=str(tmpdir), initialize=True)
+    storage.enable_group_commit(window=0.05)
+    yield storage
+    storage.disable_group_commit()
+
+
+def test_store_and_commit(storage):
+    author = ("Example Author", "mail@example.com")
+    assert storage.store("a.md", content="a", author=author, message="add a")
+    assert storage.load("a.md") == "a"
+    metadata = storage.metadata("a.md")
+    assert metadata["message"] == "add a"
+    assert metadata["author_name"] == author[0]
+    assert metadata["author_email"] == author[1]
+    # storing the same content changes nothing
+    assert not storage.store("a.md", content="a", author=author)
+    assert len(storage.log()) == 1
+    storage.rename("a.md", "b.md", author=author, message="rename")
+    assert storage.list()[0] == ["b.md"]
+    assert storage.metadata("b.md")["message"] == "rename"
+    assert not storage.repo.is_dirty()
+
+
+def test_failed_save_in_batch(storage, monkeypatch):
+    author = ("Example Author", "mail@example.com")
+    create_from_tree = groupcommit.git.Commit.create_from_tree
+
+    def failing(repo, tree, message, **kwargs):
+        if message == "fail":
+            raise ValueError("failed")
+        return create_from_tree(repo, tree, message, **kwargs)
+
+    monkeypatch.setattr(
+        groupcommit.git.Commit, "create_from_tree", staticmethod(failing)
+    )
+    batch = [
+        groupcommit._Request(
+            "store",
+            filename=filename,
+            content=filename,
+            message=message,
+            author=author,
+            mode="w",
+        )
+        for filename, message in [
+            ("a.md", "first"),
+            ("b.md", "fail"),
+            ("c.md", "third"),
+        ]
+    ]
+    # the middle save fails after its file has been staged
+    storage._group_commit._process(batch)
+    assert [request.result for request in batch] == [True, None, True]
+    assert isinstance(batch[1].error, ValueError)
+    assert [(entry["message"], entry["files"]) for entry in storage.log()] == [
+        ("third", ["c.md"]),
+        ("first", ["a.md"]),
+    ]
+    assert "b.md" not in storage.repo.head.commit.tree
+    assert ("b.md", 0) not in storage.repo.index.entries
+
+
+def test_concurrent_writers(storage, monkeypatch):
+    writers, saves = 8, 10
+    notified = []
+    monkeypatch.setattr(
+        gitstorage.plugin_manager.hook,
+        "repository_changed",
+        lambda changed_files: notified.append(changed_files),
+    )
+    results, errors = [], []
+
+    def writer(w):
+        author = (f"Writer {w}", f"writer{w}@example.com")
+        for i in range(saves):
+            try:
+                results.append(
+                    storage.store(
+                        f"writer{w}.md",
+                        content=f"save {i} of writer {w}\n",
+                        author=author,
+                        message=f"writer {w} save {i}",
+                    )
+                )
+            except Exception as e:
+                errors.append(e)
+
+    threads = [
+        threading.Thread(target=writer, args=(w,)) for w in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == [True] * writers * saves
+    # one commit per save, with the right author and message
+    log = storage.log()
+    assert len(log) == writers * saves
+    for w in range(writers):
+        history = storage.log(f"writer{w}.md")
+        assert [entry["message"] for entry in history] == [
+            f"writer {w} save {i}" for i in reversed(range(saves))
+        ]
+        assert {entry["author_email"] for entry in history} == {
+            f"writer{w}@example.com"
+        }
+        # every commit contains the content of its save
+        for i, entry in enumerate(reversed(history)):
+            assert (
+                storage.load(f"writer{w}.md", revision=entry["revision"])
+                == f"save {i} of writer {w}\n"
+            )
+        assert (
+            storage.load(f"writer{w}.md")
+            == f"save {saves - 1} of writer {w}\n"
+        )
+    # the plugins are notified once per batch
+    assert sum(len(files) for files in notified) == writers * saves
+    assert len(notified) < writers * saves
+    assert not storage.repo.is_dirty()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import pytest
+import regex
+
+from otterwiki import gitstorage, historysearch
+from otterwiki.historysearch import (
+    HistoryIndex,
+    HistorySearch,
+    stream_changes,
+)
+
+AUTHOR = ("Example Author", "mail@example.com")
+
+
+@pytest.fixture
+def storage(tmpdir):
+    storage = gitstorage.GitStorage(path=str(tmpdir), initialize=True)
+    storage.store("apple.md", content="An apple.\n", author=AUTHOR)
+    storage.store("image.txt", content="apple", author=AUTHOR)
+    storage.store(
+        "sub/pear q\"t.md", content="Pear\nand apple\n", author=AUTHOR
+    )
+    storage.store("apple.md", content="An apple a day.\n", author=AUTHOR)
+    storage.delete("sub/pear q\"t.md", author=AUTHOR)
+    return storage
+
+
+def compile(pattern, is_regexp=False):
+    if not is_regexp:
+        pattern = regex.escape(pattern)
+    return regex.compile("(" + pattern + ")", regex.IGNORECASE)
+
+
+def changes(history, storage, index=None, **kwargs):
+    return [
+        (change["filename"], change["deleted"], change["lines"])
+        for change in history.run(storage, index, **kwargs)
+    ]
+
+
+def test_stream_changes(storage):
+    result = list(stream_changes(storage.repo.git_dir, "HEAD"))
+    revisions = [metadata["revision-full"] for metadata in storage.log()]
+    assert [
+        (hexsha, path, deleted) for hexsha, path, deleted, _, _ in result
+    ] == [
+        (revisions[0], 'sub/pear q"t.md', True),
+        (revisions[1], "apple.md", False),
+        (revisions[2], 'sub/pear q"t.md', False),
+        (revisions[4], "apple.md", False),
+    ]
+    assert result[1][3:] == (["An apple a day."], ["An apple."])
+    assert result[0][3:] == ([], ["Pear", "and apple"])
+    # closing the generator stops git
+    stream = stream_changes(storage.repo.git_dir, "HEAD")
+    next(stream)
+    stream.close()
+    assert list(stream_changes(storage.repo.git_dir, "HEAD", "-Sday")) == [
+        result[1]
+    ]
+
+
+def test_history_search(storage):
+    index = HistoryIndex(storage)
+    for source in (None, index):
+        # the number of occurrences changed
+        history = HistorySearch(compile("apple"), "apple")
+        assert changes(history, storage, source) == [
+            ('sub/pear q"t.md', True, [("-", "and apple")]),
+            ('sub/pear q"t.md', False, [("+", "and apple")]),
+            ("apple.md", False, [("+", "An apple.")]),
+        ]
+        # a regexp matches added or removed lines
+        history = HistorySearch(compile("a.*day", True), "a.*day", True)
+        assert changes(history, storage, source) == [
+            ("apple.md", False, [("+", "An apple a day.")]),
+        ]
+        # the changes are paginated
+        history = HistorySearch(compile("apple"), "apple")
+        assert changes(history, storage, source, offset=1, limit=1) == [
+            ('sub/pear q"t.md', False, [("+", "and apple")]),
+        ]
+        assert history.more
+        history = HistorySearch(compile("apple"), "apple")
+        assert len(changes(history, storage, source, offset=2)) == 1
+        assert not history.more
+    assert index.count() == 4
+    index.close()
+
+
+def test_history_index(storage):
+    index = HistoryIndex(storage)
+    assert index.update() == 4
+    assert index.update() == 0
+    # new commits are added on top
+    storage.store("apple.md", content="No fruit.\n", author=AUTHOR)
+    assert index.update() == 1
+    assert [path for _, path, _, _, _ in index.candidates("apple")] == [
+        "apple.md",
+        'sub/pear q"t.md',
+        "apple.md",
+        'sub/pear q"t.md',
+        "apple.md",
+    ]
+    assert [path for _, path, _, _, _ in index.candidates("fruit")] == [
+        "apple.md"
+    ]
+    # the index is rebuilt if HEAD does not descend from the indexed one
+    storage.repo.git.reset("--hard", "HEAD~2")
+    assert index.update() == 3
+    assert index.rebuild() == 3
+    index.close()
+
+
+def test_history_index_deadline(storage, monkeypatch):
+    monkeypatch.setattr(historysearch, "CATCH_UP_BATCH", 1)
+
+    def reset_clock():
+        # a second passes per indexed commit
+        clock = iter(range(100))
+        monkeypatch.setattr(historysearch, "timer", lambda: next(clock))
+
+    index = HistoryIndex(storage)
+    # the catch-up stops at the deadline, the indexed commits are kept
+    reset_clock()
+    assert index.update(deadline=0) is None
+    assert index.count() == 1
+    reset_clock()
+    assert index.candidates("apple", deadline=1) is None
+    assert index.count() == 3
+    # until the index caught up, the history is searched via git
+    history = HistorySearch(compile("apple"), "apple")
+    index._update_lock.acquire()
+    assert index.candidates("apple") is None
+    assert len(changes(history, storage, index)) == 3
+    index._update_lock.release()
+    # a new commit is added, while catching up
+    storage.store("apple.md", content="No apple.\n", author=AUTHOR)
+    assert index.update() == 2
+    assert [path for _, path, _, _, _ in index.candidates("apple")] == [
+        "apple.md",
+        'sub/pear q"t.md',
+        "apple.md",
+        'sub/pear q"t.md',
+        "apple.md",
+    ]
+    assert index.update() == 0
+    index.close()
+
+
+def test_history_timeout(storage):
+    history = HistorySearch(compile("apple"), "apple", time_budget=1e-9)
+    assert history.run(storage) == []
+    assert history.timed_out
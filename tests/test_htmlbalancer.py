@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import glob
+import os
+
+import pytest
+from bs4 import BeautifulSoup
+
+from otterwiki.htmlbalancer import HtmlBalancer, balance_html
+
+# the golden files: <name>.html and the expected <name>.expected.html,
+# created with str(BeautifulSoup(html, 'html.parser'))
+CORPUS = sorted(
+    filename
+    for filename in glob.glob(
+        os.path.join(os.path.dirname(__file__), "balancer", "*.html")
+    )
+    if not filename.endswith(".expected.html")
+)
+
+
+def _read(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("filename", CORPUS, ids=os.path.basename)
+def test_golden_files(filename):
+    html = _read(filename)
+    expected = _read(filename[: -len(".html")] + ".expected.html")
+    assert balance_html(html) == expected
+    # the output is the same as the one of BeautifulSoup
+    assert str(BeautifulSoup(html, "html.parser")) == expected
+
+
+@pytest.mark.parametrize("filename", CORPUS, ids=os.path.basename)
+def test_streaming(filename):
+    html = _read(filename)
+    balancer = HtmlBalancer()
+    for i in range(0, len(html), 7):
+        balancer.feed(html[i : i + 7])
+    balancer.close()
+    assert balancer.result() == balance_html(html)
+
+
+def test_balance_html():
+    assert balance_html("") == ""
+    assert balance_html("<p>a<b>b</p>") == "<p>a<b>b</b></p>"
+    assert balance_html("<p>a</b></p></p>") == "<p>a</p>"
+    assert balance_html("<div><p>a") == "<div><p>a</p></div>"
+    assert balance_html("a<br>b<img src=x>") == 'a<br/>b<img src="x"/>'
@@ -430,6 +430,96 @@ def test_search(test_client):
     )
     assert "Search matched 4 pages" in rv.data.decode()
     assert rv.status_code == 200
+    # the number of results is limited
+    test_client.application.config["SEARCH_MAX_RESULTS"] = 3
+    rv = test_client.get("/-/search/{}".format("Needle"))
+    test_client.application.config["SEARCH_MAX_RESULTS"] = 1000
+    assert "Search matched 3 pages" in rv.data.decode()
+    assert "Search stopped after 3 results." in rv.data.decode()
+
+
+def test_search_pagination(test_client):
+    save_shortcut(test_client, "Paged 1", "Pagedneedle", "initial commit")
+    save_shortcut(
+        test_client, "Paged 2", "Pagedneedle\nPagedneedle", "initial commit"
+    )
+    save_shortcut(test_client, "Paged 3", "Pagedneedle", "initial commit")
+    save_shortcut(test_client, "Other", "No <b>needle</b>", "initial commit")
+    # ordered by the name match and the number of matches
+    rv = test_client.get("/-/api/v1/search?query=paged&limit=2")
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data["total"] == 3
+    assert [r["pagepath"] for r in data["results"]] == ["Paged 2", "Paged 1"]
+    assert data["results"][0]["matches"] == 3
+    assert data["results"][0]["name_match"]
+    assert data["results"][0]["url"] == "/Paged%202"
+    assert data["next_cursor"] == data["results"][-1]["cursor"]
+    rv = test_client.get(
+        "/-/api/v1/search?query=paged&limit=2&cursor={}".format(
+            data["next_cursor"]
+        )
+    )
+    data = rv.get_json()
+    assert [r["pagepath"] for r in data["results"]] == ["Paged 3"]
+    assert data["next_cursor"] is None
+    # the summary is escaped
+    rv = test_client.get("/-/api/v1/search?query=needle")
+    results = {r["pagepath"]: r for r in rv.get_json()["results"]}
+    assert results["Other"]["summary"] == [
+        'No &lt;b&gt;<span class="text-match">needle</span>&lt;/b&gt;'
+    ]
+    rv = test_client.get("/-/api/v1/search?query=(&is_regexp=y")
+    assert rv.status_code == 400
+    assert "Error in search term" in rv.get_json()["error"]
+    # the limit has to be a number and is capped by SEARCH_MAX_RESULTS
+    rv = test_client.get("/-/api/v1/search?query=paged&limit=two")
+    assert rv.status_code == 400
+    assert "Invalid limit" in rv.get_json()["error"]
+    test_client.application.config["SEARCH_MAX_RESULTS"] = 2
+    rv = test_client.get("/-/api/v1/search?query=paged&limit=1000000")
+    test_client.application.config["SEARCH_MAX_RESULTS"] = 1000
+    capped = rv.get_json()
+    assert len(capped["results"]) == 2
+    assert capped["next_cursor"] is None
+    # the html page shows the same page of results
+    test_client.application.config["SEARCH_RESULTS_PER_PAGE"] = 2
+    rv = test_client.post("/-/search", data={"query": "paged"})
+    html = rv.data.decode()
+    assert "Search matched 3 pages" in html
+    assert html.count('class="page-match"') == 2
+    assert 'name="cursor"' in html
+    rv = test_client.post(
+        "/-/search",
+        data={"query": "paged", "cursor": data["results"][0]["cursor"]},
+    )
+    test_client.application.config["SEARCH_RESULTS_PER_PAGE"] = 50
+    html = rv.data.decode()
+    assert html.count('class="page-match"') == 0
+
+
+def test_search_in_history(test_client):
+    save_shortcut(test_client, "Old Haystack", "An Oldneedle", "add needle")
+    save_shortcut(test_client, "Old Haystack", "No more", "drop needle")
+    rv = test_client.post("/-/search", data={"query": "oldneedle"})
+    assert "No match found." in rv.data.decode()
+    assert "Changes in history" not in rv.data.decode()
+    rv = test_client.post(
+        "/-/search", data={"query": "oldneedle", "in_history": "y"}
+    )
+    html = rv.data.decode()
+    assert rv.status_code == 200
+    assert "Changes in history:" in html
+    assert html.count('href="/-/commit/') == 2
+    assert html.count('href="/Old%20Haystack/view/') == 2
+    assert 'An <span class="text-match">Oldneedle</span>' in html
+    assert "drop needle" in html and "add needle" in html
+    # the second page of results is empty
+    rv = test_client.post(
+        "/-/search",
+        data={"query": "oldneedle", "in_history": "y", "history_page": "2"},
+    )
+    assert "No change in history found." in rv.data.decode()
 
 
 def test_rename(test_client):
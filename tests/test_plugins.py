@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import pytest
+
+from otterwiki.plugins import (
+    OtterwikiPluginManager,
+    OtterWikiPluginSpec,
+    hookimpl,
+)
+
+
+class Upper:
+    @hookimpl
+    def renderer_process_link(
+        self, link_html, link_url, link_text, link_title, page
+    ):
+        return link_html.upper()
+
+
+class Suffix:
+    @hookimpl
+    def renderer_process_link(
+        self, link_html, link_url, link_text, link_title, page
+    ):
+        return link_html + "!"
+
+
+@pytest.fixture
+def manager():
+    manager = OtterwikiPluginManager("otterwiki")
+    manager.add_hookspecs(OtterWikiPluginSpec)
+    return manager
+
+
+def test_hook_functions(manager):
+    assert manager.hook_functions("renderer_process_link") == ()
+    # the table is kept until the plugins change
+    assert "renderer_process_link" in manager._hook_functions
+    upper, suffix = Upper(), Suffix()
+    manager.register(upper)
+    assert manager.hook_functions("renderer_process_link") == (
+        upper.renderer_process_link,
+    )
+    manager.register(suffix)
+    assert manager.hook_functions("renderer_process_link") == tuple(
+        impl.function
+        for impl in manager.hook.renderer_process_link.get_hookimpls()
+    )
+    manager.unregister(upper)
+    assert manager.hook_functions("renderer_process_link") == (
+        suffix.renderer_process_link,
+    )
+    with pytest.raises(AttributeError):
+        manager.hook_functions("unknown_hook")
+
+
+def test_chain_hooks(monkeypatch, manager):
+    import otterwiki.plugins
+
+    monkeypatch.setattr(otterwiki.plugins, "plugin_manager", manager)
+    args = ("/a", "a", None, None)
+    html = '<a href="/a">a</a>'
+    chain_hooks = otterwiki.plugins.chain_hooks
+    call_hook = otterwiki.plugins.call_hook
+    assert chain_hooks("renderer_process_link", html, *args) == html
+    assert call_hook("renderer_process_link", html, *args) is None
+    manager.register(Upper())
+    manager.register(Suffix())
+    # the plugins are chained in the order of get_hookimpls()
+    assert (
+        chain_hooks("renderer_process_link", html, *args)
+        == '<A HREF="/A">A</A>!'
+    )
+    assert call_hook("renderer_process_link", html, *args) == html.upper()
+    assert otterwiki.plugins.collect_hook("unknown_hook") == []
+
+
+def test_hook_timing(monkeypatch, manager):
+    import otterwiki.plugins
+
+    monkeypatch.setattr(otterwiki.plugins, "plugin_manager", manager)
+    upper = Upper()
+    manager.register(upper, name="upper")
+    html = '<a href="/a">a</a>'
+    args = ("/a", "a", None, None)
+    # disabled, the table holds the plain functions
+    assert manager.hook_functions("renderer_process_link") == (
+        upper.renderer_process_link,
+    )
+    otterwiki.plugins.chain_hooks("renderer_process_link", html, *args)
+    assert manager.hook_timing.stats() == []
+
+    manager.enable_hook_timing()
+    manager.hook_timing.start_request()
+    for _ in range(3):
+        assert (
+            otterwiki.plugins.chain_hooks("renderer_process_link", html, *args)
+            == html.upper()
+        )
+    (request,) = manager.hook_timing.end_request()
+    (entry,) = manager.hook_timing.stats()
+    assert entry["plugin"] == request["plugin"] == "upper"
+    assert entry["hook"] == "renderer_process_link"
+    assert entry["calls"] == request["calls"] == 3
+    assert 0 <= entry["max"] <= entry["total"]
+    # outside of a request only the totals are recorded
+    otterwiki.plugins.call_hook("renderer_process_link", html, *args)
+    assert manager.hook_timing.end_request() == []
+    assert manager.hook_timing.stats()[0]["calls"] == 4
+
+    manager.enable_hook_timing(False)
+    otterwiki.plugins.call_hook("renderer_process_link", html, *args)
+    assert manager.hook_timing.stats()[0]["calls"] == 4
+    manager.hook_timing.reset()
+    assert manager.hook_timing.stats() == []
@@ -686,3 +686,53 @@ def test_user_add(app_with_user, admin_client):
     # check for toast
     assert "User with this email exists" in rv.data.decode()
     assert "Name must not be empty" in rv.data.decode()
+
+
+def test_plugins_hook_timing(app_with_user, admin_client):
+    from otterwiki.plugins import hookimpl, plugin_manager
+
+    class LinkPlugin:
+        @hookimpl
+        def renderer_process_link(
+            self, link_html, link_url, link_text, link_title, page
+        ):
+            return link_html
+
+    plugin = LinkPlugin()
+    plugin_manager.register(plugin, name="linkplugin")
+    try:
+        rv = admin_client.get("/-/admin/plugins")
+        assert rv.status_code == 200
+        assert "Enable recording" in rv.data.decode()
+        rv = admin_client.post(
+            "/-/admin/plugins",
+            data={"hook_timing": "enable"},
+            follow_redirects=True,
+        )
+        assert rv.status_code == 200
+        assert plugin_manager.hook_timing.enabled
+        rv = admin_client.post(
+            "/Timing/preview",
+            data={
+                "content": "[a link](https://example.com)",
+                "cursor_line": 0,
+            },
+        )
+        assert rv.status_code == 200
+        rv = admin_client.get("/-/admin/plugins")
+        table = BeautifulSoup(rv.data.decode(), "html.parser").find(
+            id="hook_timing"
+        )
+        assert "linkplugin" in str(table)
+        assert "renderer_process_link" in str(table)
+        rv = admin_client.post(
+            "/-/admin/plugins",
+            data={"hook_timing": "reset"},
+            follow_redirects=True,
+        )
+        assert "linkplugin" not in rv.data.decode()
+    finally:
+        plugin_manager.enable_hook_timing(False)
+        plugin_manager.hook_timing.reset()
+        plugin_manager.unregister(plugin)
+    assert not plugin_manager.hook_timing.enabled
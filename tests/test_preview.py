@@ -2,6 +2,7 @@
 # vim: set et ts=8 sts=4 sw=4 ai
 
 import bs4
+import json
 import re
 from otterwiki.renderer import render
 
@@ -232,3 +233,114 @@ Some intro paragraph.
     assert cursor
     parent = cursor.find_parent("li")
     assert parent and parent.find("a")
+
+
+def _preview_documents():
+    import os
+    import otterwiki
+
+    with open(
+        os.path.join(os.path.dirname(otterwiki.__file__), "help.md")
+    ) as f:
+        help_md = f.read()
+    return [
+        markdown_example,
+        help_md,
+        # duplicate headings are numbered across the blocks
+        "# Head\n\ntext\n\n## Head\n\n- a\n\n- b\n\n## Head\n",
+        # link references and abbreviations are shared by the blocks
+        "[ref]: http://example.com\n\nA [ref].\n\n*[HTML]: Hyper\n\nHTML\n",
+        # footnotes require rendering the whole document
+        "Text[^1].\n\n[^1]: A note.\n",
+        "```\ncode\n\nwith blank lines\n```\n\n$$\na\n\nb\n$$\n",
+        "",
+    ]
+
+
+def test_preview_renderer():
+    from otterwiki.preview import PreviewRenderer
+
+    preview = PreviewRenderer(render)
+    for markdown in _preview_documents():
+        for cursor in [None, 0, 3, len(markdown.splitlines()) - 1]:
+            slices, toc, library_requirements = preview.render(
+                markdown, cursor=cursor, page_url="/Test"
+            )
+            # the preview is the same as a complete render
+            assert (
+                "".join(slices),
+                toc,
+                library_requirements,
+            ) == render.markdown(markdown, cursor=cursor, page_url="/Test")
+
+
+def test_preview_renderer_cache():
+    from otterwiki.preview import PreviewRenderer
+
+    preview = PreviewRenderer(render)
+    markdown = "# Head\n\nOne.\n\n## Head\n\nTwo.\n\n## Head\n"
+    preview.render(markdown)
+    assert (preview.hits, preview.misses) == (0, 5)
+    # only the changed block is rendered again
+    slices, toc, _ = preview.render(markdown.replace("Two", "Three"))
+    assert (preview.hits, preview.misses) == (4, 6)
+    assert "<p>Three.</p>" in "".join(slices)
+    # a new heading above changes the anchors of the duplicates below
+    markdown = "## Head\n\n" + markdown
+    slices, toc, _ = preview.render(markdown)
+    assert [anchor for _, _, _, _, anchor in toc] == [
+        "head",
+        "head-1",
+        "head-2",
+        "head-3",
+    ]
+    assert "".join(slices) == render.markdown(markdown)[0]
+
+
+def test_split_blocks():
+    from otterwiki.preview import split_blocks
+
+    markdown = "# Head\n\n```\nx\n\ny\n```\n\nText\n\n- a\n\n- b\n"
+    blocks, env = split_blocks(render.mistune, markdown)
+    # the blank lines in the code block and the list don't split them
+    assert blocks == [
+        "# Head\n\n",
+        "```\nx\n\ny\n```\n\n",
+        "Text\n\n",
+        "- a\n\n- b\n",
+    ]
+    assert env == {"ref_links": {}, "ref_abbrs": {}}
+    assert split_blocks(render.mistune, "a[^1]\n\n[^1]: b\n") is None
+    assert split_blocks(render.mistune, "---\ntitle: a\n---\n\nb\n") is None
+
+
+def test_preview_blocks(test_client):
+    markdown = "# Head\n\nOne.\n\nTwo.\n"
+    rv = test_client.post(
+        "/Test/preview", data={"content": markdown, "preview_blocks": "[]"}
+    )
+    assert rv.status_code == 200
+    blocks = rv.json["preview_blocks"]
+    assert all(html for _, html in blocks)
+    assert "One." not in rv.json["preview_content"]
+    # the blocks the editor knows are not sent again
+    known = [block_id for block_id, html in blocks if "One." in html]
+    rv = test_client.post(
+        "/Test/preview",
+        data={
+            "content": markdown.replace("Two", "Three"),
+            "preview_blocks": json.dumps(known),
+        },
+    )
+    assert rv.status_code == 200
+    html = {block_id: html for block_id, html in blocks}
+    html.update(
+        (block_id, html)
+        for block_id, html in rv.json["preview_blocks"]
+        if html is not None
+    )
+    assert [html for _, html in rv.json["preview_blocks"]].count(None) == 1
+    assert (
+        "".join(html[block_id] for block_id, _ in rv.json["preview_blocks"])
+        == render.markdown(markdown.replace("Two", "Three"))[0]
+    )
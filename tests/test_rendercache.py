@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import pytest
+
+from otterwiki import gitstorage
+from otterwiki.plugins import hookimpl, plugin_manager
+from otterwiki.rendercache import RenderCache, blob_sha
+from otterwiki.renderer import OtterwikiRenderer
+
+AUTHOR = ("Example Author", "mail@example.com")
+
+
+@pytest.fixture
+def storage(tmpdir):
+    return gitstorage.GitStorage(path=str(tmpdir), initialize=True)
+
+
+@pytest.fixture
+def renderer():
+    return OtterwikiRenderer()
+
+
+def test_blob_sha(storage):
+    assert storage.store("a.md", content="# Hello\n", author=AUTHOR)
+    assert blob_sha("# Hello\n") == storage.repo.git.rev_parse("HEAD:a.md")
+
+
+def test_render_cache(storage, renderer):
+    config = {"OPEN_LINKS_IN_NEW_TAB": False}
+    cache = RenderCache(storage, config)
+    content = "# Hello\n\n```python\nprint(1)\n```\n"
+    result = cache.render(renderer, content, "a.md", page_url="/a")
+    assert result == renderer.markdown(content, page_url="/a")
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.render(renderer, content, "a.md", page_url="/a") == result
+    assert (cache.hits, cache.misses) == (1, 1)
+    # the arguments and the configuration are part of the key
+    cache.render(renderer, content, "a.md", page_url="/b")
+    config["OPEN_LINKS_IN_NEW_TAB"] = True
+    cache.render(renderer, content, "a.md", page_url="/a")
+    assert (cache.hits, cache.misses) == (1, 3)
+    # the disk tier is shared with other processes
+    config["OPEN_LINKS_IN_NEW_TAB"] = False
+    other = RenderCache(storage, config)
+    assert other.render(renderer, content, "a.md", page_url="/a") == result
+    assert (other.hits, other.misses) == (1, 0)
+    # the meta description is stored alongside
+    html, toc, library_requirements, description = other.render_page(
+        renderer, content, "a.md", page_url="/a"
+    )
+    assert (html, toc, library_requirements) == result
+    assert description == "print(1)"
+    # a change of the page drops it
+    other.invalidate(["a.md"])
+    assert other.get(cache.key(content, page_url="/a")) is None
+
+
+def test_render_cache_embeddings(storage, renderer):
+    cache = RenderCache(storage, {})
+    content = "{{Unknown}}\n"
+    cache.render(renderer, content, "a.md")
+    cache.render(renderer, content, "a.md")
+    assert (cache.hits, cache.misses) == (1, 1)
+    # embeddings might depend on any file of the repository
+    assert storage.store("b.md", content="b", author=AUTHOR)
+    cache.render(renderer, content, "a.md")
+    assert (cache.hits, cache.misses) == (1, 2)
+    # pages without embeddings stay valid
+    cache.render(renderer, "text\n", "c.md")
+    assert storage.store("b.md", content="bb", author=AUTHOR)
+    cache.render(renderer, "text\n", "c.md")
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_render_cache_size(storage, renderer):
+    cache = RenderCache(storage, {}, memory_size=6000, disk_size=200)
+    for i in range(5):
+        cache.render(renderer, f"page {i}\n", f"{i}.md")
+    # only the most recently used pages are kept
+    assert len(cache._memory) == 5
+    (rows,) = cache.db.execute("SELECT COUNT(*) FROM pages").fetchone()
+    assert 0 < rows < 5
+    cache.render(renderer, "x" * 10000 + "\n", "large.md")
+    assert len(cache._memory) == 5
+
+
+class NotCacheable:
+    @hookimpl
+    def page_render_cacheable(self, page):
+        return False
+
+
+def test_page_view_cache(test_client):
+    from otterwiki.server import app_render_cache
+
+    hits = app_render_cache.hits
+    assert test_client.get("/Home").status_code == 200
+    assert test_client.get("/Home").status_code == 200
+    assert app_render_cache.hits == hits + 1
+    plugin = NotCacheable()
+    plugin_manager.register(plugin)
+    try:
+        assert test_client.get("/Home").status_code == 200
+    finally:
+        plugin_manager.unregister(plugin)
+    assert app_render_cache.hits == hits + 1
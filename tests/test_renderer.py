@@ -8,6 +8,9 @@ from otterwiki.renderer import (
     clean_html,
     OtterwikiRenderer,
     pygments_render,
+    highlight_cache,
+    HighlightCache,
+    RendererPool,
 )
 
 
@@ -632,6 +635,33 @@ def test_clean_html_custom_attributes():
     )  # Should be escaped because onclick is not in default attributes
 
 
+def test_html_sanitizer():
+    from otterwiki.renderer import HtmlSanitizer
+
+    sanitizer = HtmlSanitizer()
+    # single tags without attributes, accepted without parsing
+    for html in ["<br>", "<br/>", "<br />", "<kbd>", "</kbd>", "<SPAN>"]:
+        assert sanitizer.clean(html) == html
+    assert sanitizer.clean("<script>") == "&lt;script&gt;"
+    assert sanitizer.clean('<span role="note">') == '<span role="note">'
+    # every value of duplicate attributes is checked, browsers use the
+    # first one
+    assert sanitizer.clean(
+        '<a href="javascript:alert(1)" href="/ok">x</a>'
+    ).startswith("&lt;a")
+    assert sanitizer.clean('<img src="javascript:alert(1)" src>').startswith(
+        "&lt;img"
+    )
+    # the custom allowlist
+    sanitizer = HtmlSanitizer(["custom"], {"custom": ["data-x"]})
+    assert sanitizer.clean("<custom>") == "<custom>"
+    assert sanitizer.clean('<custom data-x="1" class="c">') == (
+        '<custom data-x="1" class="c">'
+    )
+    assert sanitizer.clean('<custom onclick="x">').startswith("&lt;")
+    assert HtmlSanitizer().clean("<custom>") == "&lt;custom&gt;"
+
+
 def test_clean_html_render():
     text = """Preformatted script:
 
@@ -1238,6 +1268,36 @@ def test_pygments_render_python_doublebracket():
     assert """df[['a', "b"]]""" in code
 
 
+def test_pygments_render_cache():
+    code = "import os\nprint(os.getcwd())\n"
+    hits, misses = highlight_cache.hits, highlight_cache.misses
+    html = pygments_render(code, "python")
+    assert pygments_render(code, " python ") == html
+    assert (highlight_cache.hits, highlight_cache.misses) == (
+        hits + 1,
+        misses + 1,
+    )
+    # the line numbers are part of the key
+    assert pygments_render(code, "python", linenumbers=True) != html
+    assert highlight_cache.misses == misses + 2
+    # unknown languages are not highlighted
+    html = pygments_render(code, "unknownlanguage")
+    assert "unknownlanguage\nimport os" in html
+    assert highlight_cache.misses == misses + 2
+
+
+def test_highlight_cache_size():
+    cache = HighlightCache(max_size=10)
+    for i in range(4):
+        cache.put(cache.key(str(i), "python", False), "abcd")
+    # only the most recently used entries are kept
+    assert cache.get(cache.key("0", "python", False)) is None
+    assert cache.get(cache.key("3", "python", False)) == "abcd"
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.put(cache.key("4", "python", False), "x" * 11)
+    assert cache.get(cache.key("4", "python", False)) is None
+
+
 def test_render_python_doublebracket():
     # https://github.com/redimp/otterwiki/issues/190
     md = """```python
@@ -1772,3 +1832,63 @@ def test_frontmatter_body_no_xss():
     html, _, _ = render.markdown(md)
     _assert_no_event_handlers(html)
     assert "<img" not in html
+
+
+def test_renderer_pool_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    pool = RendererPool()
+    documents = [
+        "\n".join(
+            f"# Page {i} Heading {j}\n\n[[Link {i}]] $x_{i}$\n"
+            for j in range(i % 5 + 1)
+        )
+        + ("\n```mermaid\ngraph TD;\n```\n" if i % 2 else "")
+        for i in range(20)
+    ]
+    expected = [
+        pool.markdown(md, page_url=f"/Page{i}")
+        for i, md in enumerate(documents)
+    ]
+
+    def check(i):
+        for _ in range(20):
+            result = pool.markdown(documents[i], page_url=f"/Page{i}")
+            assert result == expected[i]
+        return pool.renderer
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        renderers = list(executor.map(check, list(range(20)) * 4))
+    # every thread used its own renderer
+    assert len(set(map(id, renderers))) == 8
+    assert pool.renderer not in renderers
+    # the per-render state is not shared
+    assert [toc[0][1] for _, toc, _ in expected[:3]] == [
+        "Page 0 Heading 0",
+        "Page 1 Heading 0",
+        "Page 2 Heading 0",
+    ]
+    assert expected[1][2]["requires_mermaid"]
+    assert not expected[2][2]["requires_mermaid"]
+
+
+def test_page_description():
+    from otterwiki.renderer import page_description
+
+    md = (
+        "# Title\n\nHello *world*, a [link](/x) and [[Wiki|Page]].\n"
+        "Next line\n\n- one\n- two\n\n![image](/img.png)\n\n"
+        "<div>html <b>block</b></div>\n\n```\ncode\n```\n"
+    )
+    render.markdown(md)
+    assert render.description == (
+        "Hello world, a link and Wiki. Next line·one·two·html block·code"
+    )
+    # the description is shortened
+    render.markdown("# Title\n\n" + "word " * 200)
+    assert len(render.description) <= 254
+    assert render.description.endswith("…")
+    # only a heading the page starts with is skipped
+    _, state = render.mistune.parse("Text\n\n## Heading\n")
+    assert page_description(state.tokens) == "Text·Heading"
+    assert page_description([]) == ""
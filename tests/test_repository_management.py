@@ -46,6 +46,7 @@ class TestRepositoryManagementAccess:
         assert "Repository Management" in html
         assert "Enable Git Web server" in html
         assert "Enable pushing to SSH remote" in html
+        assert "Commit-Graph" in html
 
     def test_non_admin_access_denied(self, other_client):
         """Non-admin users get 403 when accessing repository management."""
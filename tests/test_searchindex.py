@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import os
+
+import pytest
+
+from otterwiki import gitstorage
+from otterwiki.searchindex import (
+    SearchIndex,
+    fts_query,
+    page_headers,
+    trigram_query,
+)
+
+AUTHOR = ("Example Author", "mail@example.com")
+
+
+@pytest.fixture
+def storage(tmpdir):
+    return gitstorage.GitStorage(path=str(tmpdir), initialize=True)
+
+
+def filenames(result):
+    return [filename for filename, _ in result]
+
+
+def test_fts_query():
+    assert fts_query("Needle") == '"Needle" *'
+    assert fts_query("needle 1") == '"needle 1" *'
+    assert fts_query("needle ") == '"needle"'
+    assert fts_query('say "hello_world"') == '"say hello world"'
+    assert fts_query(" .*? ") is None
+    assert page_headers("# One\ntext\n  ## Two ##\n#no heading") == "One\nTwo"
+
+
+def test_trigram_query():
+    assert trigram_query("Needle") == '"Nee" AND "eed" AND "edl" AND "dle"'
+    assert trigram_query("ab") is None
+    assert trigram_query('a"b') == '"a""b"'
+    assert trigram_query("abc", is_regexp=True) == '"abc"'
+    assert trigram_query("N[eE]+dle", is_regexp=True) == (
+        '("Edl" AND "dle") OR ("edl" AND "dle")'
+    )
+    assert trigram_query("Pea+r", is_regexp=True) == '"Pea"'
+    assert trigram_query("ab(cd)+ef", is_regexp=True) == (
+        '"abc" AND "bcd" AND "cde" AND "def"'
+    )
+    assert trigram_query("a.*bcd.*efg", is_regexp=True) == '"bcd" AND "efg"'
+    assert trigram_query("abc|xyz", is_regexp=True) == '"abc" OR "xyz"'
+    assert trigram_query("colou?r", is_regexp=True) == (
+        '("col" AND "olo" AND "lor") OR ("col" AND "olo" AND "lou" AND "our")'
+    )
+    assert trigram_query("x{3}", is_regexp=True) == '"xxx"'
+    assert trigram_query(r"\bfoo\b(?=bar)", is_regexp=True) == '"foo"'
+    # nothing is required
+    assert trigram_query("abc|x", is_regexp=True) is None
+    assert trigram_query("(abc)*", is_regexp=True) is None
+    assert trigram_query(r"\d+", is_regexp=True) is None
+    # invalid or only understood by the regex module
+    assert trigram_query("abc(", is_regexp=True) is None
+    assert trigram_query("[[:alpha:]]abc", is_regexp=True) is None
+    assert trigram_query("(?:abc){e<=1}", is_regexp=True) is None
+
+
+def test_search_index(storage):
+    storage.store(
+        "apple.md", content="# Fruit\n\nAn apple a day.", author=AUTHOR
+    )
+    storage.store(
+        "sub/pear.md", content="# Apple pie\n\nPear and apple.", author=AUTHOR
+    )
+    storage.store("notes.md", content="Nothing here. Pie?", author=AUTHOR)
+    storage.store("image.txt", content="apple", author=AUTHOR)
+    index = SearchIndex(storage)
+    assert index.update() == 3
+    assert index.update() == 0
+    # the pagename outweighs a heading, which outweighs the body
+    assert filenames(index.search("apple")) == ["apple.md", "sub/pear.md"]
+    assert filenames(index.search("APP")) == ["apple.md", "sub/pear.md"]
+    assert filenames(index.search("pie")) == ["sub/pear.md", "notes.md"]
+    assert filenames(index.search("apple pie")) == ["sub/pear.md"]
+    assert filenames(index.search("pie apple")) == []
+    # substrings are found via the trigrams
+    assert filenames(index.search("ppl")) == ["apple.md", "sub/pear.md"]
+    assert filenames(index.search("***")) == []
+    # all pages might contain a query shorter than a trigram
+    assert filenames(index.search("pi")) == [
+        "sub/pear.md",
+        "notes.md",
+        "apple.md",
+    ]
+    # regexps only narrow down the pages
+    assert filenames(index.search(r"Pea+r|h[ei]re", is_regexp=True)) == [
+        "notes.md",
+        "sub/pear.md",
+    ]
+    assert len(index.search(r"\w+", is_regexp=True)) == 3
+    assert index.search("pear")[0][1] == "# Apple pie\n\nPear and apple."
+    # changes are picked up via the hook
+    storage.store("notes.md", content="An apple.", author=AUTHOR)
+    storage.delete("apple.md", author=AUTHOR)
+    assert filenames(index.search("apple")) == ["sub/pear.md", "notes.md"]
+    assert index.count() == 2
+    # and changes made outside of otterwiki
+    with open(os.path.join(storage.path, "sub/pear.md"), "w") as f:
+        f.write("Pear only, but a longer text.")
+    storage.tree.invalidate()
+    assert filenames(index.search("apple")) == ["notes.md"]
+    # the index is shared with other processes
+    other = SearchIndex(storage)
+    assert other.update() == 0
+    assert filenames(other.search("pear")) == ["sub/pear.md"]
+    assert other.rebuild() == 2
+    index.close()
+    other.close()
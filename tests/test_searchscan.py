@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import regex
+
+from otterwiki.searchscan import Scan, read_file
+
+
+def compile(pattern, flags=regex.IGNORECASE):
+    return regex.compile("(" + pattern + ")", flags)
+
+
+def test_match_lines():
+    content = "Needle\nhay\n\nhay needle\r\nneedle\n  \n"
+    for pattern in ("needle", r"\s*needle", "^$", r"\s+", r"y\s*+$", "n?"):
+        for text in (content, content + "y", "hay\x85", "a\x0cb\n"):
+            scan = Scan(compile(pattern), compile(pattern))
+            assert scan.match_lines(text) == [
+                (i, line)
+                for i, line in enumerate(text.splitlines())
+                if scan.line_re.search(line)
+            ], (pattern, text)
+    scan = Scan(compile("needle"), compile("needle"))
+    assert scan.buffer_re is not None
+    assert scan.match_lines(content) == [
+        (0, "Needle"),
+        (3, "hay needle"),
+        (4, "needle"),
+    ]
+    # a match of the whole page must not span lines
+    scan = Scan(compile(r"hay\s+hay"), compile(r"hay\s+hay"))
+    assert scan.match_lines("hay\nhay\n") == []
+    # possessive repeats and lookarounds are matched line by line
+    assert Scan(compile(r"y\s*+$"), compile("y")).buffer_re is None
+    assert Scan(compile(r"y(?=\n)"), compile("y")).buffer_re is None
+
+
+def test_scan(tmpdir):
+    tmpdir.join("a.md").write("nothing\n")
+    tmpdir.join("b.md").write("a needle\n")
+    tmpdir.join("empty.md").write("")
+    pages = [
+        ("needle.md", "Needle", "", None),
+        ("a.md", "A", None, str(tmpdir.join("a.md"))),
+        ("b.md", "B", None, str(tmpdir.join("b.md"))),
+        ("c.md", "C", "needle\nneedle", None),
+        ("empty.md", "Empty", None, str(tmpdir.join("empty.md"))),
+        ("missing.md", "Missing", None, str(tmpdir.join("missing.md"))),
+    ]
+    scan = Scan(compile("needle"), compile("needle"))
+    assert scan.run(pages) == [
+        ("needle.md", True, []),
+        ("b.md", False, [(0, "a needle")]),
+        ("c.md", False, [(0, "needle"), (1, "needle")]),
+    ]
+    assert not scan.truncated and not scan.timed_out
+    # the scan stops after max_results pages, keeping the order
+    scan = Scan(compile("needle"), compile("needle"), max_results=2)
+    assert [fn for fn, _, _ in scan.run(pages * 100)] == ["needle.md", "b.md"]
+    assert scan.truncated
+
+
+def test_scan_time_budget():
+    pattern = compile(r"(a|aa)+b")
+    pages = [(f"{i}.md", "", "a" * 40, None) for i in range(100)]
+    scan = Scan(pattern, pattern, time_budget=0.2)
+    assert scan.run(pages) == []
+    assert scan.timed_out
+
+
+def test_read_file(tmpdir):
+    tmpdir.join("a.md").write_text("# Ötter\n", "utf-8")
+    tmpdir.join("b.md").write("")
+    assert read_file(str(tmpdir.join("a.md"))) == "# Ötter\n"
+    assert read_file(str(tmpdir.join("b.md"))) == ""
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# vim: set et ts=8 sts=4 sw=4 ai:
+
+import os
+import threading
+
+import pytest
+
+from otterwiki import gitstorage
+from otterwiki.repomgmt import RepositoryManager
+from otterwiki.writer import WriterServer
+
+AUTHOR = ("Example Author", "mail@example.com")
+
+
+@pytest.fixture
+def writer(tmpdir):
+    path = str(tmpdir.mkdir("repository"))
+    storage = gitstorage.GitStorage(path=path, initialize=True)
+    socket_path = str(tmpdir.join("writer.sock"))
+    server = WriterServer(
+        storage, socket_path, repo_manager=RepositoryManager(storage)
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield storage, socket_path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def storage(writer):
+    writer_storage, socket_path = writer
+    storage = gitstorage.GitStorage(path=writer_storage.path)
+    storage.connect_writer(socket_path)
+    return storage
+
+
+def test_store_via_writer(writer, storage):
+    writer_storage, _ = writer
+    assert storage.store("a.md", content="a", author=AUTHOR, message="add")
+    assert not storage.store("a.md", content="a", author=AUTHOR)
+    # the commit has been made by the writer process
+    assert storage.load("a.md") == "a"
+    metadata = storage.metadata("a.md")
+    assert metadata["message"] == "add"
+    assert metadata["author_name"] == AUTHOR[0]
+    assert writer_storage.metadata("a.md")["message"] == "add"
+    # binary content
+    assert storage.store("b.bin", content=b"\x00\xff", mode="wb")
+    assert storage.load("b.bin", mode="rb") == b"\x00\xff"
+    storage.rename("a.md", "c.md", author=AUTHOR, message="rename")
+    assert storage.list()[0] == ["b.bin", "c.md"]
+    storage.delete("c.md", author=AUTHOR, message="delete")
+    assert storage.list()[0] == ["b.bin"]
+    assert [m["message"] for m in storage.log()] == [
+        "delete",
+        "rename",
+        "",
+        "add",
+    ]
+    assert not storage.repo.is_dirty()
+
+
+def test_writer_errors(writer, storage):
+    assert storage.store("a.md", content="a", author=AUTHOR)
+    assert storage.store("b.md", content="b", author=AUTHOR)
+    with pytest.raises(gitstorage.StorageError):
+        storage.rename("a.md", "b.md", author=AUTHOR)
+    with pytest.raises(gitstorage.StorageNotFound):
+        storage.revert("-n", author=AUTHOR)
+    # the repository operations report their errors as result
+    manager = RepositoryManager(storage)
+    assert manager.push_to_remote("") == (False, "No remote URL provided")
+    os.unlink(storage.writer.socket_path)
+    with pytest.raises(gitstorage.StorageError):
+        storage.store("a.md", content="aa", author=AUTHOR)
+    success, output = manager.pull_from_remote("/nonexistent")
+    assert not success and "writer" in output
+
+
+def test_generation(tmpdir):
+    storage = gitstorage.GitStorage(path=str(tmpdir), initialize=True)
+    other = gitstorage.GitStorage(path=str(tmpdir))
+    assert storage.generation == 0
+    assert storage.store("a.md", content="a", author=AUTHOR)
+    generation = storage.generation
+    assert generation > 0
+    assert other.generation == generation
+    assert storage.list()[0] == ["a.md"]
+    other.delete("a.md", author=AUTHOR)
+    assert storage.generation > generation
+    # reading notices the change of the other process
+    assert len(storage.log()) == 2
+    assert storage.list()[0] == []